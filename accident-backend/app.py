@@ -1,67 +1,122 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, request, request_finished
 from flask_cors import CORS
-import pandas as pd
-import sqlite3
+from werkzeug.middleware.profiler import ProfilerMiddleware
+import os
+import time
+import db
+import sql_analytics
+from changes import get_feed, sse_stream
+from generation import current_generation
+from metrics import Registry, last_run_families, span, span_seconds, start_spans
+from response_cache import cached, make_cache
+from response_formats import (MIMETYPES, batch_response, compress_response, counts_response, json_response, negotiate,
+                              plain, serialize_counts_by_dimension)
+from rollup import (ANALYTICS_DIMENSIONS, FILTER_FIELDS, MONTH_SEASONS, SEASON_MONTHS, query_analytics,
+                    query_analytics_matrix, rollup_exists)
+from geo import GRID_ZOOM, cell_center, cell_size, cells_in_box, heatmap, points_exist
+from streets import top_streets
 
 app = Flask(__name__)
 CORS(app)
+# gzip (or brotli, if installed) for clients that accept it
+app.after_request(compress_response)
+
+# "rollup" answers from the pre-aggregated accident_rollup table, "sql" runs
+# the filters and group-bys as aggregate queries over `accidents`, "pandas"
+# recomputes from raw rows (kept as the reference implementation).
+# "snapshot" answers from the memory-mapped arrays snapshot.py writes, and
+# from the rollup while the snapshot is missing or behind the DB. "parquet"
+# answers it and /api/streets from the Parquet store parquet_store.py
+# writes (needs duckdb), with the same fallback.
+ANALYTICS_BACKEND = os.environ.get("ANALYTICS_BACKEND", "rollup")
+DB_PATH = os.environ.get("ACCIDENTS_DB", "accidents.db")
+# Most filter tuples one /api/analytics/batch request may ask for
+BATCH_LIMIT = int(os.environ.get("ANALYTICS_BATCH_LIMIT", 64))
+# Largest ?limit= for /api/streets
+STREETS_LIMIT = 100
+# Most grid cells a /api/heatmap box may span at the requested zoom
+HEATMAP_MAX_CELLS = int(os.environ.get("HEATMAP_MAX_CELLS", 65536))
+
+# The serving path answers from plain sqlite3 cursors and encodes JSON
+# directly; pandas (the reference backend), numpy (snapshot) and duckdb
+# (parquet) are imported by the functions that need them, so a worker that
+# never uses those backends starts and stays without them.
+
+# API_PROFILE_DIR=path writes a cProfile .prof file per request there
+if os.environ.get("API_PROFILE_DIR"):
+    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, profile_dir=os.environ["API_PROFILE_DIR"], restrictions=(30,))
+
+def db_generation():
+    return current_generation(db.connect(DB_PATH))
+
+# RESPONSE_CACHE=memory|disk|off; entries are dropped when the ETL bumps the
+# DB generation (see generation.py) or after RESPONSE_CACHE_TTL seconds.
+response_cache = make_cache(db_generation)
+
+# Per-route request counters for /metrics. Views mark their SQLite and
+# pandas work with span("db") / span("pandas"); whatever else a request
+# spends (encoding, compression, Flask) is the latency minus those.
+request_metrics = Registry()
+request_metrics.describe("api_requests_total", "counter", "API requests by route, status and response cache result")
+request_metrics.describe("api_request_seconds", "histogram", "API request latency in seconds")
+request_metrics.describe("api_response_bytes_total", "counter", "Response body bytes sent, after compression")
+request_metrics.describe("api_request_work_seconds_total", "counter", "Seconds spent in SQLite (db), pandas, snapshot arrays and Parquet per route")
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    start_spans()
+
+def record_request(sender, response, **extra):
+    # request_finished fires after every after_request hook, compression included
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    elapsed = time.perf_counter() - g.get("request_started", time.perf_counter())
+    request_metrics.inc("api_requests_total", {"route": route, "status": str(response.status_code),
+                                               "cache": g.get("cache_result", "none")})
+    request_metrics.observe("api_request_seconds", {"route": route}, elapsed)
+    request_metrics.inc("api_response_bytes_total", {"route": route}, response.content_length or 0)
+    for kind, seconds in span_seconds().items():
+        request_metrics.inc("api_request_work_seconds_total", {"route": route, "kind": kind}, seconds)
+
+request_finished.connect(record_request, app)
 
 def get_data(state, city):
-    conn = sqlite3.connect("accidents.db")
-    df = pd.read_sql("SELECT * FROM accidents WHERE state=? AND city=?", conn, params=(state, city))
-    conn.close()
+    import pandas as pd
+    conn = db.connect(DB_PATH)
+    with span("db"):
+        df = pd.read_sql("SELECT * FROM accidents WHERE state=? AND city=?", conn, params=(state, city))
     df['start_time'] = pd.to_datetime(df['start_time'], errors='coerce')
     df = df.dropna(subset=['start_time'])
     return df
 
-def serialize_chart(df, group_col, label_name='Accidents'):
-    chart = df[group_col].value_counts().sort_index().reset_index()
-    chart.columns = ['label', 'value']
-    return {
-        "labels": chart['label'].astype(str).tolist(),
-        "datasets": [{
-            "label": label_name,
-            "data": chart['value'].tolist(),
-            "backgroundColor": "rgba(75, 192, 192, 0.6)",
-            "borderColor": "rgba(75, 192, 192, 1)",
-            "borderWidth": 1
-        }]
-    }
+def chart_counts(df, group_col):
+    chart = df[group_col].value_counts().sort_index()
+    return list(zip(chart.index.tolist(), chart.tolist()))
 
 @app.route("/api/states")
+@cached(response_cache)
 def get_states():
-    conn = sqlite3.connect("accidents.db")
-    df = pd.read_sql("SELECT DISTINCT state FROM accidents WHERE state IS NOT NULL ORDER BY state", conn)
-    conn.close()
-    return jsonify(df['state'].dropna().unique().tolist())
+    conn = db.connect(DB_PATH)
+    with span("db"):
+        rows = conn.execute("SELECT DISTINCT state FROM accidents WHERE state IS NOT NULL ORDER BY state").fetchall()
+    return json_response([state for state, in rows])
 
 @app.route("/api/cities")
+@cached(response_cache)
 def get_cities():
     state = request.args.get("state")
-    conn = sqlite3.connect("accidents.db")
-    df = pd.read_sql("SELECT DISTINCT city FROM accidents WHERE state=? AND city IS NOT NULL ORDER BY city", conn, params=(state,))
-    conn.close()
-    return jsonify(df['city'].dropna().unique().tolist())
-
-@app.route("/api/analytics")
-def get_analytics():
-    state = request.args.get("state")
-    city = request.args.get("city")
-    year = request.args.get("year")
-    month = request.args.get("month")
-    day = request.args.get("day")
-    season = request.args.get("season")
+    conn = db.connect(DB_PATH)
+    with span("db"):
+        rows = conn.execute("SELECT DISTINCT city FROM accidents WHERE state=? AND city IS NOT NULL ORDER BY city",
+                            (state,)).fetchall()
+    return json_response([city for city, in rows])
 
+@span("pandas")
+def pandas_counts(state, city, year=None, month=None, day=None, season=None):
     df = get_data(state, city)
 
     if season:
-        season_months = {
-            'Winter': [12, 1, 2],
-            'Spring': [3, 4, 5],
-            'Summer': [6, 7, 8],
-            'Autumn': [9, 10, 11]
-        }
-        df = df[df['start_time'].dt.month.isin(season_months.get(season, []))]
+        df = df[df['start_time'].dt.month.isin(SEASON_MONTHS.get(season, []))]
     if year:
         df = df[df['start_time'].dt.year == int(year)]
     if month:
@@ -74,23 +129,251 @@ def get_analytics():
     df['day'] = df['start_time'].dt.day
     df['hour'] = df['start_time'].dt.hour
     df['weekday'] = df['start_time'].dt.day_name()
+    df['season'] = df['month'].map(MONTH_SEASONS)
+
+    return {key: chart_counts(df, col) for key, col in ANALYTICS_DIMENSIONS}
+
+@span("db")
+def rollup_counts(state, city, year=None, month=None, day=None, season=None):
+    conn = db.connect(DB_PATH)
+    if not rollup_exists(conn):
+        return None
+    return query_analytics(conn, state, city, year, month, day, season)
+
+@span("snapshot")
+def snapshot_counts(state, city, year=None, month=None, day=None, season=None):
+    from snapshot import query_snapshot, snapshot_dir
+    return query_snapshot(snapshot_dir(DB_PATH), db_generation(), state, city, year, month, day, season)
+
+@span("parquet")
+def parquet_counts(state, city, year=None, month=None, day=None, season=None):
+    import parquet_store
+    return parquet_store.query_analytics(parquet_store.parquet_dir(DB_PATH), db_generation(), state, city, year, month,
+                                         day, season)
+
+@span("db")
+def query_builder_counts(state, city, year=None, month=None, day=None, season=None):
+    return sql_analytics.query_analytics(db.connect(DB_PATH), state, city, year, month, day, season)
+
+# Chart.js payloads per backend, as /api/analytics returns them by default
+def pandas_analytics(*args, **kwargs):
+    return serialize_counts_by_dimension(pandas_counts(*args, **kwargs))
+
+def rollup_analytics(*args, **kwargs):
+    counts = rollup_counts(*args, **kwargs)
+    return None if counts is None else serialize_counts_by_dimension(counts)
+
+def query_builder_analytics(*args, **kwargs):
+    return serialize_counts_by_dimension(query_builder_counts(*args, **kwargs))
+
+def snapshot_analytics(*args, **kwargs):
+    counts = snapshot_counts(*args, **kwargs)
+    return None if counts is None else serialize_counts_by_dimension(counts)
+
+def parquet_analytics(*args, **kwargs):
+    counts = parquet_counts(*args, **kwargs)
+    return None if counts is None else serialize_counts_by_dimension(counts)
+
+def analytics_counts(state, city, year=None, month=None, day=None, season=None):
+    counts = None
+    if ANALYTICS_BACKEND == "snapshot":
+        counts = snapshot_counts(state, city, year, month, day, season)
+    elif ANALYTICS_BACKEND == "parquet":
+        counts = parquet_counts(state, city, year, month, day, season)
+    if ANALYTICS_BACKEND in ("rollup", "snapshot", "parquet") and counts is None:
+        counts = rollup_counts(state, city, year, month, day, season)
+    elif ANALYTICS_BACKEND == "sql":
+        counts = query_builder_counts(state, city, year, month, day, season)
+    if counts is None:
+        counts = pandas_counts(state, city, year, month, day, season)
+    return counts
+
+@app.route("/api/analytics")
+@cached(response_cache, vary=negotiate)
+def get_analytics():
+    state = request.args.get("state")
+    city = request.args.get("city")
+
+    response_format = negotiate()
+    if response_format is None:
+        return jsonify({"error": f"format must be one of {', '.join(MIMETYPES)}"}), 400
+    try:
+        filters = request_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return counts_response(analytics_counts(state, city, **filters), response_format)
+
+def filter_value(name, value):
+    # Calendar fields start at 1, so 0 is rejected rather than read as "no filter"
+    if name == "season":
+        return value
+    if not value.isdigit() or int(value) == 0:
+        raise ValueError(f"{name} must be a positive number, got {value!r}")
+    return int(value)
+
+def request_filters():
+    # The drill-down filters given as query parameters, validated as
+    # filter_value() does for batch filters; ValueError for a bad one
+    return {name: filter_value(name, request.args[name]) for name in FILTER_FIELDS if request.args.get(name)}
+
+def parse_filter(text):
+    # "year:2020,month:3" -> {"year": 2020, "month": 3}
+    f = {}
+    for term in text.split(","):
+        name, _, value = (part.strip() for part in term.partition(":"))
+        if name not in FILTER_FIELDS or not value:
+            raise ValueError(f"bad filter term {term!r}, expected one of {', '.join(FILTER_FIELDS)} as name:value")
+        f[name] = filter_value(name, value)
+    return f
+
+def expand_counts(state, city, expand, base):
+    # Filters and counts for every value of `expand` under the base filters.
+    # The rollup answers the whole level in one grouped read; the other
+    # backends take the values from the base counts and run one per value.
+    if ANALYTICS_BACKEND == "rollup":
+        conn = db.connect(DB_PATH)
+        if rollup_exists(conn):
+            with span("db"):
+                matrix = query_analytics_matrix(conn, state, city, expand, **base)
+            return [{**base, expand: value} for value in matrix], list(matrix.values())
+    dimension = dict((col, key) for key, col in ANALYTICS_DIMENSIONS)[expand]
+    values = [plain(label) for label, _ in analytics_counts(state, city, **base)[dimension]]
+    filters = [{**base, expand: value} for value in values]
+    return filters, [analytics_counts(state, city, **f) for f in filters]
+
+# One round trip for a whole drill-down level: ?expand=month&year=2020 gives
+# /api/analytics for each month of 2020, repeated ?filter=year:2020,month:3
+# gives it for each listed filter (merged over the base year/month/day/season).
+@app.route("/api/analytics/batch")
+@cached(response_cache, vary=negotiate)
+def get_analytics_batch():
+    state = request.args.get("state")
+    city = request.args.get("city")
+    expand = request.args.get("expand")
+
+    response_format = negotiate()
+    if response_format is None:
+        return jsonify({"error": f"format must be one of {', '.join(MIMETYPES)}"}), 400
+    try:
+        base = request_filters()
+        filters = [{**base, **parse_filter(text)} for text in request.args.getlist("filter")]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if expand:
+        if filters or expand not in FILTER_FIELDS or expand in base:
+            return jsonify({"error": f"expand must be one of {', '.join(FILTER_FIELDS)}, "
+                                     "not already filtered on and not combined with filter="}), 400
+        filters, results = expand_counts(state, city, expand, base)
+    elif 0 < len(filters) <= BATCH_LIMIT:
+        results = [analytics_counts(state, city, **f) for f in filters]
+    else:
+        return jsonify({"error": f"give expand= or between 1 and {BATCH_LIMIT} filter= parameters"}), 400
+    return batch_response(filters, results, response_format)
+
+# Top streets under the same drill-down filters as /api/analytics, as a
+# "streets" dimension in any of its formats
+@app.route("/api/streets")
+@cached(response_cache, vary=negotiate)
+def get_streets():
+    state = request.args.get("state")
+    city = request.args.get("city")
+    limit = request.args.get("limit", "10")
+
+    response_format = negotiate()
+    if response_format is None:
+        return jsonify({"error": f"format must be one of {', '.join(MIMETYPES)}"}), 400
+    if not limit.isdigit() or not 1 <= int(limit) <= STREETS_LIMIT:
+        return jsonify({"error": f"limit must be between 1 and {STREETS_LIMIT}"}), 400
+    try:
+        filters = request_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = None
+    if ANALYTICS_BACKEND == "parquet":
+        import parquet_store
+        with span("parquet"):
+            rows = parquet_store.query_top_streets(parquet_store.parquet_dir(DB_PATH), db_generation(), state, city,
+                                                   int(limit), **filters)
+    if rows is None:
+        with span("db"):
+            rows = top_streets(db.connect(DB_PATH), state, city, int(limit), **filters)
+    return counts_response({"streets": rows}, response_format)
+
+def parse_bbox(text):
+    # "west,south,east,north" in degrees, the GeoJSON / Leaflet toBBoxString() order
+    parts = [float(v) for v in text.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox needs four numbers")
+    west, south, east, north = parts
+    if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+        raise ValueError("bbox must be west,south,east,north within -180..180 and -90..90")
+    return west, south, east, north
+
+# Accident counts per grid cell inside a bounding box, e.g.
+# /api/heatmap?bbox=-97.95,30.1,-97.55,30.5&zoom=12&year=2020
+@app.route("/api/heatmap")
+@cached(response_cache)
+def get_heatmap():
+    zoom = request.args.get("zoom", "12")
+
+    try:
+        bbox = parse_bbox(request.args.get("bbox", ""))
+        filters = request_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not zoom.isdigit() or int(zoom) > GRID_ZOOM:
+        return jsonify({"error": f"zoom must be between 0 and {GRID_ZOOM}"}), 400
+    zoom = int(zoom)
+    if cells_in_box(*bbox, zoom) > HEATMAP_MAX_CELLS:
+        return jsonify({"error": f"the box spans more than {HEATMAP_MAX_CELLS} cells at zoom {zoom}; "
+                                 "zoom out or shrink it"}), 400
+
+    conn = db.connect(DB_PATH)
+    with span("db"):
+        rows = heatmap(conn, *bbox, zoom, **filters) if points_exist(conn) else []
+    centers = [cell_center(cell, zoom) for cell, _ in rows]
+    return json_response({
+        "zoom": zoom,
+        "cell_size": cell_size(zoom),
+        "cells": [cell for cell, _ in rows],
+        "lat": [lat for lat, _ in centers],
+        "lng": [lng for _, lng in centers],
+        "counts": [count for _, count in rows],
+    })
+
+# Server-sent events, one per state and city a committed sync batch touched:
+# {"id", "generation", "state", "city", "first", "last", "rows", "created_at"},
+# first/last being the range of the new rows' start_time. ?state= and ?city=
+# narrow the stream; a reconnecting EventSource resumes after Last-Event-ID.
+@app.route("/api/stream")
+def get_stream():
+    body = sse_stream(get_feed(DB_PATH), request.headers.get("Last-Event-ID"), request.args.get("state"),
+                      request.args.get("city"))
+    return Response(body, mimetype="text/event-stream", headers={"Cache-Control": "no-cache",
+                                                                "X-Accel-Buffering": "no"})
+
+@app.route("/api/cache/stats")
+def get_cache_stats():
+    return jsonify(response_cache.snapshot())
 
-    def get_season(month):
-        if month in [12, 1, 2]: return 'Winter'
-        if month in [3, 4, 5]: return 'Spring'
-        if month in [6, 7, 8]: return 'Summer'
-        return 'Autumn'
-    df['season'] = df['month'].apply(get_season)
-
-    response = {
-        "years": serialize_chart(df, 'year'),
-        "months": serialize_chart(df, 'month'),
-        "days": serialize_chart(df, 'day'),
-        "hours": serialize_chart(df, 'hour'),
-        "weekdays": serialize_chart(df, 'weekday'),
-        "seasons": serialize_chart(df, 'season')
-    }
-    return jsonify(response)
+# Prometheus scrape target: this process's request counters, the response
+# cache and the DB generation, plus each city's latest ETL run from etl_logs
+@app.route("/metrics")
+def get_metrics():
+    conn = db.connect(DB_PATH)
+    stats = response_cache.snapshot()
+    events = ("hits", "misses", "stale", "evictions", "not_modified")
+    extra = [
+        ("api_cache_events_total", "counter", "Response cache lookups and evictions in this process",
+         [({"event": event}, stats[event]) for event in events]),
+        ("api_cache_entries", "gauge", "Entries in the response cache", [({}, stats["entries"])]),
+        ("accidents_db_generation", "gauge", "DB generation counter, bumped on every committed write",
+         [({}, current_generation(conn))]),
+    ] + last_run_families(conn)
+    return Response(request_metrics.render(extra), content_type="text/plain; version=0.0.4; charset=utf-8")
 
 if __name__ == "__main__":
     app.run(debug=True)
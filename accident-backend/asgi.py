@@ -0,0 +1,206 @@
+import asyncio
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as api
+import changes
+from app import app as flask_app
+
+# ASGI serving mode for the same /api/* routes:
+#
+#     uvicorn asgi:application --host 0.0.0.0 --port 5000
+#
+# The event loop only parses requests and writes responses; each Flask view
+# (pandas and SQLite work) runs on a bounded thread pool whose threads keep
+# their pooled read-only connections warm. Requests beyond the pool plus
+# API_QUEUE waiting slots are turned away with 503 + Retry-After instead of
+# piling up behind a slow query.
+#
+# /api/stream is the exception: its server-sent events are written from the
+# event loop, which checks the process's change feed (changes.py) every
+# STREAM_POLL_SECONDS, so open streams hold no pool thread. At most
+# API_STREAMS of them are served at once.
+
+API_WORKERS = int(os.environ.get("API_WORKERS", 8))
+API_QUEUE = int(os.environ.get("API_QUEUE", 64))
+API_STREAMS = int(os.environ.get("API_STREAMS", 256))
+STREAM_PATH = "/api/stream"
+
+
+def build_environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def start_wsgi(wsgi_app, environ):
+    # Status and headers of the response, with its body iterable still unread
+    captured = {}
+
+    def start_response(status, headers, exc_info=None):
+        captured["status"] = int(status.split(" ", 1)[0])
+        captured["headers"] = headers
+
+    result = wsgi_app(environ, start_response)
+    return captured["status"], captured["headers"], result
+
+
+def read_body(result):
+    try:
+        return b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+def run_wsgi(wsgi_app, environ):
+    status, headers, result = start_wsgi(wsgi_app, environ)
+    return status, headers, read_body(result)
+
+
+class BoundedWSGI:
+    def __init__(self, wsgi_app, workers=API_WORKERS, queue=API_QUEUE):
+        self.wsgi_app = wsgi_app
+        self.workers = workers
+        self.limit = workers + queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="api")
+        self.in_flight = 0
+        self.rejected = 0
+        self.streams = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        if scope["path"] == STREAM_PATH and scope["method"] == "GET":
+            await self.stream(scope, body, receive, send)
+            return
+        # Only the event loop thread touches in_flight, so no lock is needed
+        if self.in_flight >= self.limit:
+            self.rejected += 1
+            await respond(send, 503, [("Retry-After", "1"), ("Content-Length", "0")], b"")
+            return
+        self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            status, headers, payload = await loop.run_in_executor(
+                self.executor, run_wsgi, self.wsgi_app, build_environ(scope, body))
+        finally:
+            self.in_flight -= 1
+        await respond(send, status, headers, payload)
+
+    async def stream(self, scope, body, receive, send):
+        # The events /api/stream sends under WSGI, without a thread per client.
+        # Flask still answers the request itself, so the status and headers
+        # (CORS included) and the /metrics counters are the WSGI route's; its
+        # blocking body is closed unread and the frames written from here.
+        if self.streams >= API_STREAMS:
+            self.rejected += 1
+            await respond(send, 503, [("Retry-After", "5"), ("Content-Length", "0")], b"")
+            return
+        loop = asyncio.get_running_loop()
+        status, headers, result = await loop.run_in_executor(self.executor, start_wsgi, self.wsgi_app,
+                                                             build_environ(scope, body))
+        if status != 200:
+            payload = await loop.run_in_executor(self.executor, read_body, result)
+            await respond(send, status, headers, payload)
+            return
+        if hasattr(result, "close"):
+            result.close()
+        params = {k: v[0] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        request_headers = {name.decode("latin-1").lower(): value.decode("latin-1")
+                           for name, value in scope.get("headers", [])}
+        feed = changes.get_feed(api.DB_PATH)
+        self.streams += 1
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            after = await loop.run_in_executor(self.executor, changes.stream_after, feed,
+                                               request_headers.get("last-event-id"))
+            try:
+                await send({"type": "http.response.start", "status": 200, "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]})
+                retry = int(changes.STREAM_POLL_SECONDS * 1000) + 1000
+                await send({"type": "http.response.body", "body": f"retry: {retry}\n: connected\n\n".encode(),
+                            "more_body": True})
+                started = beat = loop.time()
+                while not disconnected.done() and loop.time() - started < changes.STREAM_MAX_SECONDS:
+                    await asyncio.wait([disconnected], timeout=changes.STREAM_POLL_SECONDS)
+                    # since() reads the table for a client resuming further
+                    # back than the feed remembers
+                    events = await loop.run_in_executor(self.executor, feed.since, after)
+                    if events:
+                        after = events[-1]["id"]
+                    frames = [changes.sse_message(event) for event in events
+                              if changes.wanted(event, params.get("state"), params.get("city"))]
+                    if frames or loop.time() - beat >= changes.STREAM_HEARTBEAT_SECONDS:
+                        beat = loop.time()
+                        await send({"type": "http.response.body", "body": b"".join(frames) or b": keep-alive\n\n",
+                                    "more_body": True})
+                if not disconnected.done():
+                    await send({"type": "http.response.body", "body": b""})
+            finally:
+                feed.unsubscribe()
+        finally:
+            disconnected.cancel()
+            self.streams -= 1
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=True)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+async def respond(send, status, headers, body):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+application = BoundedWSGI(flask_app)
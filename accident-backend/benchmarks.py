@@ -0,0 +1,657 @@
+import argparse
+import functools
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import csv_ingest
+import db
+import etl
+import response_formats
+from migrate import apply_migrations
+from geo import rebuild_points
+from rollup import ensure_rollup, query_analytics, rebuild_rollup
+from streets import rebuild_streets
+from synthetic import FIXTURE_CITIES, generate_accidents, generate_socrata_records, write_fixture_db
+from writer import write_accidents
+
+# Offline benchmarks over synthetic data. Each one prints a small table.
+
+
+def legacy_insert(conn, df, city):
+    # The pre-UPSERT path the sync scripts used: re-read every id for the city
+    existing_ids = pd.read_sql("SELECT DISTINCT id FROM accidents WHERE city=?", conn, params=(city,))['id'].tolist()
+    new_df = df[~df['id'].isin(existing_ids)]
+    if len(new_df) > 0:
+        new_df.to_sql("accidents", conn, if_exists='append', index=False)
+    conn.commit()
+    return len(new_df)
+
+
+def ingest_batch(df, size, offset, seed):
+    # Half already-stored rows, half new ones, all for the busiest city
+    city_rows = df[df['city'] == 'Austin']
+    stored = city_rows.head(size // 2)
+    fresh = generate_accidents(size * 4, seed=seed)
+    fresh = fresh[fresh['city'] == 'Austin'].head(size - len(stored)).copy()
+    fresh['id'] = [f"new-{offset}-{i}" for i in range(len(fresh))]
+    return pd.concat([stored, fresh], ignore_index=True)
+
+
+def bench_ingest(sizes, batch_size):
+    print(f"{'table rows':>12}{'legacy ms':>12}{'upsert ms':>12}{'inserted':>10}{'skipped':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        # Keep fsync noise out of the comparison; both paths commit the same way
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        apply_migrations(conn, log=lambda message: None)
+        ensure_rollup(conn)
+        loaded = 0
+        seed = 1
+        base = generate_accidents(0)
+        for size in sizes:
+            while loaded < size:
+                chunk = generate_accidents(min(200_000, size - loaded), seed=seed)
+                chunk['id'] = [f"bulk-{seed}-{i}" for i in range(len(chunk))]
+                write_accidents(conn, chunk)
+                conn.commit()
+                base = chunk if base.empty else base
+                loaded += len(chunk)
+                seed += 1
+
+            batch = ingest_batch(base, batch_size, size, seed)
+            started = time.perf_counter()
+            legacy_insert(conn, batch.copy(), 'Austin')
+            legacy_ms = (time.perf_counter() - started) * 1000
+            conn.execute("DELETE FROM accidents WHERE id LIKE 'new-%'")
+            conn.commit()
+
+            started = time.perf_counter()
+            inserted, skipped = write_accidents(conn, batch)
+            conn.commit()
+            upsert_ms = (time.perf_counter() - started) * 1000
+            print(f"{loaded:>12}{legacy_ms:>12.1f}{upsert_ms:>12.1f}{inserted:>10}{skipped:>10}")
+        conn.close()
+
+
+def legacy_normalise(records, source, since):
+    # Per-batch mapping and clean-up the sync scripts did before etl.py
+    df = pd.DataFrame(records)
+    if source.date_field in df.columns:
+        df['start_time'] = df[source.date_field]
+    if source.id_field in df.columns:
+        df['id'] = df[source.id_field]
+    if 'latitude' in df.columns:
+        df['start_lat'] = df['latitude']
+    if 'longitude' in df.columns:
+        df['start_lng'] = df['longitude']
+    if 'location' in df.columns and isinstance(df['location'].iloc[0], dict):
+        df['start_lat'] = df['location'].apply(lambda x: x.get('lat') if isinstance(x, dict) else None)
+        df['start_lng'] = df['location'].apply(lambda x: x.get('lon') if isinstance(x, dict) else None)
+    if 'street_name' in df.columns:
+        df['street'] = df['street_name']
+    elif 'on_street_name' in df.columns:
+        df['street'] = df['on_street_name']
+    df['city'] = source.city
+    df['state'] = source.state
+    df['country'] = 'US'
+    df['end_time'] = df.get('start_time', pd.NaT)
+    df['end_lat'] = df.get('start_lat', pd.NA)
+    df['end_lng'] = df.get('start_lng', pd.NA)
+    df['distance(mi)'] = 0.1
+    df['timezone'] = 'US/Eastern'
+    df['description'] = 'Auto-Crash'
+    df['severity'] = 2
+    df['start_time'] = pd.to_datetime(df['start_time'], errors='coerce')
+    df['end_time'] = pd.to_datetime(df['end_time'], errors='coerce')
+    df = df[df['start_time'] >= pd.Timestamp(since)]
+    df = df[etl.INSERT_COLUMNS].dropna(subset=['id', 'start_time'])
+    return df.loc[:, ~df.columns.duplicated()]
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_normalise(sizes, repeat):
+    print(f"{'source':<10}{'rows':>9}{'legacy ms':>12}{'etl ms':>10}{'legacy MB':>11}{'etl MB':>9}")
+    for name in ("New York", "Chicago"):
+        source = etl.SOURCES[name]
+        for size in sizes:
+            records = generate_socrata_records(source, size)
+            ctx = etl.RunContext(None, source, "2025-01-01")
+            legacy_s, legacy_df = best_of(lambda: legacy_normalise(records, source, ctx.since), repeat)
+            etl_s, etl_df = best_of(lambda: etl.normalise(ctx, records), repeat)
+            legacy_mb = legacy_df.memory_usage(deep=True).sum() / 1e6
+            etl_mb = etl_df.memory_usage(deep=True).sum() / 1e6
+            print(f"{name:<10}{size:>9}{legacy_s * 1000:>12.1f}{etl_s * 1000:>10.1f}{legacy_mb:>11.1f}{etl_mb:>9.1f}")
+
+
+def write_synthetic_csv(path, target_mb, chunk_rows=200_000):
+    # Appends seeded chunks until the file reaches target_mb; never holds
+    # more than one chunk in memory.
+    rows = 0
+    seed = 0
+    while not os.path.exists(path) or os.path.getsize(path) < target_mb * 1024 * 1024:
+        chunk = generate_accidents(chunk_rows, seed=seed)
+        chunk['id'] = [f"csv-{seed}-{i}" for i in range(len(chunk))]
+        chunk.to_csv(path, mode='a', header=seed == 0, index=False)
+        rows += len(chunk)
+        seed += 1
+    return rows
+
+
+def legacy_load(path, db, chunksize):
+    # What load_to_db.py did before streaming: read the whole file, then
+    # read it again in chunks for to_sql. The rollups, street ids and point
+    # index the other loaders maintain are rebuilt afterwards, so every
+    # loader ends with the same tables and indexes.
+    df = pd.read_csv(path)
+    conn = sqlite3.connect(db)
+    apply_migrations(conn, log=lambda message: None)
+    total = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize):
+        chunk.to_sql('accidents', conn, if_exists='append', index=False)
+        total += len(chunk)
+    conn.commit()
+    rebuild_rollup(conn)
+    rebuild_streets(conn, log=lambda message: None)
+    rebuild_points(conn, log=lambda message: None)
+    conn.close()
+    return min(total, len(df))
+
+
+def streaming_load(path, db, batch_size):
+    return csv_ingest.load_csv(path, db, batch_size, log=lambda message: None).inserted
+
+
+def measure_load(loader, path, db, batch_size, results):
+    started = time.perf_counter()
+    rows = loader(path, db, batch_size)
+    results.put((rows, time.perf_counter() - started, csv_ingest.peak_rss_mb()))
+
+
+def bulk_load(path, db, batch_size):
+    return csv_ingest.bulk_load(path, db, batch_size, log=lambda message: None)
+
+
+def parallel_bulk_load(path, db, batch_size, workers):
+    return csv_ingest.parallel_load(path, db, batch_size, workers, log=lambda message: None)
+
+
+def run_loaders(path, runs, tmp):
+    # Each loader runs in a fresh spawned interpreter so its peak RSS is its
+    # own; yields (name, batch_size, rows, seconds, peak_mb).
+    ctx = multiprocessing.get_context("spawn")
+    for i, (name, loader, batch_size) in enumerate(runs):
+        results = ctx.Queue()
+        proc = ctx.Process(target=measure_load, args=(loader, path, os.path.join(tmp, f"load-{i}.db"),
+                                                      batch_size, results))
+        proc.start()
+        loaded, seconds, peak = results.get()
+        proc.join()
+        yield name, batch_size, loaded, seconds, peak
+
+
+def bench_stream(size_mb, batch_sizes, max_rss_mb, legacy):
+    over = False
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "crashes.csv")
+        rows = write_synthetic_csv(path, size_mb)
+        print(f"📄 {os.path.getsize(path) / 1e6:.0f} MB synthetic CSV, {rows} rows")
+        runs = [("streaming", streaming_load, b) for b in batch_sizes]
+        if legacy:
+            runs.append(("legacy", legacy_load, 100_000))
+        print(f"{'loader':<12}{'batch':>9}{'rows':>11}{'seconds':>10}{'rows/s':>10}{'peak MB':>10}")
+        for name, batch_size, loaded, seconds, peak in run_loaders(path, runs, tmp):
+            flag = ""
+            if name == "streaming" and peak > max_rss_mb:
+                flag = f"  ❌ over {max_rss_mb} MB"
+                over = True
+            print(f"{name:<12}{batch_size:>9}{loaded:>11}{seconds:>10.1f}{loaded / seconds:>10.0f}{peak:>10.0f}{flag}")
+    return not over
+
+
+def bench_bulk(size_mb, batch_size, workers):
+    # The old load_to_db.py, the streaming loader, --bulk and --workers N
+    # for each N on the same seeded CSV, each ending with the accidents
+    # indexes, rollups, street ids and point index in place
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "crashes.csv")
+        rows = write_synthetic_csv(path, size_mb)
+        print(f"📄 {os.path.getsize(path) / 1e6:.0f} MB synthetic CSV, {rows} rows, {os.cpu_count()} CPUs")
+        runs = [("legacy", legacy_load, 100_000), ("streaming", streaming_load, 100_000),
+                ("bulk", bulk_load, batch_size)]
+        runs += [(f"workers={n}", functools.partial(parallel_bulk_load, workers=n), 100_000) for n in workers]
+        print(f"{'loader':<12}{'batch':>9}{'rows':>11}{'seconds':>10}{'rows/s':>10}{'peak MB':>10}")
+        for name, batch, loaded, seconds, peak in run_loaders(path, runs, tmp):
+            print(f"{name:<12}{batch:>9}{loaded:>11}{seconds:>10.1f}{loaded / seconds:>10.0f}{peak:>10.0f}")
+
+
+def legacy_read(path, state, city):
+    # What every route did before db.py: a fresh read-write connection per request
+    conn = sqlite3.connect(path)
+    try:
+        return query_analytics(conn, state, city)
+    finally:
+        conn.close()
+
+
+def pooled_read(path, state, city):
+    return query_analytics(db.connect(path), state, city)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else float("nan")
+
+
+def contend(path, read, writer_connect, readers, seconds, batch_size):
+    # One thread ingests batches as fast as it can while `readers` threads
+    # issue rollup queries; returns read latencies, read errors and rows written.
+    stop = threading.Event()
+    latencies = []
+    errors = []
+    written = [0]
+
+    def writer():
+        conn = writer_connect(path)
+        seed = 100
+        while not stop.is_set():
+            batch = generate_accidents(batch_size, seed=seed)
+            batch['id'] = [f"w-{seed}-{i}" for i in range(len(batch))]
+            try:
+                written[0] += write_accidents(conn, batch)[0]
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                conn.rollback()
+                errors.append(f"write: {e}")
+            seed += 1
+        conn.close()
+
+    def reader(n):
+        state, city = FIXTURE_CITIES[n % len(FIXTURE_CITIES)]
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                read(path, state, city)
+                latencies.append(time.perf_counter() - started)
+            except sqlite3.OperationalError as e:
+                errors.append(f"read: {e}")
+
+    threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader, args=(n,)) for n in range(readers)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    db.close_pool()
+    return latencies, errors, written[0]
+
+
+def bench_readers(rows, readers, seconds, batch_size):
+    print(f"{'mode':<22}{'reads':>8}{'p50 ms':>9}{'p99 ms':>9}{'errors':>8}{'rows written':>14}")
+    modes = [
+        ("connect per request", legacy_read, sqlite3.connect, "delete"),
+        ("pooled ro + WAL", pooled_read, db.write_connection, "wal"),
+    ]
+    for name, read, writer_connect, journal in modes:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "accidents.db")
+            write_fixture_db(path, rows, seed=0)
+            conn = sqlite3.connect(path)
+            conn.execute(f"PRAGMA journal_mode={journal}")
+            ensure_rollup(conn)
+            conn.commit()
+            conn.close()
+            latencies, errors, written = contend(path, read, writer_connect, readers, seconds, batch_size)
+            print(f"{name:<22}{len(latencies):>8}{percentile(latencies, 0.5) * 1000:>9.2f}"
+                  f"{percentile(latencies, 0.99) * 1000:>9.2f}{len(errors):>8}{written:>14}")
+            for message in sorted(set(errors))[:3]:
+                print(f"   ⚠️ {message}")
+
+
+def bench_formats(rows, repeat):
+    # Payload size and encode time per /api/analytics format for the biggest
+    # fixture city, city-level and drilled into one year.
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "accidents.db")
+        write_fixture_db(path, rows, seed=0)
+        conn = sqlite3.connect(path)
+        ensure_rollup(conn)
+        state, city, year = conn.execute(
+            "SELECT state, city, MAX(year) FROM accident_rollup GROUP BY state, city ORDER BY SUM(accidents) DESC").fetchone()
+        cases = {f"{city}": query_analytics(conn, state, city), f"{city} {year}": query_analytics(conn, state, city, year)}
+        conn.close()
+
+    brotli = response_formats.brotli_module()
+    print(f"{'payload':<16}{'format':<9}{'bytes':>8}{'gzip':>8}{'brotli':>8}{'encode us':>11}")
+    for name, counts in cases.items():
+        for fmt in response_formats.MIMETYPES:
+            try:
+                encode_s, body = best_of(lambda: response_formats.encode(counts, fmt), repeat)
+            except response_formats.FormatUnavailable:
+                print(f"{name:<16}{fmt:<9}{'(not installed)':>35}")
+                continue
+            gzip_bytes = len(response_formats.compress(body, "gzip")[0])
+            brotli_bytes = str(len(brotli.compress(body, quality=5))) if brotli else "-"
+            print(f"{name:<16}{fmt:<9}{len(body):>8}{gzip_bytes:>8}{brotli_bytes:>8}{encode_s * 1e6:>11.1f}")
+
+
+def bench_batch(rows, repeat):
+    # Prefetching a whole drill-down level: one /api/analytics call per value
+    # against one /api/analytics/batch call, through Flask's test client with
+    # the response cache off, for the biggest fixture city.
+    import app
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "accidents.db")
+        write_fixture_db(path, rows, seed=0)
+        conn = sqlite3.connect(path)
+        ensure_rollup(conn)
+        state, city, year = conn.execute(
+            "SELECT state, city, MAX(year) FROM accident_rollup GROUP BY state, city ORDER BY SUM(accidents) DESC").fetchone()
+        conn.close()
+        app.DB_PATH = path
+        app.response_cache.backend = None
+        client = app.app.test_client()
+        base = {"state": state, "city": city, "format": "compact"}
+        levels = [("year", {}), ("season", {}), ("month", {"year": year}), ("day", {"year": year, "month": 6})]
+
+        print(f"{'expand':<8}{'base':<22}{'calls':>6}{'single ms':>11}{'batch ms':>10}{'speedup':>9}")
+        for expand, filters in levels:
+            batch_query = {**base, **filters, "expand": expand}
+            values = [f[expand] for f in client.get("/api/analytics/batch", query_string=batch_query).get_json()["filters"]]
+
+            def singles():
+                for value in values:
+                    client.get("/api/analytics", query_string={**base, **filters, expand: value})
+
+            single_s, _ = best_of(singles, repeat)
+            batch_s, _ = best_of(lambda: client.get("/api/analytics/batch", query_string=batch_query), repeat)
+            print(f"{expand:<8}{str(filters or '-'):<22}{len(values):>6}{single_s * 1000:>11.2f}"
+                  f"{batch_s * 1000:>10.2f}{single_s / batch_s:>8.1f}x")
+
+
+def bench_streets(rows, streets, repeat):
+    # Top-10 streets for the biggest fixture city: pandas value_counts over
+    # the raw text (the old Streamlit path) against streets.top_streets() on
+    # the street index, at each drill-down level. Street names are drawn from
+    # `streets` roots, each in a few spellings.
+    from streets import rebuild_streets, top_streets
+    rng = np.random.default_rng(0)
+    suffixes = [("ST", "Street"), ("AVE", "Avenue"), ("RD", "Road"), ("BLVD", "Boulevard")]
+    names = []
+    for i in range(streets):
+        short, long = suffixes[i % len(suffixes)]
+        names += [f"{i + 1} {short}", f"{i + 1} {long}", f"{i + 1} {long.lower()}."]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "accidents.db")
+        df = generate_accidents(rows, seed=0)
+        # Zipf-like, so a few streets dominate as in the real data
+        df["street"] = np.array(names)[np.minimum(rng.zipf(1.3, size=rows), len(names)) - 1]
+        conn = sqlite3.connect(path)
+        apply_migrations(conn, log=lambda message: None)
+        df.to_sql("accidents", conn, if_exists="append", index=False)
+        started = time.perf_counter()
+        rebuild_streets(conn, log=lambda message: None)
+        print(f"🛣️ Street index for {rows} rows built in {time.perf_counter() - started:.2f}s, "
+              f"{conn.execute('SELECT COUNT(*) FROM streets').fetchone()[0]} streets from "
+              f"{conn.execute('SELECT COUNT(*) FROM street_aliases').fetchone()[0]} spellings")
+        state, city, year = conn.execute(
+            "SELECT state, city, MAX(year) FROM accidents GROUP BY state, city ORDER BY COUNT(*) DESC").fetchone()
+        conn.close()
+        conn = db.connect(path)
+
+        def legacy(**filters):
+            city_data = pd.read_sql("SELECT start_time, street FROM accidents WHERE state = ? AND city = ?", conn,
+                                    params=(state, city), parse_dates=["start_time"])
+            for col, value in filters.items():
+                city_data = city_data[getattr(city_data["start_time"].dt, col) == value]
+            return city_data["street"].value_counts().head(10)
+
+        levels = [("city", {}), ("year", {"year": year}), ("month", {"year": year, "month": 6}),
+                  ("day", {"year": year, "month": 6, "day": 15})]
+        print(f"{'filter':<8}{'value_counts ms':>17}{'top_streets ms':>16}")
+        for name, filters in levels:
+            legacy_s, _ = best_of(lambda: legacy(**filters), repeat)
+            index_s, _ = best_of(lambda: top_streets(conn, state, city, 10, **filters), repeat)
+            print(f"{name:<8}{legacy_s * 1000:>17.2f}{index_s * 1000:>16.3f}")
+        db.close_pool()
+
+
+def bench_heatmap(rows, repeat):
+    # /api/heatmap's query against reading the points into pandas and
+    # binning them there, for boxes from a whole metro area down to a few
+    # blocks around its centre. Points cluster around the fixture cities.
+    from geo import GRID_ZOOM, heatmap, rebuild_points
+    centres = {"Austin": (30.27, -97.74), "Houston": (29.76, -95.37), "New York": (40.71, -74.01),
+               "Montgomery": (39.15, -77.2), "Chicago": (41.88, -87.63)}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "accidents.db")
+        df = generate_accidents(rows, seed=0)
+        rng = np.random.default_rng(0)
+        df["start_lat"] = [centres[c][0] for c in df["city"]] + rng.normal(0, 0.15, rows)
+        df["start_lng"] = [centres[c][1] for c in df["city"]] + rng.normal(0, 0.15, rows)
+        conn = sqlite3.connect(path)
+        apply_migrations(conn, log=lambda message: None)
+        df.to_sql("accidents", conn, if_exists="append", index=False)
+        started = time.perf_counter()
+        indexed = rebuild_points(conn, log=lambda message: None)
+        print(f"🗺️ {indexed} points indexed in {time.perf_counter() - started:.2f}s")
+        conn.close()
+        conn = db.connect(path)
+        lat, lng = centres["Austin"]
+
+        def pandas_heatmap(west, south, east, north, zoom, year=None):
+            points = pd.read_sql("SELECT start_lat, start_lng, year FROM accidents", conn)
+            points = points[points["start_lng"].between(west, east) & points["start_lat"].between(south, north)]
+            if year:
+                points = points[points["year"] == year]
+            y = ((points["start_lat"] + 90) * (1 << zoom) / 180).astype("int64")
+            x = ((points["start_lng"] + 180) * (1 << zoom) / 360).astype("int64")
+            return (y * (1 << zoom) + x).value_counts()
+
+        cases = [("metro", 0.5, 11, None), ("metro 2020", 0.5, 11, 2020), ("district", 0.05, 14, None),
+                 ("blocks", 0.005, GRID_ZOOM, None)]
+        print(f"{'box':<12}{'points':>9}{'cells':>7}{'pandas ms':>11}{'rtree ms':>10}")
+        for name, half, zoom, year in cases:
+            box = (lng - half, lat - half, lng + half, lat + half)
+            cells = heatmap(conn, *box, zoom, year)
+            pandas_s, _ = best_of(lambda: pandas_heatmap(*box, zoom, year), repeat)
+            rtree_s, _ = best_of(lambda: heatmap(conn, *box, zoom, year), repeat)
+            print(f"{name:<12}{sum(n for _, n in cells):>9}{len(cells):>7}{pandas_s * 1000:>11.1f}{rtree_s * 1000:>10.2f}")
+        db.close_pool()
+
+
+def bench_parquet(rows, db_path, repeat):
+    # Size on disk and query latency, SQLite (rollup and aggregate SQL) against
+    # the Parquet store, for the busiest city at each drill-down level. With
+    # --db the comparison runs on that database (e.g. the full national
+    # load) instead of a synthetic one; its store is built if missing.
+    import parquet_store
+    import sql_analytics
+    from generation import current_generation
+    from streets import top_streets
+    from synthetic import write_scaled_db
+    with tempfile.TemporaryDirectory() as tmp:
+        if not db_path:
+            db_path = os.path.join(tmp, "accidents.db")
+            write_scaled_db(db_path, rows, log=lambda message: None)
+        store = parquet_store.parquet_dir(db_path)
+        conn = sqlite3.connect(db_path)
+        started = time.perf_counter()
+        parquet_store.export_parquet(conn, store, log=lambda message: None)
+        export_s = time.perf_counter() - started
+        conn.close()
+        conn = db.connect(db_path)
+        sqlite_mb, parquet_mb = os.path.getsize(db_path) / 1e6, parquet_store.store_bytes(store) / 1e6
+        total = conn.execute("SELECT COUNT(*) FROM accidents").fetchone()[0]
+        print(f"🧱 {total} rows: SQLite {sqlite_mb:.1f} MB, Parquet {parquet_mb:.1f} MB "
+              f"({sqlite_mb / parquet_mb:.1f}x smaller), store updated in {export_s:.1f}s")
+        state, city, year = conn.execute(
+            "SELECT state, city, MAX(year) FROM accidents GROUP BY state, city ORDER BY COUNT(*) DESC").fetchone()
+        generation = current_generation(conn)
+        levels = [("city", {}), ("year", {"year": year}), ("month", {"year": year, "month": 6}),
+                  ("day", {"year": year, "month": 6, "day": 15}), ("season", {"season": "Winter"})]
+        print(f"{'filter':<8}{'sql ms':>10}{'rollup ms':>11}{'parquet ms':>12}{'streets ms':>12}{'pq streets ms':>15}")
+        for name, filters in levels:
+            sql_s, _ = best_of(lambda: sql_analytics.query_analytics(conn, state, city, **filters), repeat)
+            rollup_s, _ = best_of(lambda: query_analytics(conn, state, city, **filters), repeat)
+            parquet_s, _ = best_of(lambda: parquet_store.query_analytics(store, generation, state, city, **filters),
+                                   repeat)
+            streets_s, _ = best_of(lambda: top_streets(conn, state, city, 10, **filters), repeat)
+            pq_streets_s, _ = best_of(lambda: parquet_store.query_top_streets(store, generation, state, city, 10,
+                                                                              **filters), repeat)
+            print(f"{name:<8}{sql_s * 1000:>10.1f}{rollup_s * 1000:>11.2f}{parquet_s * 1000:>12.2f}"
+                  f"{streets_s * 1000:>12.2f}{pq_streets_s * 1000:>15.2f}")
+        db.close_pool()
+
+
+# Run in a fresh interpreter per measurement: import the API, then serve
+# the list, analytics and streets routes once each, as a new worker would.
+# Peak RSS comes from /proc, so this runs on Linux.
+STARTUP_CHILD = """
+import json, sys, time
+
+def peak_rss_kb():
+    # VmHWM rather than ru_maxrss, which keeps the parent's peak across fork + exec
+    with open("/proc/self/status") as f:
+        return next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+
+started = time.perf_counter()
+if {eager}:
+    import pandas
+import app
+imported = time.perf_counter() - started
+rss_import = peak_rss_kb()
+client = app.app.test_client()
+for url in {urls!r}:
+    assert client.get(url).status_code == 200, url
+print(json.dumps({{"import_s": imported, "first_s": time.perf_counter() - started - imported,
+                  "rss_import_kb": rss_import, "rss_kb": peak_rss_kb(),
+                  "pandas": "pandas" in sys.modules, "numpy": "numpy" in sys.modules}}))
+"""
+
+
+def bench_startup(rows, repeat):
+    # Worker cold start and peak RSS of the lazy-import serving path against
+    # the same worker with pandas loaded up front, as app.py used to. Fails
+    # if serving the /api/* routes on the rollup backend pulls in pandas.
+    import json
+    import subprocess
+    from urllib.parse import urlencode
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "accidents.db")
+        write_fixture_db(path, rows, seed=0)
+        conn = sqlite3.connect(path)
+        ensure_rollup(conn)
+        conn.commit()
+        state, city = conn.execute("SELECT state, city FROM accidents GROUP BY 1, 2 ORDER BY COUNT(*) DESC").fetchone()
+        conn.close()
+        query = urlencode({"state": state, "city": city})
+        urls = ["/api/states", f"/api/cities?state={state}", f"/api/analytics?{query}",
+                f"/api/analytics?{query}&format=compact", f"/api/streets?{query}"]
+        env = {**os.environ, "ACCIDENTS_DB": path, "ANALYTICS_BACKEND": "rollup", "RESPONSE_CACHE": "off"}
+        here = os.path.dirname(os.path.abspath(__file__))
+        print(f"{'worker':<8}{'import ms':>11}{'requests ms':>13}{'RSS import MB':>15}{'RSS MB':>8}  modules")
+        leaked = False
+        for name, eager in (("lazy", False), ("eager", True)):
+            runs = []
+            for _ in range(repeat):
+                out = subprocess.run([sys.executable, "-c", STARTUP_CHILD.format(eager=eager, urls=urls)], env=env,
+                                     cwd=here, capture_output=True, text=True, check=True)
+                runs.append(json.loads(out.stdout.strip().splitlines()[-1]))
+            best = min(runs, key=lambda run: run["import_s"])
+            modules = ", ".join(m for m in ("pandas", "numpy") if best[m]) or "-"
+            print(f"{name:<8}{best['import_s'] * 1000:>11.0f}{best['first_s'] * 1000:>13.1f}"
+                  f"{best['rss_import_kb'] / 1024:>15.1f}{best['rss_kb'] / 1024:>8.1f}  {modules}")
+            if not eager and any(run["pandas"] for run in runs):
+                print("❌ the serving path imported pandas")
+                leaked = True
+    return not leaked
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline performance benchmarks")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+    ingest = sub.add_parser("ingest", help="per-batch ingest time as the accidents table grows")
+    ingest.add_argument("--sizes", default="0,250000,1000000,2000000")
+    ingest.add_argument("--batch-size", type=int, default=1000)
+    normalise = sub.add_parser("normalise", help="Socrata batch normalisation, legacy mapping vs etl.normalise")
+    normalise.add_argument("--sizes", default="1000,100000")
+    normalise.add_argument("--repeat", type=int, default=3)
+    stream = sub.add_parser("stream", help="peak RSS of the streaming CSV loader on a large synthetic file")
+    stream.add_argument("--size-mb", type=int, default=2048)
+    stream.add_argument("--batch-sizes", default="10000,100000")
+    stream.add_argument("--max-rss-mb", type=int, default=512, help="fail if the streaming loader goes above this")
+    stream.add_argument("--legacy", action="store_true", help="also run the old read-everything loader")
+    bulk = sub.add_parser("bulk", help="rows/s of csv_ingest --bulk against the old and streaming loaders")
+    bulk.add_argument("--size-mb", type=int, default=200)
+    bulk.add_argument("--batch-size", type=int, default=200_000)
+    bulk.add_argument("--workers", default="2,4", help="process counts to run the parallel --workers load with")
+    readers = sub.add_parser("readers", help="read latency while a writer ingests, per-request vs pooled WAL")
+    readers.add_argument("--rows", type=int, default=200_000)
+    readers.add_argument("--readers", type=int, default=8)
+    readers.add_argument("--seconds", type=float, default=10)
+    readers.add_argument("--batch-size", type=int, default=5000)
+    formats = sub.add_parser("formats", help="/api/analytics payload size and encode time per response format")
+    formats.add_argument("--rows", type=int, default=500_000)
+    formats.add_argument("--repeat", type=int, default=200)
+    batch = sub.add_parser("batch", help="a drill-down level as N /api/analytics calls vs one /api/analytics/batch")
+    batch.add_argument("--rows", type=int, default=500_000)
+    batch.add_argument("--repeat", type=int, default=5)
+    streets = sub.add_parser("streets", help="top-10 streets, raw text value_counts vs the street index")
+    streets.add_argument("--rows", type=int, default=500_000)
+    streets.add_argument("--streets", type=int, default=5000, help="distinct street names before respelling")
+    streets.add_argument("--repeat", type=int, default=5)
+    heat = sub.add_parser("heatmap", help="bounding-box heatmap, pandas binning vs the accident_points R*Tree")
+    heat.add_argument("--rows", type=int, default=1_000_000)
+    heat.add_argument("--repeat", type=int, default=3)
+    parquet = sub.add_parser("parquet", help="size on disk and query latency, SQLite vs the Parquet store")
+    parquet.add_argument("--rows", type=int, default=1_000_000)
+    parquet.add_argument("--db", help="compare on this database instead of synthetic rows")
+    parquet.add_argument("--repeat", type=int, default=5)
+    startup = sub.add_parser("startup", help="API worker import time and RSS, lazy imports vs pandas up front")
+    startup.add_argument("--rows", type=int, default=20_000)
+    startup.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.benchmark == "ingest":
+        bench_ingest([int(s) for s in args.sizes.split(",")], args.batch_size)
+    elif args.benchmark == "normalise":
+        bench_normalise([int(s) for s in args.sizes.split(",")], args.repeat)
+    elif args.benchmark == "stream":
+        if not bench_stream(args.size_mb, [int(s) for s in args.batch_sizes.split(",")], args.max_rss_mb, args.legacy):
+            sys.exit(1)
+    elif args.benchmark == "bulk":
+        bench_bulk(args.size_mb, args.batch_size, [int(n) for n in args.workers.split(",") if n])
+    elif args.benchmark == "readers":
+        bench_readers(args.rows, args.readers, args.seconds, args.batch_size)
+    elif args.benchmark == "formats":
+        bench_formats(args.rows, args.repeat)
+    elif args.benchmark == "batch":
+        bench_batch(args.rows, args.repeat)
+    elif args.benchmark == "streets":
+        bench_streets(args.rows, args.streets, args.repeat)
+    elif args.benchmark == "heatmap":
+        bench_heatmap(args.rows, args.repeat)
+    elif args.benchmark == "parquet":
+        bench_parquet(args.rows, args.db, args.repeat)
+    elif args.benchmark == "startup":
+        if not bench_startup(args.rows, args.repeat):
+            sys.exit(1)
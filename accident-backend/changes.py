@@ -0,0 +1,185 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import db
+from generation import current_generation
+
+# Change events for live dashboards. write_accidents() records one row per
+# state and city a batch inserted into, with the start_time range it
+# covered, inside the writer's transaction; readers see an event exactly
+# when its rows are committed. /api/stream pushes them to the dashboard as
+# server-sent events, resuming after Last-Event-ID.
+#
+# Each API process runs one ChangeFeed per database while it has
+# subscribers: a thread that polls the table every STREAM_POLL_SECONDS and
+# wakes every open stream, so the DB sees one indexed read per interval no
+# matter how many dashboards are connected.
+change_table = "change_events"
+# Events kept in the table; a client further behind than this reloads
+CHANGE_EVENTS_KEEP = 10_000
+STREAM_POLL_SECONDS = float(os.environ.get("STREAM_POLL_SECONDS", 1))
+# Comment lines that keep proxies from closing an idle stream
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get("STREAM_HEARTBEAT_SECONDS", 15))
+# A stream ends after this long and the browser reconnects with Last-Event-ID,
+# so no connection holds a server thread indefinitely
+STREAM_MAX_SECONDS = float(os.environ.get("STREAM_MAX_SECONDS", 300))
+FEED_EVENTS = 1000
+
+CHANGE_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {change_table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    generation INTEGER NOT NULL,
+    state TEXT,
+    city TEXT,
+    first_time TEXT,
+    last_time TEXT,
+    rows INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+)
+"""
+EVENT_FIELDS = ("id", "generation", "state", "city", "first", "last", "rows", "created_at")
+
+
+def record_changes(conn, source):
+    # One event per state and city among the rows staged in `source`
+    # (exactly the ones just inserted); runs in the caller's transaction.
+    conn.execute(CHANGE_SCHEMA)
+    cur = conn.execute(f"""
+        INSERT INTO {change_table} (generation, state, city, first_time, last_time, rows, created_at)
+        SELECT ?, state, city, MIN(start_time), MAX(start_time), COUNT(*), ? FROM {source}
+        GROUP BY state, city
+    """, (current_generation(conn), datetime.now().isoformat(timespec="seconds")))
+    conn.execute(f"DELETE FROM {change_table} WHERE id <= (SELECT MAX(id) FROM {change_table}) - ?",
+                 (CHANGE_EVENTS_KEEP,))
+    return cur.rowcount
+
+
+def events_after(conn, after, limit=FEED_EVENTS):
+    try:
+        rows = conn.execute(f"""
+            SELECT id, generation, state, city, first_time, last_time, rows, created_at FROM {change_table}
+            WHERE id > ? ORDER BY id LIMIT ?
+        """, (after, limit)).fetchall()
+    except sqlite3.OperationalError:
+        # No batch has been written since the table was introduced
+        return []
+    return [dict(zip(EVENT_FIELDS, row)) for row in rows]
+
+
+def latest_event_id(conn):
+    try:
+        return conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {change_table}").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+
+
+class ChangeFeed:
+    # The newest events of one database, polled on a background thread
+    # while at least one stream is subscribed
+    def __init__(self, path):
+        self.path = path
+        self.cond = threading.Condition()
+        self.events = deque(maxlen=FEED_EVENTS)
+        self.last_id = None
+        self.subscribers = 0
+        self.thread = None
+
+    def subscribe(self):
+        with self.cond:
+            if self.last_id is None:
+                self.last_id = latest_event_id(db.connect(self.path))
+            if self.thread is None:
+                # Catch up on what was committed while nobody was listening
+                self.poll()
+                self.thread = threading.Thread(target=self.run, name="change-feed", daemon=True)
+                self.thread.start()
+            # The thread can't see the count until the lock is released
+            self.subscribers += 1
+            return self.last_id
+
+    def unsubscribe(self):
+        with self.cond:
+            self.subscribers -= 1
+
+    def run(self):
+        while True:
+            with self.cond:
+                if not self.subscribers:
+                    self.thread = None
+                    return
+            try:
+                self.poll()
+            except sqlite3.Error:
+                pass
+            time.sleep(STREAM_POLL_SECONDS)
+
+    def poll(self):
+        events = events_after(db.connect(self.path), self.last_id)
+        if events:
+            with self.cond:
+                self.events.extend(events)
+                self.last_id = events[-1]["id"]
+                self.cond.notify_all()
+
+    def since(self, after):
+        # Events after `after`: from memory, or from the table for a client
+        # that resumed further back than the feed remembers
+        with self.cond:
+            if after >= self.last_id or (self.events and self.events[0]["id"] <= after + 1):
+                return [event for event in self.events if event["id"] > after]
+        return events_after(db.connect(self.path), after)
+
+    def wait(self, after, timeout):
+        with self.cond:
+            self.cond.wait_for(lambda: self.last_id > after, timeout)
+        return self.since(after)
+
+
+_feeds = {}
+_feeds_lock = threading.Lock()
+
+
+def get_feed(path):
+    with _feeds_lock:
+        if path not in _feeds:
+            _feeds[path] = ChangeFeed(path)
+        return _feeds[path]
+
+
+def stream_after(feed, last_event_id):
+    # Where a stream starts: after the id the browser last saw when it is
+    # reconnecting, otherwise at the newest event (no history replay)
+    latest = feed.subscribe()
+    if last_event_id and last_event_id.isdigit():
+        return min(int(last_event_id), latest)
+    return latest
+
+
+def wanted(event, state, city):
+    return (not state or event["state"] == state) and (not city or event["city"] == city)
+
+
+def sse_message(event):
+    return f"id: {event['id']}\nevent: change\ndata: {json.dumps(event, separators=(',', ':'))}\n\n".encode()
+
+
+def sse_stream(feed, last_event_id=None, state=None, city=None):
+    # Blocking generator of SSE frames for a WSGI response; unsubscribes
+    # when the client goes away or STREAM_MAX_SECONDS is up
+    after = stream_after(feed, last_event_id)
+    try:
+        yield f"retry: {int(STREAM_POLL_SECONDS * 1000) + 1000}\n: connected\n\n".encode()
+        started = time.monotonic()
+        while time.monotonic() - started < STREAM_MAX_SECONDS:
+            events = feed.wait(after, STREAM_HEARTBEAT_SECONDS)
+            if events:
+                after = events[-1]["id"]
+            frames = [sse_message(event) for event in events if wanted(event, state, city)]
+            yield b"".join(frames) if frames else b": keep-alive\n\n"
+    finally:
+        feed.unsubscribe()
@@ -0,0 +1,125 @@
+import json
+
+import app
+import parquet_store
+from check_fixture import expect, fixture_db, main
+from rollup import SEASON_MONTHS
+from snapshot import Snapshot, refresh_snapshot, snapshot_dir
+from synthetic import generate_accidents
+from writer import write_accidents
+
+# Compares every /api/analytics backend against the pandas reference on a
+# generated fixture DB, and every /api/analytics/batch result against the
+# single call it stands for. Exits non-zero if any drill-down payload differs.
+# The snapshot and Parquet store are built, then refreshed incrementally
+# after a second write, so their comparisons cover the merge, append and
+# compaction paths. The Parquet backend is checked when duckdb is installed.
+BACKENDS = {
+    "sql": app.query_builder_analytics,
+    "rollup": app.rollup_analytics,
+    "snapshot": app.snapshot_analytics,
+}
+if parquet_store.duckdb:
+    BACKENDS["parquet"] = app.parquet_analytics
+
+
+def drilldown_cases(df):
+    start = df['start_time']
+    for (state, city), group in df.groupby(['state', 'city']):
+        times = start.loc[group.index]
+        yield dict(state=state, city=city)
+        for season in list(SEASON_MONTHS) + ['Monsoon']:
+            yield dict(state=state, city=city, season=season)
+        for year in sorted(times.dt.year.unique()):
+            yield dict(state=state, city=city, year=str(year))
+            yield dict(state=state, city=city, year=str(year), season='Summer')
+            for month in (1, 6, 12):
+                yield dict(state=state, city=city, year=str(year), month=str(month))
+                for day in (1, 15, 31):
+                    yield dict(state=state, city=city, year=str(year), month=str(month), day=str(day))
+    yield dict(state='ZZ', city='Nowhere')
+
+
+def batch_cases(df):
+    start = df['start_time']
+    for (state, city), group in df.groupby(['state', 'city']):
+        year = str(start.loc[group.index].dt.year.min())
+        yield dict(state=state, city=city, expand='year')
+        yield dict(state=state, city=city, expand='season')
+        yield dict(state=state, city=city, season='Winter', expand='month')
+        yield dict(state=state, city=city, year=year, expand='month')
+        yield dict(state=state, city=city, year=year, month='6', expand='day')
+        yield dict(state=state, city=city, filter=[f'year:{year},month:{m}' for m in (1, 6, 12)] + ['season:Summer'])
+
+
+def check_batches(failures, df):
+    # Each batch result must be byte-identical to the /api/analytics
+    # response for its filter, for every backend.
+    client = app.app.test_client()
+    backend = app.ANALYTICS_BACKEND
+    try:
+        for app.ANALYTICS_BACKEND in (*BACKENDS, "pandas"):
+            mismatched = []
+            for case in batch_cases(df):
+                batch = client.get("/api/analytics/batch", query_string=case).get_json()
+                base = {k: v for k, v in case.items() if k not in ("expand", "filter")}
+                for f, result in zip(batch["filters"], batch["results"]):
+                    single = client.get("/api/analytics", query_string={**base, **f}).get_json()
+                    if single != result:
+                        mismatched.append((base, f))
+            failures = expect(failures, not mismatched, f"/api/analytics/batch ({app.ANALYTICS_BACKEND}) matches "
+                              "/api/analytics" + (f" except for {mismatched}" if mismatched else ""))
+    finally:
+        app.ANALYTICS_BACKEND = backend
+    # Malformed filters are a 400 on both endpoints; 0 is not read as "no filter"
+    for url in ("/api/analytics?state=TX&city=Austin&year=abc", "/api/analytics?state=TX&city=Austin&year=0",
+                "/api/analytics/batch?state=TX&city=Austin&filter=year:0"):
+        failures = expect(failures, client.get(url).status_code == 400, f"{url} is rejected")
+    return failures
+
+
+def run_checks(rows, seed):
+    failures = 0
+    with fixture_db(rows, seed) as (db_path, df, conn):
+        refresh_snapshot(conn, snapshot_dir(db_path), log=lambda message: None)
+        if parquet_store.duckdb:
+            parquet_store.export_parquet(conn, parquet_store.parquet_dir(db_path), log=lambda message: None)
+        fresh = generate_accidents(rows // 10, seed=seed + 1)
+        fresh["id"] = [f"new-{i}" for i in range(len(fresh))]
+        write_accidents(conn, fresh)
+        conn.commit()
+
+        stale = app.snapshot_analytics(state=fresh["state"][0], city=fresh["city"][0]) is None
+        failures = expect(failures, stale, "the snapshot is not used once the DB generation moves on")
+        # A request that read the manifest before the refresh can still open
+        # the city directories it names
+        reader = Snapshot(snapshot_dir(db_path))
+        reader.current()
+        refresh_snapshot(conn, snapshot_dir(db_path), log=lambda message: None)
+        try:
+            reader.city(fresh["state"][0], fresh["city"][0])
+            readable = True
+        except OSError:
+            readable = False
+        failures = expect(failures, readable, "a refresh keeps the city directories of the manifest it replaced")
+        if parquet_store.duckdb:
+            # Compact every partition the second export touches
+            compact_files, parquet_store.COMPACT_FILES = parquet_store.COMPACT_FILES, 2
+            parquet_store.export_parquet(conn, parquet_store.parquet_dir(db_path), log=lambda message: None)
+            parquet_store.COMPACT_FILES = compact_files
+
+        cases = list(drilldown_cases(df))
+        expected = [json.dumps(app.pandas_analytics(**case), sort_keys=True) for case in cases]
+        for name, backend in BACKENDS.items():
+            mismatched = [case for case, payload in zip(cases, expected)
+                          if json.dumps(backend(**case), sort_keys=True) != payload]
+            failures = expect(failures, not mismatched, f"{name} matches pandas on {len(cases)} drill-downs"
+                              + (f" except for {mismatched}" if mismatched else ""))
+
+        app.response_cache.backend = None
+        failures = check_batches(failures, df)
+    return failures
+
+
+if __name__ == "__main__":
+    main(run_checks, "analytics", "Check analytics backends return identical chart payloads", rows=20_000)
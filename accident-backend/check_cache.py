@@ -0,0 +1,77 @@
+import os
+
+import app
+from check_fixture import expect, fixture_db, main
+from response_cache import DiskBackend, MemoryBackend, ResponseCache
+from synthetic import generate_accidents
+from writer import write_accidents
+
+# Drives the cached API routes through Flask's test client on a fixture DB:
+# repeat requests hit, equivalent query strings share an entry (values that
+# differ as the views read them don't), If-None-Match
+# gets a 304, an ETL write invalidates, the LRU evicts, and two disk-backed
+# caches (as two gunicorn workers would) see each other's entries. /metrics
+# reports the same requests and cache results in the Prometheus format.
+
+
+def run_checks(rows, seed):
+    failures = 0
+    with fixture_db(rows, seed) as (db_path, _, conn):
+        cache = app.response_cache
+        cache.backend = MemoryBackend(4)
+        client = app.app.test_client()
+
+        url = "/api/analytics?state=TX&city=Austin&year=2020&month=3"
+        first = client.get(url)
+        second = client.get("/api/analytics?month=3&city=Austin&year=2020&state=TX&day=")
+        failures = expect(failures, cache.stats["hits"] == 1 and first.data == second.data,
+                          "equivalent query strings share one cache entry")
+
+        # The views query "Austin " as sent, so its (empty) payload must not
+        # be served for "Austin"
+        padded = client.get("/api/analytics?state=TX&city=Austin%20&year=2020&month=3")
+        again = client.get(url)
+        failures = expect(failures, cache.stats["hits"] == 2 and padded.data != first.data and again.data == first.data,
+                          "a value with stray whitespace gets its own cache entry")
+
+        etag = first.headers.get("ETag")
+        revalidated = client.get(url, headers={"If-None-Match": etag})
+        failures = expect(failures, revalidated.status_code == 304 and cache.stats["not_modified"] == 1,
+                          f"If-None-Match {etag} answers 304")
+
+        fresh = generate_accidents(50, seed=seed + 1, start="2020-03-01", years=0.05)
+        fresh["id"] = [f"new-{i}" for i in range(len(fresh))]
+        fresh["state"], fresh["city"] = "TX", "Austin"
+        write_accidents(conn, fresh)
+        conn.commit()
+        after_write = client.get(url, headers={"If-None-Match": etag})
+        failures = expect(failures, after_write.status_code == 200 and after_write.headers["ETag"] != etag
+                          and cache.stats["stale"] == 1, "an ETL insert bumps the generation and invalidates")
+
+        for city in ("Houston", "Chicago", "New York", "Montgomery"):
+            client.get(f"/api/cities?state=TX&city={city}")
+        failures = expect(failures, cache.stats["evictions"] >= 1 and len(cache.backend) == 4,
+                          f"LRU capped at 4 entries ({cache.stats['evictions']} evicted)")
+
+        stats = client.get("/api/cache/stats").get_json()
+        failures = expect(failures, stats["hits"] == cache.stats["hits"] and stats["generation"] >= 1,
+                          f"/api/cache/stats reports {stats}")
+
+        scrape = client.get("/metrics").get_data(as_text=True)
+        hit = 'api_requests_total{cache="hit",route="/api/analytics",status="200"} 2'
+        failures = expect(failures, hit in scrape and 'api_request_seconds_count{route="/api/analytics"}' in scrape
+                          and 'api_request_work_seconds_total{kind="db",route="/api/analytics"}' in scrape
+                          and f'api_cache_events_total{{event="hits"}} {cache.stats["hits"]}' in scrape,
+                          "/metrics reports per-route requests, latency, DB time and cache hits")
+
+        shared = os.path.join(os.path.dirname(db_path), "response_cache.db")
+        worker_a = ResponseCache(DiskBackend(shared), 300, app.db_generation)
+        worker_b = ResponseCache(DiskBackend(shared), 300, app.db_generation)
+        worker_a.store("/api/states?", app.db_generation(), b'["TX"]')
+        failures = expect(failures, worker_b.lookup("/api/states?", app.db_generation()) is not None,
+                          "disk backend entries are shared between caches")
+    return failures
+
+
+if __name__ == "__main__":
+    main(run_checks, "cache", "Check the API response cache", rows=5_000)
@@ -0,0 +1,54 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import app
+from rollup import rebuild_rollup
+from synthetic import write_fixture_db
+
+# Shared by the check_*.py scripts that drive the API on a synthetic
+# fixture DB (or, like check_sync.py, a mock server): the pass/fail line,
+# the temporary DB and the command line.
+
+
+def expect(failures, ok, message):
+    print(("✅ " if ok else "❌ ") + message)
+    return failures + (0 if ok else 1)
+
+
+@contextmanager
+def fixture_db(rows, seed):
+    # (db path, generated accidents, open connection) for a fixture DB in a
+    # temporary directory, with its rollup built and the app serving it
+    db_path_before = app.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "fixture_accidents.db")
+        df = write_fixture_db(db_path, rows, seed)
+        conn = sqlite3.connect(db_path)
+        rebuild_rollup(conn)
+        app.DB_PATH = db_path
+        try:
+            yield db_path, df, conn
+        finally:
+            conn.close()
+            app.DB_PATH = db_path_before
+
+
+def main(run_checks, name, description, rows, seed=0, **options):
+    # run_checks gets rows, seed and any extra integer `options` by keyword;
+    # seed=None leaves --seed out for checks that generate nothing at random
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--rows", type=int, default=rows)
+    if seed is not None:
+        parser.add_argument("--seed", type=int, default=seed)
+    for option, default in options.items():
+        parser.add_argument("--" + option.replace("_", "-"), type=int, default=default)
+    args = parser.parse_args()
+
+    failures = run_checks(**vars(args))
+    if failures:
+        print(f"❌ {failures} {name} checks failed.")
+        sys.exit(1)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+import app
+from check_fixture import expect, fixture_db, main
+from geo import GRID_ZOOM, band, cell_ids, rebuild_points
+from synthetic import generate_accidents
+from writer import write_accidents
+
+# Checks the grid cells and /api/heatmap on a fixture DB: cells written at
+# ingest (SQL) match the ones bulk loads compute (numpy), the R*Tree indexes
+# every point, and each heatmap matches a pandas count of the same points.
+
+
+def reference_heatmap(df, west, south, east, north, zoom, year=None, month=None, day=None, season=None):
+    # Boxes are matched at zoom-16 cell resolution
+    x, y = band(df["start_lng"], -180.0, 360.0), band(df["start_lat"], -90.0, 180.0)
+    (x0, x1), (y0, y1) = band([west, east], -180.0, 360.0), band([south, north], -90.0, 180.0)
+    df = df.assign(x=x, y=y)
+    df = df[df["x"].between(x0, x1) & df["y"].between(y0, y1)]
+    for col, value in (("year", year), ("month", month), ("day", day), ("season", season)):
+        if value:
+            df = df[df[col] == (value if col == "season" else int(value))]
+    shift = GRID_ZOOM - zoom
+    cells = ((df["y"].to_numpy() >> shift) << zoom) | (df["x"].to_numpy() >> shift)
+    counts = pd.Series(cells).value_counts().sort_index()
+    return [int(c) for c in counts.index], [int(n) for n in counts.values]
+
+
+def run_checks(rows, seed):
+    failures = 0
+    with fixture_db(rows, seed) as (_, _, conn):
+        rebuild_points(conn, log=lambda message: None)
+
+        fresh = generate_accidents(500, seed=seed + 1, start="2020-03-01", years=0.05)
+        fresh["id"] = [f"new-{i}" for i in range(len(fresh))]
+        fresh.loc[fresh.index[:10], ["start_lat", "start_lng"]] = np.nan
+        write_accidents(conn, fresh)
+        conn.commit()
+
+        df = pd.read_sql("SELECT start_lat, start_lng, cell, year, month, day, season FROM accidents "
+                         "WHERE year IS NOT NULL", conn)
+        located = df.dropna(subset=["start_lat", "start_lng"])
+        numpy_cells = cell_ids(located["start_lat"], located["start_lng"])
+        failures = expect(failures, located["cell"].astype("int64").tolist() == numpy_cells
+                          and df["cell"].isna().sum() == 10, "ingest cells (SQL) equal bulk-load cells (numpy)")
+        points = conn.execute("SELECT COUNT(*) FROM accident_points").fetchone()[0]
+        failures = expect(failures, points == len(located), f"R*Tree indexes all {points} located accidents")
+
+        app.response_cache.backend = None
+        client = app.app.test_client()
+        year = str(int(located["year"].min()))
+        cases = [
+            dict(bbox=(-125.0, 24.0, -66.0, 49.0), zoom=6),
+            dict(bbox=(-98.0, 29.0, -96.0, 31.0), zoom=12),
+            dict(bbox=(-100.0, 30.0, -90.0, 40.0), zoom=10, year=year),
+            dict(bbox=(-100.0, 30.0, -90.0, 40.0), zoom=9, season="Winter"),
+            dict(bbox=(-125.0, 24.0, -66.0, 49.0), zoom=8, year="2020", month="3", day="5"),
+            dict(bbox=(-97.8, 30.2, -97.7, 30.3), zoom=16),
+        ]
+        mismatched = []
+        for case in cases:
+            query = {**case, "bbox": ",".join(map(str, case["bbox"]))}
+            payload = client.get("/api/heatmap", query_string=query).get_json()
+            if [payload["cells"], payload["counts"]] != list(reference_heatmap(located, *case.pop("bbox"), **case)):
+                mismatched.append(query)
+        failures = expect(failures, not mismatched, "/api/heatmap matches the pandas reference"
+                          + (f" except for {mismatched}" if mismatched else ""))
+        bad = ["bbox=1,2,3", "bbox=10,0,0,10", "bbox=-100,30,-90,40&zoom=17", "bbox=-180,-90,180,90&zoom=16",
+               "bbox=-100,30,-90,40&year=abc", "bbox=-100,30,-90,40&month=3.5"]
+        failures = expect(failures, all(client.get(f"/api/heatmap?{q}").status_code == 400 for q in bad),
+                          "bad boxes, zooms and filters are rejected")
+    return failures
+
+
+if __name__ == "__main__":
+    main(run_checks, "heatmap", "Check the grid cells and /api/heatmap", rows=20_000)
@@ -0,0 +1,101 @@
+import sqlite3
+
+import pandas as pd
+
+import app
+import parquet_store
+from check_fixture import expect, fixture_db, main
+from rollup import SEASON_MONTHS
+from streets import rebuild_streets, street_key, top_streets
+from synthetic import generate_accidents
+from writer import write_accidents
+
+# Checks the street dictionary and /api/streets on a fixture DB: spellings of
+# one street share an id, the incrementally maintained street_rollup equals a
+# full rebuild, and the top streets for each drill-down filter match a
+# pandas count over the normalised raw text.
+
+SPELLINGS = ["Main Street", " main st. ", "MAIN ST", "Lamar Boulevard", "lamar blvd", "North Lamar Blvd"]
+
+
+def reference_top(conn, state, city, limit=10, year=None, month=None, day=None, season=None):
+    df = pd.read_sql("SELECT street, year, month, day FROM accidents WHERE state=? AND city=? AND year IS NOT NULL",
+                     conn, params=(state, city))
+    if season:
+        df = df[df["month"].isin(SEASON_MONTHS.get(season, []))]
+    for col, value in (("year", year), ("month", month), ("day", day)):
+        if value:
+            df = df[df[col] == int(value)]
+    counts = df["street"].dropna().map(street_key).dropna().value_counts()
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    return [[name, int(n)] for name, n in ranked]
+
+
+def run_checks(rows, seed):
+    failures = 0
+    with fixture_db(rows, seed) as (db_path, df, conn):
+        rebuild_streets(conn, log=lambda message: None)
+        missing = conn.execute("SELECT COUNT(*) FROM accidents WHERE street IS NOT NULL AND street_id IS NULL").fetchone()[0]
+        failures = expect(failures, missing == 0, "rebuild gives every fixture accident a street id")
+
+        fresh = generate_accidents(len(SPELLINGS) * 20, seed=seed + 1, start="2020-03-01", years=0.05)
+        fresh["id"] = [f"new-{i}" for i in range(len(fresh))]
+        fresh["state"], fresh["city"] = "TX", "Austin"
+        fresh["street"] = [SPELLINGS[i % len(SPELLINGS)] for i in range(len(fresh))]
+        write_accidents(conn, fresh)
+        conn.commit()
+        ids = dict(conn.execute("SELECT raw, street_id FROM street_aliases WHERE raw IN (%s)"
+                                % ", ".join("?" * len(SPELLINGS)), SPELLINGS).fetchall())
+        failures = expect(failures, len({ids.get(s) for s in SPELLINGS[:3]}) == 1 and ids[SPELLINGS[0]] != ids[SPELLINGS[3]]
+                          and ids[SPELLINGS[3]] == ids[SPELLINGS[4]],
+                          "spellings of one street share an id at ingest")
+
+        counts_sql = ["SELECT * FROM street_rollup ORDER BY 1, 2, 3, 4, 5", "SELECT * FROM street_totals ORDER BY 1, 2, 3"]
+        incremental = [conn.execute(sql).fetchall() for sql in counts_sql]
+        rebuild_streets(conn, log=lambda message: None)
+        rebuilt = [conn.execute(sql).fetchall() for sql in counts_sql]
+        failures = expect(failures, incremental == rebuilt, "street_rollup and street_totals maintained at ingest "
+                                                            f"equal a rebuild ({len(rebuilt[0])} rows)")
+
+        app.response_cache.backend = None
+        client = app.app.test_client()
+        year = str(df["start_time"].dt.year.min())
+        cases = [dict(), dict(year=year), dict(year="2020", month="3"), dict(season="Winter"),
+                 dict(year="2020", month="3", day="5"), dict(season="Summer", year=year, limit=3)]
+        backend, backends = app.ANALYTICS_BACKEND, ["rollup"]
+        if parquet_store.duckdb:
+            parquet_store.export_parquet(conn, parquet_store.parquet_dir(db_path), log=lambda message: None)
+            backends.append("parquet")
+        for app.ANALYTICS_BACKEND in backends:
+            mismatched = []
+            for state, city in df[["state", "city"]].drop_duplicates().itertuples(index=False):
+                for case in cases:
+                    payload = client.get("/api/streets", query_string={"state": state, "city": city,
+                                                                        "format": "compact", **case}).get_json()["streets"]
+                    actual = [list(pair) for pair in zip(payload["labels"], payload["counts"])]
+                    if actual != reference_top(conn, state, city, **case):
+                        mismatched.append((city, case))
+            failures = expect(failures, not mismatched, f"/api/streets ({app.ANALYTICS_BACKEND}) matches the pandas "
+                              "reference" + (f" except for {mismatched}" if mismatched else ""))
+        app.ANALYTICS_BACKEND = backend
+        failures = expect(failures, client.get("/api/streets?state=TX&city=Austin&limit=0").status_code == 400,
+                          "limit=0 is rejected")
+        failures = expect(failures, client.get("/api/streets?state=TX&city=Austin&year=abc").status_code == 400,
+                          "a non-numeric year is rejected")
+
+        # Without the street index the raw spellings are counted, with the
+        # calendar derived from start_time on a database never migrated
+        legacy = sqlite3.connect(":memory:")
+        legacy.execute("CREATE TABLE accidents (id TEXT, state TEXT, city TEXT, street TEXT, start_time TEXT)")
+        legacy.executemany("INSERT INTO accidents VALUES (?, ?, ?, ?, ?)",
+                           [("a", "TX", "Austin", "Main St", "2020-03-05 08:00:00"),
+                            ("b", "TX", "Austin", "Main St", "2021-03-05 08:00:00"),
+                            ("c", "TX", "Austin", "Oak Ave", "2020-07-01 08:00:00")])
+        failures = expect(failures, top_streets(legacy, "TX", "Austin", year="2020", season="Spring") == [("Main St", 1)],
+                          "the unindexed fallback works on an unmigrated database")
+        legacy.close()
+    return failures
+
+
+if __name__ == "__main__":
+    main(run_checks, "street", "Check the street dictionary and /api/streets", rows=20_000)
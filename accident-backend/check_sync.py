@@ -0,0 +1,352 @@
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+
+import app
+import changes
+import etl
+import sync_daemon
+from check_fixture import expect, main
+from fetch_engine import make_session, print_timings, run_sources
+from mock_socrata import MockSocrata
+from watermark import ensure_watermarks, fetch_new_pages, get_watermark, save_watermark
+
+# Runs the watermark sync loop twice against a local stand-in Socrata server
+# and checks the second run only downloads the records added in between, then
+# drives several sources through the concurrent fetch engine with throttling
+# and server errors injected, then runs the full etl.py pipeline. Last, the
+# sync daemon polls the mock server while /api/stream (WSGI and ASGI) waits
+# for the change event of records added under it.
+SOURCES = {
+    "keyset": {"date_field": "crash_date", "id_field": "collision_id", "use_where": True},
+    "newest-first": {"date_field": "date_time", "id_field": "crash_id", "use_where": False},
+}
+
+
+def socrata_records(config, start, count):
+    # Several crashes share each timestamp so paging has to break ties on id
+    records = []
+    for i in range(start, start + count):
+        crash_day = date(2025, 1, 1) + timedelta(days=i // 50)
+        records.append({
+            config["date_field"]: f"{crash_day.isoformat()}T00:00:00.000",
+            config["id_field"]: str(1000 + i),
+            "location": {"lat": "30.1", "lon": "-97.7"},
+        })
+    return records
+
+
+def sync(conn, url, config, since, page_size, until=None, max_pages=100):
+    watermark = get_watermark(conn, url, since, until)
+    seen = 0
+    for batch, mark in fetch_new_pages(url, config, watermark, since, until, page_size=page_size, max_pages=max_pages):
+        conn.executemany("INSERT OR IGNORE INTO ingested (id) VALUES (?)",
+                         [(r[config["id_field"]],) for r in batch])
+        seen += len(batch)
+        if mark:
+            save_watermark(conn, url, since, until, mark)
+        conn.commit()
+    return seen
+
+
+def run_watermark_checks(failures, initial, added, page_size):
+    since = "2025-01-01T00:00:00"
+    for name, config in SOURCES.items():
+        mock = MockSocrata({"/resource.json": socrata_records(config, 0, initial)})
+        url = mock.start() + "/resource.json"
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE ingested (id TEXT PRIMARY KEY)")
+        ensure_watermarks(conn)
+        try:
+            first = sync(conn, url, config, since, page_size)
+            mock.append("/resource.json", socrata_records(config, initial, added))
+            served_before = mock.rows_served
+            second = sync(conn, url, config, since, page_size)
+            downloaded = mock.rows_served - served_before
+            third = sync(conn, url, config, since, page_size)
+            total = conn.execute("SELECT COUNT(*) FROM ingested").fetchone()[0]
+        finally:
+            mock.stop()
+            conn.close()
+
+        # Newest-first sources re-read the page that straddles the watermark
+        allowed = added if config["use_where"] else added + page_size
+        ok = first == initial and second == added and third == 0 and total == initial + added and downloaded <= allowed
+        failures = expect(failures, ok, f"{name}: first={first} second={second} third={third} "
+                          f"rows downloaded on re-run={downloaded} stored={total}")
+
+    # A newest-first walk cut short by max_pages saves no mark, so a later run
+    # still fetches the older records; a backfill window keeps to [since, until)
+    config = SOURCES["newest-first"]
+    mock = MockSocrata({"/resource.json": socrata_records(config, 0, 250)})
+    url = mock.start() + "/resource.json"
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE ingested (id TEXT PRIMARY KEY)")
+    ensure_watermarks(conn)
+    try:
+        cut = sync(conn, url, config, since, 50, max_pages=2)
+        cut_mark = get_watermark(conn, url, since)
+        resumed = sync(conn, url, config, since, 50)
+        total = conn.execute("SELECT COUNT(*) FROM ingested").fetchone()[0]
+        conn.execute("DELETE FROM ingested")
+        window = sync(conn, url, config, "2025-01-02T00:00:00", 50, until="2025-01-04T00:00:00")
+        window_mark = get_watermark(conn, url, "2025-01-02T00:00:00", "2025-01-04T00:00:00")
+    finally:
+        mock.stop()
+        conn.close()
+    ok = cut == 100 and cut_mark is None and total == 250 and window == 100 \
+        and window_mark == ("2025-01-03T00:00:00.000", "1149")
+    return expect(failures, ok, f"newest-first cut off at max_pages: {cut} rows and mark {cut_mark}, "
+                  f"then {total} stored; window [01-02, 01-04) read {window} rows, mark {window_mark}")
+
+
+def engine_run(mock, base, sources, page_size, max_workers, per_host):
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE ingested (source TEXT, id TEXT, PRIMARY KEY (source, id))")
+
+    def fetch_pages(name, config, get):
+        return fetch_new_pages(base + config["path"], config, None, "2025-01-01T00:00:00",
+                               page_size=page_size, get=get)
+
+    def write_batch(name, config, batch, mark):
+        conn.executemany("INSERT OR IGNORE INTO ingested VALUES (?, ?)",
+                         [(name, r[config["id_field"]]) for r in batch])
+        conn.commit()
+
+    mock.max_in_flight = 0
+    session = make_session(pool_size=max_workers * per_host, backoff=0.01)
+    started = time.perf_counter()
+    timings = run_sources(sources, fetch_pages, write_batch, session=session,
+                          max_workers=max_workers, per_host=per_host)
+    elapsed = time.perf_counter() - started
+    stored = dict(conn.execute("SELECT source, COUNT(*) FROM ingested GROUP BY source").fetchall())
+    conn.close()
+    return timings, elapsed, stored
+
+
+def run_engine_checks(failures, rows, page_size, per_host):
+    config = SOURCES["keyset"]
+    sources = {f"City {i}": dict(config, path=f"/city{i}.json") for i in range(4)}
+    mock = MockSocrata({c["path"]: socrata_records(config, 0, rows) for c in sources.values()}, latency=0.05)
+    base = mock.start()
+    try:
+        _, sequential, _ = engine_run(mock, base, sources, page_size, max_workers=1, per_host=1)
+        mock.fail(429, 2)
+        mock.fail(503, 1)
+        timings, concurrent, stored = engine_run(mock, base, sources, page_size, max_workers=4, per_host=per_host)
+        peak = mock.max_in_flight
+    finally:
+        mock.stop()
+
+    print_timings(timings)
+    ok = all(stored.get(name) == rows for name in sources) and peak <= per_host \
+        and not any(t["error"] for t in timings.values())
+    return expect(failures, ok, f"engine: sequential {sequential:.2f}s, concurrent {concurrent:.2f}s, "
+                  f"peak in-flight {peak} (limit {per_host}), stored {stored}")
+
+
+def run_etl_checks(failures, rows, page_size):
+    # Socrata-shaped Austin and New York payloads behind the mock server
+    austin = etl.SOURCES["Austin"]
+    new_york = etl.SOURCES["New York"]
+    datasets = {}
+    for source in (austin, new_york):
+        records = socrata_records(source.fetch_config, 0, rows)
+        for r in records:
+            r.update(latitude="30.27", longitude="-97.74", on_street_name=" main st ", rpt_street_name="LAMAR BLVD")
+        datasets[f"/{source.city.replace(' ', '_')}.json"] = records
+    mock = MockSocrata(datasets)
+    base = mock.start()
+    registry = {s.city: etl.Source(**{**s.__dict__, "url": f"{base}/{s.city.replace(' ', '_')}.json"})
+                for s in (austin, new_york)}
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = os.path.join(tmp, "etl.db")
+            etl.run(since="2025-01-01", db=db, page_size=page_size, registry=registry)
+            again = etl.run(since="2025-01-01", db=db, page_size=page_size, registry=registry)
+            conn = sqlite3.connect(db)
+            stored = dict(conn.execute("SELECT city, COUNT(*) FROM accidents GROUP BY city").fetchall())
+            rollup = conn.execute("SELECT SUM(accidents) FROM accident_rollup").fetchone()[0]
+            stages = json.loads(conn.execute("SELECT stage_timings FROM etl_logs LIMIT 1").fetchone()[0])
+            fetched_bytes = conn.execute("SELECT fetched_bytes FROM etl_logs LIMIT 1").fetchone()[0]
+            detail = {stage for (stage,) in conn.execute("SELECT DISTINCT stage FROM etl_metrics")}
+            conn.close()
+            # A source whose fetch fails makes the command line exit non-zero
+            mock.fail(404)
+            sources, etl.SOURCES = etl.SOURCES, registry
+            try:
+                status = etl.main(["--city", "Austin", "--since", "2025-01-01", "--db", db,
+                                   "--page-size", str(page_size)])
+            finally:
+                etl.SOURCES = sources
+    finally:
+        mock.stop()
+
+    ok = stored == {"Austin": rows, "New York": rows} and rollup == 2 * rows \
+        and all(ctx.fetched == 0 for ctx in again.values()) \
+        and set(stages) == {"fetch", "normalise", "dedupe", "write"} and fetched_bytes > 0 \
+        and {"fetch.http", "normalise.to_datetime", "write.dedupe", "write.stage"} <= detail and status == 1
+    return expect(failures, ok, f"etl: stored {stored}, rollup {rollup}, stages {sorted(stages)}, {fetched_bytes} "
+                  f"bytes, etl_metrics stages {sorted(detail)}, exit status {status} after a failed fetch")
+
+
+def wait_until(check, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def stored_rows(path):
+    try:
+        conn = sqlite3.connect(path)
+        try:
+            return conn.execute("SELECT COUNT(*) FROM accidents").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
+
+
+def change_events(body):
+    # The data of every "change" event in an SSE body
+    return [json.loads(block.split("data: ", 1)[1]) for block in body.decode().split("\n\n")
+            if "event: change" in block]
+
+
+def wsgi_stream(query, headers, until, timeout, out):
+    response = app.app.test_client().get("/api/stream", query_string=query, headers=headers, buffered=False)
+    body = b""
+    started = time.monotonic()
+    try:
+        for chunk in response.response:
+            body += chunk
+            if until(change_events(body)) or time.monotonic() - started > timeout:
+                break
+    finally:
+        response.close()
+    out.append(body)
+
+
+def asgi_stream(query, until, timeout, out):
+    import asgi
+    gone = asyncio.Event()
+    scope = {"type": "http", "method": "GET", "path": "/api/stream", "query_string": query.encode(),
+             "headers": [], "http_version": "1.1", "scheme": "http", "server": ("check", 80)}
+    requested = []
+    body = []
+
+    async def receive():
+        if not requested:
+            requested.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await gone.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            out.append(dict(message["headers"]))
+        body.append(message.get("body", b""))
+        if until(change_events(b"".join(body))):
+            gone.set()
+
+    async def main():
+        task = asyncio.ensure_future(asgi.application(scope, receive, send))
+        try:
+            await asyncio.wait_for(gone.wait(), timeout)
+        except asyncio.TimeoutError:
+            gone.set()
+        await task
+
+    asyncio.run(main())
+    out.insert(0, b"".join(body))
+
+
+def run_daemon_checks(failures, rows, added, page_size):
+    # Backoff doubles per failure up to the cap and resets after a good poll
+    schedule = sync_daemon.Schedule({"a": 10}, jitter=0, max_backoff=35)
+    waits = []
+    for ok in (False, False, False, True):
+        schedule.done("a", ok, 0.0)
+        waits.append(schedule.due_at["a"])
+
+    austin = etl.SOURCES["Austin"]
+    mock = MockSocrata({"/austin.json": socrata_records(austin.fetch_config, 0, rows)})
+    base = mock.start()
+    registry = {"Austin": etl.Source(**{**austin.__dict__, "url": f"{base}/austin.json", "poll_seconds": 0.2})}
+    poll, heartbeat = changes.STREAM_POLL_SECONDS, changes.STREAM_HEARTBEAT_SECONDS
+    changes.STREAM_POLL_SECONDS, changes.STREAM_HEARTBEAT_SECONDS = 0.05, 0.2
+    db_path = app.DB_PATH
+    stream_key = ("api_requests_total", (("cache", "none"), ("route", "/api/stream"), ("status", "200")))
+    streams_before = app.request_metrics.values.get(stream_key, 0)
+    stop = threading.Event()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "daemon.db")
+            daemon = threading.Thread(target=sync_daemon.run_daemon, kwargs=dict(
+                since="2025-01-01", db=path, jitter=0, page_size=page_size, registry=registry, stop=stop))
+            daemon.start()
+            loaded = wait_until(lambda: stored_rows(path) == rows)
+            app.DB_PATH = path
+            fresh = lambda events: sum(e["rows"] for e in events) >= added
+            wsgi_out, asgi_out, replay_out = [], [], []
+            readers = [threading.Thread(target=wsgi_stream, args=({"city": "Austin"}, {}, fresh, 30, wsgi_out)),
+                       threading.Thread(target=asgi_stream, args=("city=Austin", fresh, 30, asgi_out))]
+            for reader in readers:
+                reader.start()
+            # Both streams are open before the new records exist
+            wait_until(lambda: changes.get_feed(path).subscribers == 2)
+            mock.append("/austin.json", socrata_records(austin.fetch_config, rows, added))
+            for reader in readers:
+                reader.join()
+            # A reconnecting browser sends the last id it saw and gets what it missed
+            wsgi_stream({}, {"Last-Event-ID": "0"}, fresh, 30, replay_out)
+            stop.set()
+            daemon.join()
+            total = stored_rows(path)
+    finally:
+        stop.set()
+        mock.stop()
+        changes.STREAM_POLL_SECONDS, changes.STREAM_HEARTBEAT_SECONDS = poll, heartbeat
+        app.DB_PATH = db_path
+
+    first_day = date(2025, 1, 1) + timedelta(days=rows // 50)
+    last_day = date(2025, 1, 1) + timedelta(days=(rows + added - 1) // 50)
+    # One event per committed page; together they cover the added records
+    expected = {"cities": ["TX/Austin"], "rows": added, "first": f"{first_day} 00:00:00", "last": f"{last_day} 00:00:00"}
+
+    def summary(events):
+        return {"cities": sorted({f"{e['state']}/{e['city']}" for e in events}), "rows": sum(e["rows"] for e in events),
+                "first": min((e["first"] for e in events), default=None),
+                "last": max((e["last"] for e in events), default=None)}
+
+    pushed = {name: summary(change_events(out[0])) for name, out in (("wsgi", wsgi_out), ("asgi", asgi_out))}
+    replayed = change_events(replay_out[0])
+    # The ASGI stream gets Flask's headers (CORS included) and is counted in /metrics
+    asgi_headers = asgi_out[1]
+    counted = app.request_metrics.values.get(stream_key, 0) - streams_before
+    ok = waits == [20, 35, 35, 10] and loaded and total == rows + added \
+        and all(got == expected for got in pushed.values()) and summary(replayed)["rows"] == rows + added \
+        and asgi_headers.get(b"access-control-allow-origin") == b"*" and counted == 3
+    return expect(failures, ok, f"daemon: backoff waits {waits}, stored {total}, pushed {pushed['wsgi']} "
+                  f"(asgi {pushed['asgi'] == expected}, CORS {asgi_headers.get(b'access-control-allow-origin')}), "
+                  f"{len(replayed)} events replayed after Last-Event-ID 0, {counted} streams in /metrics")
+
+
+def run_checks(rows, added, page_size):
+    failures = run_watermark_checks(0, rows, added, page_size)
+    failures = run_engine_checks(failures, rows // 2, page_size, per_host=3)
+    failures = run_etl_checks(failures, rows // 2, page_size)
+    return run_daemon_checks(failures, rows // 2, added, page_size)
+
+
+if __name__ == "__main__":
+    main(run_checks, "sync", "Check incremental watermark sync against a mock Socrata server", rows=5000, seed=None,
+         added=730, page_size=500)
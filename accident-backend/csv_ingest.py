@@ -0,0 +1,379 @@
+import argparse
+import io
+import os
+import resource
+import shutil
+import sqlite3
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from db import write_connection
+from etl import Pipeline, RunContext, dedupe, write
+from generation import bump_generation
+from geo import add_points_after, cell_ids
+from metrics import timed
+from migrate import ACCIDENT_INDEXES, apply_migrations, quote_ident
+from rollup import STORED_CALENDAR, ensure_rollup, update_rollup
+from streets import add_street_counts, street_ids
+from writer import INSERT_COLUMNS, to_rows
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Streams a cleaned crash CSV into accidents one chunk at a time. Each chunk
+# runs through the same dedupe -> write stages as the Socrata sync and is
+# released before the next one is read, so peak memory follows batch_size
+# rather than the size of the file.
+
+csv_path = "cleaned_crash_data.csv"
+db_path = "accidents.db"
+
+progress_table = "load_progress"
+
+CSV_STAGES = [("dedupe", dedupe), ("write", write)]
+
+BULK_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+]
+
+
+# Only the accidents columns are parsed; ids stay text so numeric-looking
+# ids match the TEXT key.
+CSV_OPTIONS = dict(usecols=lambda c: c in INSERT_COLUMNS, dtype={"id": str})
+
+
+def csv_batches(path, batch_size, skip_rows=0):
+    skip = (lambda i: 0 < i <= skip_rows) if skip_rows else None
+    with pd.read_csv(path, chunksize=batch_size, skiprows=skip, **CSV_OPTIONS) as reader:
+        yield from reader
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def load_csv(path=csv_path, db=db_path, batch_size=100_000, log=print):
+    conn = write_connection(db)
+    apply_migrations(conn, log=log)
+    ensure_rollup(conn)
+    conn.commit()
+
+    ctx = RunContext(conn, None, None)
+    pipeline = Pipeline(CSV_STAGES)
+    for batch in csv_batches(path, batch_size):
+        pipeline.process(ctx, batch)
+        conn.commit()
+        log(f"✅ Loaded {ctx.fetched} rows so far ({ctx.inserted} new)...")
+    conn.close()
+    log(f"🎉 Done. {ctx.inserted} rows inserted, {ctx.fetched - ctx.inserted} skipped, peak RSS {peak_rss_mb():.0f} MB.")
+    return ctx
+
+
+def file_key(path):
+    # A resume point only applies to the same file, unchanged since
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_size, int(stat.st_mtime)
+
+
+def load_progress(conn, key):
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {progress_table} "
+                 "(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, rows_done INTEGER, inserted INTEGER)")
+    row = conn.execute(f"SELECT size, mtime, rows_done, inserted FROM {progress_table} WHERE path=?",
+                       (key[0],)).fetchone()
+    if row is None or (row[0], row[1]) != key[1:]:
+        return 0, 0
+    return row[2], row[3]
+
+
+def drop_accident_indexes(conn):
+    # Explicit indexes only; the (city, id) key index is needed for dedupe.
+    # ACCIDENT_INDEXES puts them back.
+    indexes = conn.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='accidents' "
+                           "AND sql IS NOT NULL").fetchall()
+    for (name,) in indexes:
+        conn.execute(f"DROP INDEX {quote_ident(name)}")
+
+
+_bulk_columns = ", ".join(quote_ident(name) for name in INSERT_COLUMNS + ["street_id", "cell"])
+_bulk_insert = f"INSERT OR IGNORE INTO accidents ({_bulk_columns}) VALUES ({', '.join('?' * (len(INSERT_COLUMNS) + 2))})"
+
+
+def chunk_cells(chunk):
+    return cell_ids(*(pd.to_numeric(chunk[col], errors="coerce") if col in chunk else pd.Series(index=chunk.index, dtype=float)
+                      for col in ("start_lat", "start_lng")))
+
+
+def fold_rows_after(conn, rowid):
+    # The rollups and point index for the accidents inserted after `rowid`,
+    # as write_accidents() feeds them from staging; the caller commits with
+    # the insert, so a resumed load never counts a chunk twice.
+    new_rows = f"(SELECT * FROM accidents WHERE rowid > {int(rowid)})"
+    update_rollup(conn, new_rows, STORED_CALENDAR)
+    add_street_counts(conn, new_rows, STORED_CALENDAR)
+    add_points_after(conn, rowid)
+    bump_generation(conn)
+
+
+def insert_rows(conn, rows, streets, aliases):
+    # Straight executemany into accidents, skipping rows whose (city, id) is
+    # stored. `rows` are INSERT_COLUMNS values followed by the grid cell.
+    # street_id and cell are filled in here, and the rollups and point index
+    # are extended from the new rowids, so nothing is rescanned or rebuilt
+    # at the end; `aliases` carries the spelling -> street_id map between chunks.
+    street = INSERT_COLUMNS.index("street")
+    street_ids(conn, streets, aliases)
+    last_rowid = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM accidents").fetchone()[0]
+    inserted = conn.executemany(_bulk_insert, ((*row[:-1], aliases.get(row[street]), row[-1]) for row in rows)).rowcount
+    fold_rows_after(conn, last_rowid)
+    return inserted
+
+
+def chunk_rows(chunk, cells, slice_rows=50_000):
+    # to_rows() a slice at a time, so only one slice of the chunk is held as
+    # Python objects while executemany consumes it
+    for start in range(0, len(chunk), slice_rows):
+        yield from zip(to_rows(chunk.iloc[start:start + slice_rows]), cells[start:start + slice_rows])
+
+
+def insert_chunk(conn, chunk, aliases):
+    streets = chunk.get("street", pd.Series(dtype=object)).dropna().unique()
+    return insert_rows(conn, ((*row, cell) for row, cell in chunk_rows(chunk, chunk_cells(chunk))), streets, aliases)
+
+
+def start_bulk(conn, path, log):
+    # Bulk pragmas and a dropped set of secondary indexes; (key, rows_done,
+    # inserted) to resume from. path=None loads without resume tracking.
+    for pragma in BULK_PRAGMAS:
+        conn.execute(pragma)
+    apply_migrations(conn, log=log)
+    ensure_rollup(conn)
+    key, rows_done, inserted = None, 0, 0
+    if path is not None:
+        key = file_key(path)
+        rows_done, inserted = load_progress(conn, key)
+    if rows_done:
+        log(f"⏩ Resuming after row {rows_done}")
+    drop_accident_indexes(conn)
+    conn.commit()
+    return key, rows_done, inserted
+
+
+def save_progress(conn, key, rows_done, inserted):
+    conn.execute(f"INSERT OR REPLACE INTO {progress_table} VALUES (?, ?, ?, ?, ?)", (*key, rows_done, inserted))
+    conn.commit()
+
+
+def finish_bulk(conn, key, log):
+    # The rollups and point index are already up to date (see insert_rows)
+    log("🔄 Building indexes...")
+    for ddl in ACCIDENT_INDEXES:
+        conn.execute(ddl)
+    if key is not None:
+        conn.execute(f"DELETE FROM {progress_table} WHERE path=?", (key[0],))
+    conn.commit()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def bulk_load(path=csv_path, db=db_path, batch_size=200_000, log=print):
+    # Bulk mode for the historical CSV: durability is traded for speed while
+    # loading (WAL, synchronous=OFF), the secondary indexes are dropped and
+    # rebuilt once at the end, and rows go straight into accidents with
+    # executemany, one transaction per chunk. Each commit also records how
+    # many CSV rows are done, so a rerun resumes after the last one. The
+    # rollups and spatial index are extended in the same transaction.
+    conn = sqlite3.connect(db)
+    key, rows_done, inserted = start_bulk(conn, path, log)
+
+    aliases = {}
+    started = time.perf_counter()
+    loaded = 0
+    for chunk in csv_batches(path, batch_size, skip_rows=rows_done):
+        inserted += insert_chunk(conn, chunk, aliases)
+        rows_done += len(chunk)
+        loaded += len(chunk)
+        save_progress(conn, key, rows_done, inserted)
+        log(f"✅ Loaded {rows_done} rows so far ({loaded / (time.perf_counter() - started):.0f} rows/s)...")
+
+    finish_bulk(conn, key, log)
+    conn.close()
+    elapsed = time.perf_counter() - started
+    log(f"🎉 Done. {inserted} rows inserted, {rows_done - inserted} skipped, "
+        f"{loaded / elapsed:.0f} rows/s, peak RSS {peak_rss_mb():.0f} MB.")
+    return inserted
+
+
+# --workers N: --bulk with the CSV cut into byte ranges of whole lines (so a
+# record must not span lines, as in cleaned_crash_data.csv) that a process
+# pool reads, parses and normalises into insert-ready rows and grid cells.
+# With pyarrow installed a shard comes back as an Arrow IPC file in shared
+# memory (/dev/shm) that the writer maps instead of unpickling; without it
+# the rows are pickled back. This process stays the only SQLite writer and
+# inserts shards in file order, so progress and resume work as in --bulk.
+SPOOL_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+WORKER_STAGES = ["read", "parse", "normalise"]
+WRITER_STAGES = ["wait", "transfer", "insert", "finish"]
+
+
+def skip_lines(f, lines):
+    # Moves f past the next `lines` line breaks
+    while lines:
+        block = f.read(1 << 24)
+        if not block:
+            return
+        if block.count(b"\n") < lines:
+            lines -= block.count(b"\n")
+            continue
+        pos = -1
+        for _ in range(lines):
+            pos = block.index(b"\n", pos + 1)
+        f.seek(f.tell() - len(block) + pos + 1)
+        return
+
+
+def line_bytes(path):
+    # Average line length over the first MB
+    with open(path, "rb") as f:
+        f.readline()
+        sample = f.read(1 << 20)
+    return len(sample) / max(1, sample.count(b"\n"))
+
+
+def csv_shards(path, shard_bytes, skip_rows=0):
+    # The header line and [(start, end)] byte ranges of whole data lines,
+    # starting after skip_rows of them
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as f:
+        header = f.readline()
+        skip_lines(f, skip_rows)
+        start = f.tell()
+        while start < size:
+            f.seek(start + shard_bytes)
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header, ranges
+
+
+def parse_shard(path, header, start, end, spool):
+    # Runs in a pool process: one byte range to insert-ready rows, returned
+    # as an Arrow file path under `spool` (or the rows themselves)
+    seconds = {}
+    with timed(seconds, "read"):
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start)
+    with timed(seconds, "parse"):
+        chunk = pd.read_csv(io.BytesIO(header + data), **CSV_OPTIONS)
+    del data
+    with timed(seconds, "normalise"):
+        cells = chunk_cells(chunk)
+        streets = chunk["street"].dropna().unique().tolist() if "street" in chunk else []
+        if pa is None:
+            payload = [(*row, cell) for row, cell in zip(to_rows(chunk), cells)]
+        else:
+            columns = {name: pa.array(chunk[name], from_pandas=True) if name in chunk else pa.nulls(len(chunk))
+                       for name in INSERT_COLUMNS}
+            table = pa.table({**columns, "cell": pa.array(cells, type=pa.int64())})
+            payload = os.path.join(spool, f"shard-{start}.arrow")
+            with pa.OSFile(payload, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    return len(chunk), streets, payload, seconds
+
+
+def shard_rows(payload):
+    # The rows of a parsed shard; an Arrow file is mapped, read and removed
+    if isinstance(payload, list):
+        return payload
+    with pa.memory_map(payload) as source:
+        columns = [column.to_pylist() for column in pa.ipc.open_file(source).read_all().columns]
+    os.remove(payload)
+    return zip(*columns)
+
+
+def print_stage_rates(seconds, rows, workers, elapsed, log):
+    # Worker stages are summed over the pool, so their rows/s is per process
+    log(f"{'stage':<11}{'in':>8}{'seconds':>10}{'rows/s':>12}")
+    for stages, where in ((WORKER_STAGES, "workers"), (WRITER_STAGES, "writer")):
+        for stage in stages:
+            value = seconds.get(stage, 0.0)
+            log(f"{stage:<11}{where:>8}{value:>10.2f}{rows / value if value else 0:>12.0f}")
+    log(f"{'total':<11}{f'{workers} + 1':>8}{elapsed:>10.2f}{rows / elapsed if elapsed else 0:>12.0f}")
+
+
+def parallel_load(path=csv_path, db=db_path, batch_size=100_000, workers=None, log=print):
+    workers = workers or os.cpu_count()
+    conn = sqlite3.connect(db)
+    key, rows_done, inserted = start_bulk(conn, path, log)
+    header, shards = csv_shards(path, max(1, int(batch_size * line_bytes(path))), rows_done)
+    log(f"🧩 {len(shards)} shards of ~{batch_size} rows, {workers} workers, "
+        f"{'Arrow via shared memory' if pa else 'pickled rows (install pyarrow to map them instead)'}")
+
+    aliases = {}
+    seconds = {}
+    loaded = 0
+    started = time.perf_counter()
+    spool = tempfile.mkdtemp(prefix="csv-ingest-", dir=SPOOL_DIR)
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            # At most one shard per worker queued ahead of the writer, so
+            # memory follows workers * batch_size
+            queued = iter(shards)
+            pending = deque(pool.submit(parse_shard, path, header, start, end, spool)
+                            for start, end in [next(queued) for _ in range(min(workers + 1, len(shards)))])
+            while pending:
+                with timed(seconds, "wait"):
+                    rows, streets, payload, shard_seconds = pending.popleft().result()
+                following = next(queued, None)
+                if following:
+                    pending.append(pool.submit(parse_shard, path, header, *following, spool))
+                for stage, value in shard_seconds.items():
+                    seconds[stage] = seconds.get(stage, 0.0) + value
+                with timed(seconds, "transfer"):
+                    shard = shard_rows(payload)
+                with timed(seconds, "insert"):
+                    inserted += insert_rows(conn, shard, streets, aliases)
+                    rows_done += rows
+                    loaded += rows
+                    save_progress(conn, key, rows_done, inserted)
+                log(f"✅ Loaded {rows_done} rows so far ({loaded / (time.perf_counter() - started):.0f} rows/s)...")
+    finally:
+        shutil.rmtree(spool, ignore_errors=True)
+
+    with timed(seconds, "finish"):
+        finish_bulk(conn, key, log)
+    conn.close()
+    elapsed = time.perf_counter() - started
+    print_stage_rates(seconds, loaded, workers, elapsed, log)
+    log(f"🎉 Done. {inserted} rows inserted, {rows_done - inserted} skipped, "
+        f"{loaded / elapsed:.0f} rows/s, peak RSS {peak_rss_mb():.0f} MB.")
+    return inserted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream a cleaned crash CSV into accidents.db")
+    parser.add_argument("--csv", default=csv_path)
+    parser.add_argument("--db", default=db_path)
+    parser.add_argument("--batch-size", type=int, help="rows held in memory (and per transaction in --bulk)")
+    parser.add_argument("--bulk", action="store_true", help="fast resumable load of a large historical CSV")
+    parser.add_argument("--workers", type=int, default=1, help="parse the CSV in this many processes (implies --bulk)")
+    args = parser.parse_args(argv)
+    if args.workers > 1:
+        return parallel_load(args.csv, args.db, args.batch_size or 100_000, args.workers)
+    if args.bulk:
+        return bulk_load(args.csv, args.db, args.batch_size or 200_000)
+    return load_csv(args.csv, args.db, args.batch_size or 100_000)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import sqlite3
+
+import parquet_store
+import sql_analytics
+from generation import current_generation
+from rollup import query_analytics, rollup_exists
+from streets import top_streets
+
+# The queries behind streamlitapp.py, kept free of Streamlit so the
+# benchmark suite can time exactly what the dashboard runs. The dashboard
+# wraps each one in st.cache_data. `parquet` is a Parquet store directory
+# to answer from while it is current (see parquet_store.py).
+
+
+def data_version(conn):
+    # DB generation + latest etl_logs row; moves whenever the data can have changed
+    try:
+        last_log = conn.execute("SELECT MAX(rowid) FROM etl_logs").fetchone()[0]
+    except sqlite3.OperationalError:
+        last_log = None
+    return current_generation(conn), last_log
+
+
+def states(conn):
+    rows = conn.execute("SELECT DISTINCT state FROM accidents WHERE state IS NOT NULL ORDER BY state")
+    return [state for (state,) in rows]
+
+
+def cities(conn, state):
+    rows = conn.execute("SELECT DISTINCT city FROM accidents WHERE state = ? AND city IS NOT NULL ORDER BY city", (state,))
+    return [city for (city,) in rows]
+
+
+def city_counts(conn, state, city, parquet=None):
+    # Year/month/hour/weekday/season counts from the rollup, or as aggregate
+    # queries over accidents when it hasn't been built
+    if parquet:
+        counts = parquet_store.query_analytics(parquet, current_generation(conn), state, city)
+        if counts is not None:
+            return counts
+    if rollup_exists(conn):
+        return query_analytics(conn, state, city)
+    return sql_analytics.query_analytics(conn, state, city)
+
+
+def city_top_streets(conn, state, city, limit=10, parquet=None):
+    # From the street index, so spellings of one street are counted together
+    if parquet:
+        rows = parquet_store.query_top_streets(parquet, current_generation(conn), state, city, limit)
+        if rows is not None:
+            return rows
+    return top_streets(conn, state, city, limit)
@@ -0,0 +1,68 @@
+import os
+import sqlite3
+import threading
+from urllib.parse import quote
+
+# Shared SQLite access for the API and dashboards. Readers get one read-only
+# (mode=ro) connection per thread and process, reused across requests so
+# sqlite3's statement cache keeps prepared queries warm. Writers (the ETL
+# and loaders) open their connection through write_connection(), which puts
+# the database in WAL mode so readers never wait on an ingest commit.
+
+BUSY_TIMEOUT_MS = int(os.environ.get("ACCIDENTS_DB_BUSY_TIMEOUT_MS", 5000))
+STATEMENT_CACHE = 256
+
+_local = threading.local()
+_wal_checked = set()
+_wal_lock = threading.Lock()
+
+
+def ensure_wal(path):
+    # journal_mode=WAL is persistent, but can only be set through a writable
+    # connection; do it once per file so read-only connections inherit it.
+    with _wal_lock:
+        if path in _wal_checked or not os.path.exists(path):
+            return
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+        except sqlite3.OperationalError:
+            # Locked by a writer still in rollback mode; try again next time
+            return
+        finally:
+            conn.close()
+        _wal_checked.add(path)
+
+
+def read_only_uri(path):
+    return f"file:{quote(os.path.abspath(path))}?mode=ro"
+
+
+def connect(path):
+    # Pooled read-only connection for the calling thread. A forked worker
+    # (gunicorn with --preload) starts its own pool rather than sharing the
+    # parent's connections.
+    pool = getattr(_local, "pool", None)
+    if pool is None or _local.pid != os.getpid():
+        pool = _local.pool = {}
+        _local.pid = os.getpid()
+    conn = pool.get(path)
+    if conn is None:
+        ensure_wal(path)
+        conn = sqlite3.connect(read_only_uri(path), uri=True, timeout=BUSY_TIMEOUT_MS / 1000,
+                               cached_statements=STATEMENT_CACHE)
+        pool[path] = conn
+    return conn
+
+
+def close_pool():
+    for conn in getattr(_local, "pool", {}).values():
+        conn.close()
+    _local.pool = {}
+
+
+def write_connection(path):
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
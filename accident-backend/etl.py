@@ -0,0 +1,318 @@
+import argparse
+import json
+import sqlite3
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import pandas as pd
+
+import parquet_store
+from db import write_connection
+from fetch_engine import print_timings, rows_per_second, run_sources
+from metrics import kind_seconds, profiled, save_stage_metrics, timed
+from migrate import apply_migrations
+from rollup import ensure_rollup
+from snapshot import refresh_snapshot, snapshot_dir, snapshot_exists
+from watermark import ensure_watermarks, fetch_new_pages, get_watermark, save_watermark
+from writer import INSERT_COLUMNS, write_accidents
+
+# Single ETL entry point for every Socrata source. Sources are declared once
+# in SOURCES; each batch runs through the same stage pipeline
+# (normalise -> dedupe -> write) after the concurrent fetch engine.
+
+db_path = "accidents.db"
+log_table = "etl_logs"
+
+
+@dataclass(frozen=True)
+class Source:
+    city: str
+    state: str
+    url: str
+    date_field: str
+    id_field: str
+    use_where: bool = True
+    timezone: str = "US/Eastern"
+    # Source column -> accidents column, applied with one DataFrame.rename
+    columns: dict = field(default_factory=dict)
+    # First of these present in a batch becomes `street`
+    street_fields: tuple = ("street_name", "on_street_name")
+    # Explicit pd.to_datetime format for date_field, so nothing is inferred
+    time_format: str = "ISO8601"
+    # How often sync_daemon.py polls the source, in seconds
+    poll_seconds: int = 300
+
+    @property
+    def fetch_config(self):
+        return {"date_field": self.date_field, "id_field": self.id_field, "use_where": self.use_where}
+
+
+SOURCES = {
+    "Austin": Source(
+        city="Austin", state="TX", timezone="US/Central",
+        url="https://data.austintexas.gov/resource/y2wy-tgr5.json",
+        date_field="crash_timestamp", id_field="cris_crash_id",
+        columns={"latitude": "start_lat", "longitude": "start_lng", "crash_sev_id": "severity"},
+        street_fields=("rpt_street_name", "street_name"),
+    ),
+    "New York": Source(
+        city="New York", state="NY",
+        url="https://data.cityofnewyork.us/resource/h9gi-nx95.json",
+        date_field="crash_date", id_field="collision_id",
+        columns={"latitude": "start_lat", "longitude": "start_lng"},
+    ),
+    "Montgomery": Source(
+        city="Montgomery", state="MD",
+        url="https://data.montgomerycountymd.gov/resource/mmzv-x632.json",
+        date_field="date_time", id_field="crash_id", use_where=False,
+        columns={"latitude": "start_lat", "longitude": "start_lng"},
+    ),
+    "Chicago": Source(
+        city="Chicago", state="IL", timezone="US/Central",
+        url="https://data.cityofchicago.org/resource/85ca-t3if.json",
+        date_field="crash_date", id_field="crash_record_id",
+        columns={"latitude": "start_lat", "longitude": "start_lng"},
+    ),
+}
+
+
+@dataclass
+class RunContext:
+    conn: sqlite3.Connection
+    source: Source
+    since: str
+    until: str = None
+    fetched: int = 0
+    inserted: int = 0
+    fetched_bytes: int = 0
+    wall_seconds: float = 0.0
+    error: Exception = None
+    # Pipeline stages, plus dotted sub-stages ("write.dedupe") timed inside them
+    stage_seconds: dict = field(default_factory=dict)
+
+
+def location_coordinates(values):
+    # Socrata nests points either as {"latitude", "longitude"} (legacy
+    # location columns) or GeoJSON {"coordinates": [lng, lat]}.
+    loc = pd.json_normalize([v if isinstance(v, dict) else {} for v in values])
+    missing = pd.Series(None, index=range(len(values)), dtype=object)
+    lat = loc.get("latitude", loc.get("lat", missing))
+    lng = loc.get("longitude", loc.get("lon", missing))
+    if "coordinates" in loc.columns:
+        lat = lat.fillna(loc["coordinates"].str[1])
+        lng = lng.fillna(loc["coordinates"].str[0])
+    return lat.values, lng.values
+
+
+def build_columns(source, records):
+    # Columnar builder: pull only the fields the mapping needs, one list per
+    # column, instead of materialising every Socrata attribute.
+    wanted = {source.date_field: "start_time", source.id_field: "id", **source.columns}
+    data = {target: [r.get(field) for r in records] for field, target in wanted.items()}
+    street = next((f for f in source.street_fields if any(f in r for r in records[:50])), None)
+    data["street"] = [r.get(street) for r in records] if street else [None] * len(records)
+    if "start_lat" not in data or all(v is None for v in data["start_lat"]):
+        data["start_lat"], data["start_lng"] = location_coordinates([r.get("location") for r in records])
+    return pd.DataFrame(data)
+
+
+def parse_times(values, source):
+    times = pd.to_datetime(values, format=source.time_format, errors="coerce")
+    if getattr(times.dt, "tz", None) is not None:
+        times = times.dt.tz_convert(source.timezone).dt.tz_localize(None)
+    return times
+
+
+def normalise(ctx, records):
+    source = ctx.source
+    if not records:
+        return pd.DataFrame(columns=INSERT_COLUMNS)
+    with timed(ctx.stage_seconds, "normalise.frame"):
+        df = build_columns(source, records)
+
+    with timed(ctx.stage_seconds, "normalise.to_datetime"):
+        df["start_time"] = parse_times(df["start_time"], source)
+    window = df["start_time"] >= pd.Timestamp(ctx.since)
+    if ctx.until:
+        window &= df["start_time"] < pd.Timestamp(ctx.until)
+    df = df[window & df["id"].notna()].copy()
+
+    df["id"] = df["id"].astype(str)
+    df["end_time"] = df["start_time"]
+    for col in ("start_lat", "start_lng"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype("float32")
+    df["end_lat"] = df["start_lat"]
+    df["end_lng"] = df["start_lng"]
+    df["distance(mi)"] = 0.1
+    df["description"] = "Auto-Crash"
+    df["city"] = source.city
+    df["state"] = source.state
+    df["country"] = "US"
+    df["timezone"] = source.timezone
+    severity = df["severity"] if "severity" in df.columns else pd.Series(2, index=df.index)
+    df["severity"] = pd.to_numeric(severity, errors="coerce").fillna(2).astype("int8")
+    return df[INSERT_COLUMNS]
+
+
+def dedupe(ctx, df):
+    # Rows repeated within the batch; rows already stored are skipped by write
+    return df.drop_duplicates(subset=["city", "id"])
+
+
+def write(ctx, df):
+    seconds = {}
+    inserted, _ = write_accidents(ctx.conn, df, seconds)
+    for step, elapsed in seconds.items():
+        ctx.stage_seconds[f"write.{step}"] = ctx.stage_seconds.get(f"write.{step}", 0.0) + elapsed
+    ctx.inserted += inserted
+    return df
+
+
+DEFAULT_STAGES = [("normalise", normalise), ("dedupe", dedupe), ("write", write)]
+
+
+class Pipeline:
+    def __init__(self, stages=None):
+        self.stages = list(stages or DEFAULT_STAGES)
+
+    def process(self, ctx, records):
+        ctx.fetched += len(records)
+        data = records
+        for name, stage in self.stages:
+            started = time.perf_counter()
+            data = stage(ctx, data)
+            ctx.stage_seconds[name] = ctx.stage_seconds.get(name, 0.0) + time.perf_counter() - started
+        return data
+
+
+def log_run(conn, ctx):
+    # Skipped covers everything fetched but not stored: already present,
+    # outside the date window, or missing an id/timestamp. stage_timings
+    # keeps the top-level stages; every stage and sub-stage also gets an
+    # etl_metrics row under the same run_time.
+    run_time = datetime.now().isoformat()
+    kinds = kind_seconds(ctx.stage_seconds)
+    conn.execute(
+        f"INSERT INTO {log_table} (run_time, city, state, source, inserted_rows, skipped_rows, fetched_rows, stage_timings, "
+        "fetched_bytes, wall_seconds, http_seconds, pandas_seconds, db_seconds) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (run_time, ctx.source.city, ctx.source.state, ctx.source.url, ctx.inserted,
+         ctx.fetched - ctx.inserted, ctx.fetched,
+         json.dumps({name: round(seconds, 4) for name, seconds in ctx.stage_seconds.items() if "." not in name}),
+         ctx.fetched_bytes, round(ctx.wall_seconds, 4),
+         *(round(kinds.get(kind, 0.0), 4) for kind in ("http", "pandas", "db"))))
+    save_stage_metrics(conn, run_time, ctx.source.city, ctx.stage_seconds)
+
+
+def open_db(db):
+    conn = write_connection(db)
+    apply_migrations(conn)
+    ensure_rollup(conn)
+    ensure_watermarks(conn)
+    conn.commit()
+    return conn
+
+
+def sync_sources(conn, sources, since, until=None, pipeline=None, session=None, max_workers=4, page_size=1000,
+                 max_pages=100, prefetch=4, log=print):
+    # One incremental fetch of `sources` into an open write connection;
+    # returns the run contexts and the fetch engine's per-source timings
+    pipeline = pipeline or Pipeline()
+    contexts = {name: RunContext(conn, source, since, until) for name, source in sources.items()}
+    watermarks = {}
+    for name, source in sources.items():
+        watermarks[name] = get_watermark(conn, source.url, since, until)
+        log(f"🔄 Starting incremental fetch for {name} after {watermarks[name] or since}...")
+
+    def fetch_pages(name, source, get):
+        return fetch_new_pages(source.url, source.fetch_config, watermarks[name], since, until,
+                               page_size=page_size, max_pages=max_pages, get=get)
+
+    def write_batch(name, source, batch, mark):
+        ctx = contexts[name]
+        try:
+            if batch:
+                pipeline.process(ctx, batch)
+            if mark:
+                save_watermark(conn, source.url, since, until, mark)
+            conn.commit()
+        except Exception:
+            # Nothing of a failed batch may ride along with a later commit
+            conn.rollback()
+            raise
+
+    # Pages are normalised, written and dropped as they arrive; at most
+    # `prefetch` pages per source wait in memory, so peak RSS follows
+    # page_size * prefetch rather than the date window.
+    timings = run_sources(sources, fetch_pages, write_batch, session=session, max_workers=max_workers,
+                          prefetch=prefetch)
+    for name, ctx in contexts.items():
+        t = timings[name]
+        ctx.stage_seconds = {"fetch": t["fetch_s"], "fetch.http": t["http_s"],
+                             "fetch.json": max(t["fetch_s"] - t["http_s"], 0.0), **ctx.stage_seconds}
+        ctx.fetched_bytes = t["bytes"]
+        ctx.wall_seconds = t["wall_s"]
+        ctx.error = t["error"]
+        log_run(conn, ctx)
+        if ctx.error is not None:
+            log(f"❌ {name} failed: {ctx.error} ({ctx.inserted} rows inserted before the error).")
+        else:
+            log(f"✅ {name}: {ctx.inserted} rows inserted, {ctx.fetched - ctx.inserted} skipped "
+                f"({rows_per_second(t):.0f} rows/s).")
+    conn.commit()
+    return contexts, timings
+
+
+def refresh_stores(conn, db):
+    # Once `python snapshot.py` / `python parquet_store.py` have built the
+    # snapshot or Parquet store, keep them current: only the rows committed
+    # since their last refresh are read
+    if snapshot_exists(snapshot_dir(db)):
+        refresh_snapshot(conn, snapshot_dir(db))
+    if parquet_store.duckdb and parquet_store.store_exists(parquet_store.parquet_dir(db)):
+        parquet_store.export_parquet(conn, parquet_store.parquet_dir(db))
+
+
+def run(cities=None, since="2025-01-01", until=None, db=db_path, pipeline=None, max_workers=4, page_size=1000,
+        max_pages=100, registry=None, prefetch=4):
+    since = pd.Timestamp(since).isoformat()
+    until = pd.Timestamp(until).isoformat() if until else None
+    registry = registry or SOURCES
+    sources = {name: registry[name] for name in (cities or registry)}
+
+    conn = open_db(db)
+    contexts, timings = sync_sources(conn, sources, since, until, pipeline, max_workers=max_workers,
+                                     page_size=page_size, max_pages=max_pages, prefetch=prefetch)
+    refresh_stores(conn, db)
+    conn.close()
+    print_timings(timings)
+    return contexts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sync accidents from the configured Socrata sources")
+    parser.add_argument("--city", action="append", choices=sorted(SOURCES), help="repeat for several; default all")
+    parser.add_argument("--since", default="2025-01-01", help="only rows at or after this time")
+    parser.add_argument("--until", help="only rows before this time")
+    parser.add_argument("--db", default=db_path)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--max-pages", type=int, default=100)
+    parser.add_argument("--prefetch", type=int, default=4, help="pages per source buffered ahead of the writer")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="profile the run into PATH: cProfile stats, or pyinstrument HTML if PATH ends in .html")
+    args = parser.parse_args(argv)
+    with profiled(args.profile):
+        contexts = run(args.city, args.since, args.until, args.db, max_workers=args.workers,
+                       page_size=args.page_size, max_pages=args.max_pages, prefetch=args.prefetch)
+    # Non-zero when any source failed, so cron and wrappers can tell
+    failed = sorted(name for name, ctx in contexts.items() if ctx.error is not None)
+    if failed:
+        print(f"❌ {len(failed)} of {len(contexts)} sources failed: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
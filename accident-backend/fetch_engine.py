@@ -0,0 +1,125 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Fetches several sources at once over one pooled requests.Session. Each
+# source pages on its own worker thread and runs ahead of the writer through
+# a bounded queue; the caller's thread is the only one that touches SQLite.
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def make_session(pool_size=8, retries=5, backoff=0.5):
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=frozenset(["GET"]), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class HostLimiter:
+    # Caps in-flight requests per host so one portal isn't hit by every worker
+    def __init__(self, per_host=2):
+        self.per_host = per_host
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    def __call__(self, url):
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.per_host)
+            return self.semaphores[host]
+
+
+def limited_get(session, limiter, timeout=60):
+    def get(url, params=None):
+        with limiter(url):
+            return session.get(url, params=params, timeout=timeout)
+    return get
+
+
+def run_sources(sources, fetch_pages, write_batch, session=None, max_workers=4, per_host=2, prefetch=4):
+    # fetch_pages(name, config, get) yields (batch, mark) pairs on a worker
+    # thread; write_batch(name, config, batch, mark) runs here, one at a time.
+    session = session or make_session(pool_size=max_workers * per_host)
+    get = limited_get(session, HostLimiter(per_host))
+    results = queue.Queue(maxsize=prefetch * max(1, len(sources)))
+    timings = {name: {"pages": 0, "rows": 0, "requests": 0, "bytes": 0, "fetch_s": 0.0, "http_s": 0.0,
+                      "write_s": 0.0, "wall_s": 0.0, "error": None}
+               for name in sources}
+    started = {}
+    # A source whose write failed stops fetching; later batches are dropped
+    # so its watermark never moves past the failed one.
+    stopped = set()
+
+    def counted_get(name):
+        # fetch_s minus http_s is the time spent decoding JSON and paging
+        def source_get(url, params=None):
+            t0 = time.perf_counter()
+            response = get(url, params=params)
+            timings[name]["http_s"] += time.perf_counter() - t0
+            timings[name]["requests"] += 1
+            timings[name]["bytes"] += len(response.content)
+            return response
+        return source_get
+
+    def fetch(name, config):
+        started[name] = time.perf_counter()
+        try:
+            pages = fetch_pages(name, config, counted_get(name))
+            while name not in stopped:
+                t0 = time.perf_counter()
+                item = next(pages, None)
+                timings[name]["fetch_s"] += time.perf_counter() - t0
+                if item is None:
+                    break
+                results.put(("batch", name, item))
+        except Exception as e:
+            results.put(("error", name, e))
+        results.put(("done", name, None))
+
+    pending = len(sources)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for name, config in sources.items():
+            pool.submit(fetch, name, config)
+        while pending:
+            kind, name, payload = results.get()
+            if kind == "batch" and name not in stopped:
+                batch, mark = payload
+                t0 = time.perf_counter()
+                try:
+                    write_batch(name, sources[name], batch, mark)
+                except Exception as e:
+                    timings[name]["error"] = e
+                    stopped.add(name)
+                timings[name]["write_s"] += time.perf_counter() - t0
+                timings[name]["pages"] += 1
+                timings[name]["rows"] += len(batch)
+            elif kind == "error":
+                timings[name]["error"] = payload
+            elif kind == "done":
+                timings[name]["wall_s"] = time.perf_counter() - started.get(name, time.perf_counter())
+                pending -= 1
+    return timings
+
+
+def rows_per_second(t):
+    return t["rows"] / t["wall_s"] if t["wall_s"] else 0.0
+
+
+def print_timings(timings):
+    print(f"{'source':<14}{'pages':>7}{'rows':>9}{'MB':>8}{'http s':>9}{'fetch s':>10}{'write s':>10}{'wall s':>9}"
+          f"{'rows/s':>10}")
+    for name, t in timings.items():
+        print(f"{name:<14}{t['pages']:>7}{t['rows']:>9}{t['bytes'] / 1e6:>8.2f}{t['http_s']:>9.2f}{t['fetch_s']:>10.2f}"
+              f"{t['write_s']:>10.2f}{t['wall_s']:>9.2f}{rows_per_second(t):>10.0f}"
+              + (f"  ❌ {t['error']}" if t['error'] else ""))
@@ -0,0 +1,30 @@
+import sqlite3
+
+# A single counter that moves whenever committed data changes (ETL inserts,
+# bulk loads, rollup rebuilds). Readers such as the API response cache
+# compare it instead of re-running queries to find out if anything changed.
+generation_table = "db_generation"
+
+GENERATION_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {generation_table} (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    generation INTEGER NOT NULL
+)
+"""
+
+
+def bump_generation(conn):
+    # Runs inside the writer's transaction, so readers see the new value
+    # exactly when the rows it covers are committed.
+    conn.execute(GENERATION_SCHEMA)
+    conn.execute(f"INSERT INTO {generation_table} (id, generation) VALUES (1, 1) "
+                 "ON CONFLICT (id) DO UPDATE SET generation = generation + 1")
+
+
+def current_generation(conn):
+    try:
+        row = conn.execute(f"SELECT generation FROM {generation_table} WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        # Nothing has been written since the counter was introduced
+        return 0
+    return row[0] if row else 0
@@ -0,0 +1,165 @@
+import argparse
+import sqlite3
+import time
+
+from generation import bump_generation
+from rollup import SEASON_MONTHS
+
+points_table = "accident_points"
+
+# Every accident with coordinates gets an integer grid cell at ingest:
+# latitude and longitude are each cut into 2**GRID_ZOOM bands and the cell
+# is (y << 16) | x, about 600 m x 300 m at zoom 16. A coarser zoom z keeps
+# the top z bits of each band, so its cell is computed from the stored one.
+# accident_points is an integer R*Tree over (x, y, year, month, day), so a
+# heatmap prunes on the box and the calendar filters together and is
+# answered from the index alone, without touching `accidents`. Boxes are
+# matched at cell resolution: a point counts when its zoom-16 cell is inside.
+GRID_ZOOM = 16
+GRID_SIZE = 1 << GRID_ZOOM
+
+POINTS_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {points_table} USING rtree_i32(
+    id, min_x, max_x, min_y, max_y, min_year, max_year, min_month, max_month, min_day, max_day
+)
+"""
+
+_band_x = f"MIN(MAX(CAST((start_lng + 180.0) * {GRID_SIZE} / 360.0 AS INTEGER), 0), {GRID_SIZE - 1})"
+_band_y = f"MIN(MAX(CAST((start_lat + 90.0) * {GRID_SIZE} / 180.0 AS INTEGER), 0), {GRID_SIZE - 1})"
+# The cell of a row's start_lat/start_lng, NULL without coordinates
+CELL_SQL = f"CASE WHEN start_lat IS NOT NULL AND start_lng IS NOT NULL THEN ({_band_y} << {GRID_ZOOM}) | {_band_x} END"
+
+
+def band(values, low, span):
+    # Grid band of each coordinate, as the CAST in CELL_SQL computes it.
+    # numpy is imported here so the API, which only needs coord_band(),
+    # starts without it.
+    import numpy as np
+    return np.clip(((np.asarray(values, dtype="float64") - low) * GRID_SIZE / span).astype(np.int64), 0, GRID_SIZE - 1)
+
+
+def coord_band(value, low, span):
+    # band() for one coordinate
+    return min(max(int((value - low) * GRID_SIZE / span), 0), GRID_SIZE - 1)
+
+
+def cell_ids(lat, lng):
+    # CELL_SQL for arrays of coordinates; NaN coordinates give None
+    import numpy as np
+    lat = np.asarray(lat, dtype="float64")
+    lng = np.asarray(lng, dtype="float64")
+    valid = ~(np.isnan(lat) | np.isnan(lng))
+    cells = (band(np.where(valid, lat, 0), -90.0, 180.0) << GRID_ZOOM) | band(np.where(valid, lng, 0), -180.0, 360.0)
+    return [int(cell) if ok else None for cell, ok in zip(cells, valid)]
+
+
+def zoom_cell_sql(zoom):
+    shift = GRID_ZOOM - zoom
+    return f"((min_y >> {shift}) << {zoom}) | (min_x >> {shift})"
+
+
+def cell_size(zoom):
+    # (degrees of latitude, degrees of longitude) covered by one cell
+    return 180.0 / (1 << zoom), 360.0 / (1 << zoom)
+
+
+def cell_center(cell, zoom):
+    dlat, dlng = cell_size(zoom)
+    y, x = cell >> zoom, cell & ((1 << zoom) - 1)
+    return round(-90.0 + (y + 0.5) * dlat, 6), round(-180.0 + (x + 0.5) * dlng, 6)
+
+
+def cells_in_box(west, south, east, north, zoom):
+    dlat, dlng = cell_size(zoom)
+    return (int((north - south) / dlat) + 1) * (int((east - west) / dlng) + 1)
+
+
+def ensure_points(conn):
+    conn.execute(POINTS_SCHEMA)
+
+
+def points_exist(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (points_table,)).fetchone()
+    return row is not None
+
+
+def points_select_sql(join):
+    return f"""
+INSERT INTO {points_table}
+SELECT a.rowid, a.cell & {GRID_SIZE - 1}, a.cell & {GRID_SIZE - 1}, a.cell >> {GRID_ZOOM}, a.cell >> {GRID_ZOOM},
+       a.year, a.year, a.month, a.month, a.day, a.day
+FROM {join}
+WHERE a.cell IS NOT NULL AND a.year IS NOT NULL
+"""
+
+
+def update_points(conn, source):
+    # Index the rows staged in `source` (just inserted into accidents); the
+    # caller commits with the insert.
+    cur = conn.execute(points_select_sql(f"{source} s JOIN accidents a ON a.city = s.city AND a.id = s.id"))
+    return cur.rowcount
+
+
+def add_points_after(conn, rowid):
+    # Index the accidents inserted after `rowid`, for loaders that write
+    # accidents.cell themselves; the caller commits with the insert.
+    return conn.execute(points_select_sql("accidents a") + " AND a.rowid > ?", (rowid,)).rowcount
+
+
+def rebuild_points(conn, batch_size=50_000, log=print):
+    # Fill accidents.cell where it is missing, one rowid range per commit,
+    # then re-index every point. Used by the migration and after bulk loads.
+    ensure_points(conn)
+    last_rowid, filled = 0, 0
+    while True:
+        upper = conn.execute("SELECT MAX(rowid) FROM (SELECT rowid FROM accidents WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                             (last_rowid, batch_size)).fetchone()[0]
+        if upper is None:
+            break
+        cur = conn.execute(f"""
+            UPDATE accidents SET cell = {CELL_SQL}
+            WHERE rowid > ? AND rowid <= ? AND cell IS NULL AND start_lat IS NOT NULL AND start_lng IS NOT NULL
+        """, (last_rowid, upper))
+        filled += cur.rowcount
+        last_rowid = upper
+        conn.commit()
+    conn.execute(f"DELETE FROM {points_table}")
+    indexed = conn.execute(points_select_sql("accidents a")).rowcount
+    bump_generation(conn)
+    conn.commit()
+    log(f"🗺️ {filled} accidents given a grid cell, {indexed} points indexed")
+    return indexed
+
+
+def heatmap(conn, west, south, east, north, zoom, year=None, month=None, day=None, season=None):
+    # [(cell, accidents)] at `zoom` for the points inside the box
+    x0, x1 = coord_band(west, -180.0, 360.0), coord_band(east, -180.0, 360.0)
+    y0, y1 = coord_band(south, -90.0, 180.0), coord_band(north, -90.0, 180.0)
+    where = ["min_x <= ?", "max_x >= ?", "min_y <= ?", "max_y >= ?"]
+    params = [x1, x0, y1, y0]
+    for col, value in (("year", year), ("month", month), ("day", day)):
+        if value:
+            where.append(f"min_{col} = ?")
+            params.append(int(value))
+    if season:
+        months = SEASON_MONTHS.get(season, [])
+        where.append(f"min_month IN ({', '.join('?' * len(months))})" if months else "0")
+        params += months
+    rows = conn.execute(f"""
+        SELECT {zoom_cell_sql(zoom)} AS zoom_cell, COUNT(*) FROM {points_table}
+        WHERE {' AND '.join(where)} GROUP BY zoom_cell ORDER BY zoom_cell
+    """, params)
+    return rows.fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild accidents.cell and the accident_points R*Tree")
+    parser.add_argument("--db", default="accidents.db")
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    started = time.perf_counter()
+    rebuild_points(conn, args.batch_size)
+    conn.close()
+    print(f"✅ Spatial index rebuilt in {time.perf_counter() - started:.1f}s")
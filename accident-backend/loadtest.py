@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import app
+from rollup import rebuild_rollup
+from synthetic import FIXTURE_CITIES, write_fixture_db
+
+# Offline load test for the /api/* contract. Virtual users replay the
+# dashboard's drill-down clicks (states -> cities -> city -> year -> month ->
+# day) against a generated fixture DB and the harness reports throughput and
+# latency percentiles per step. Targets:
+#   asgi   the asgi.py app driven in-process on an event loop
+#   wsgi   the Flask app through its test client, one thread per user
+#   URL    a running server (python app.py, uvicorn asgi:application, ...)
+
+STEPS = ["states", "cities", "city", "year", "month", "day"]
+
+
+def click_sequence(rng, years):
+    state, city = rng.choice(FIXTURE_CITIES)
+    year, month, day = rng.choice(years), rng.randint(1, 12), rng.randint(1, 28)
+    analytics = {"state": state, "city": city}
+    yield "states", "/api/states"
+    yield "cities", "/api/cities?" + urlencode({"state": state})
+    yield "city", "/api/analytics?" + urlencode(analytics)
+    yield "year", "/api/analytics?" + urlencode({**analytics, "year": year})
+    yield "month", "/api/analytics?" + urlencode({**analytics, "year": year, "month": month})
+    yield "day", "/api/analytics?" + urlencode({**analytics, "year": year, "month": month, "day": day})
+
+
+def user_sequences(users, sessions, seed, years):
+    rng = random.Random(seed)
+    return [[list(click_sequence(rng, years)) for _ in range(sessions)] for _ in range(users)]
+
+
+async def asgi_get(application, url):
+    path, _, query = url.partition("?")
+    scope = {"type": "http", "method": "GET", "path": path, "query_string": query.encode(), "headers": [],
+             "http_version": "1.1", "scheme": "http", "server": ("loadtest", 80)}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await application(scope, receive, send)
+    return sent[0]["status"]
+
+
+def run_asgi(plans, application):
+    results = []
+
+    async def user(plan):
+        for sequence in plan:
+            for step, url in sequence:
+                started = time.perf_counter()
+                status = await asgi_get(application, url)
+                results.append((step, time.perf_counter() - started, status))
+
+    async def main():
+        await asyncio.gather(*(user(plan) for plan in plans))
+
+    asyncio.run(main())
+    return results
+
+
+def run_threads(plans, make_get):
+    results = []
+    lock = threading.Lock()
+
+    def user(plan):
+        get = make_get()
+        for sequence in plan:
+            for step, url in sequence:
+                started = time.perf_counter()
+                status = get(url)
+                with lock:
+                    results.append((step, time.perf_counter() - started, status))
+
+    threads = [threading.Thread(target=user, args=(plan,)) for plan in plans]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else float("nan")
+
+
+def summarise(results, elapsed):
+    summary = {"requests": len(results), "seconds": round(elapsed, 3), "rps": round(len(results) / elapsed, 1),
+               "errors": sum(1 for _, _, status in results if status >= 400), "steps": {}}
+    for step in STEPS + ["all"]:
+        latencies = [s for name, s, _ in results if step in ("all", name)]
+        summary["steps"][step] = {q: round(percentile(latencies, p) * 1000, 2)
+                                  for q, p in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99))}
+    return summary
+
+
+def print_summary(target, summary):
+    print(f"🎯 {target}: {summary['requests']} requests in {summary['seconds']}s, "
+          f"{summary['rps']} req/s, {summary['errors']} errors")
+    print(f"{'step':<8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}")
+    for step, q in summary["steps"].items():
+        print(f"{step:<8}{q['p50']:>10.2f}{q['p90']:>10.2f}{q['p99']:>10.2f}")
+
+
+def run(target, plans, workers):
+    if target == "asgi":
+        import asgi
+        application = asgi.BoundedWSGI(app.app, workers=workers, queue=len(plans))
+        run_target = lambda: run_asgi(plans, application)
+    elif target == "wsgi":
+        def make_get():
+            client = app.app.test_client()
+            return lambda url: client.get(url).status_code
+        run_target = lambda: run_threads(plans, make_get)
+    else:
+        import requests
+
+        def make_get():
+            session = requests.Session()
+            return lambda url: session.get(target.rstrip("/") + url, timeout=60).status_code
+        run_target = lambda: run_threads(plans, make_get)
+    started = time.perf_counter()
+    results = run_target()
+    return summarise(results, time.perf_counter() - started)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay dashboard drill-downs against the API and report latency")
+    parser.add_argument("--target", action="append", help="asgi, wsgi or a base URL; repeat to compare (default asgi and wsgi)")
+    parser.add_argument("--users", type=int, default=16)
+    parser.add_argument("--sessions", type=int, default=5, help="drill-down sequences per user")
+    parser.add_argument("--workers", type=int, default=8, help="executor threads for the asgi target")
+    parser.add_argument("--rows", type=int, default=200_000, help="fixture rows when --db is not given")
+    parser.add_argument("--db", help="existing database to test against instead of a fixture")
+    parser.add_argument("--cache", action="store_true", help="keep the response cache on (off by default)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results here for regression tracking")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db
+        if db_path is None:
+            db_path = os.path.join(tmp, "fixture_accidents.db")
+            write_fixture_db(db_path, args.rows, args.seed)
+            conn = sqlite3.connect(db_path)
+            rebuild_rollup(conn)
+            conn.close()
+        app.DB_PATH = db_path
+        if not args.cache:
+            app.response_cache.backend = None
+        conn = sqlite3.connect(db_path)
+        years = [y for (y,) in conn.execute("SELECT DISTINCT year FROM accident_rollup ORDER BY year")]
+        conn.close()
+
+        plans = user_sequences(args.users, args.sessions, args.seed, years or [2020])
+        report = {"users": args.users, "sessions": args.sessions, "rows": args.rows if args.db is None else None,
+                  "cache": args.cache, "targets": {}}
+        for target in args.target or ["asgi", "wsgi"]:
+            summary = run(target, plans, args.workers)
+            report["targets"][target] = summary
+            print_summary(target, summary)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Results written to {args.json}")
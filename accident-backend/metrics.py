@@ -0,0 +1,246 @@
+import cProfile
+import pstats
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+metrics_table = "etl_metrics"
+
+# Instrumentation shared by the ETL and the API. Sync runs record seconds per
+# pipeline stage ("normalise.to_datetime", "write.dedupe", ...) and persist
+# them, one row per (run, city, stage), next to the run's etl_logs row.
+# API routes count requests, latency, response bytes, cache results and
+# their DB and pandas time in an in-process Registry rendered at /metrics in
+# the Prometheus text format. Like the cache stats, counters are per process.
+METRICS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {metrics_table} (
+    run_time TEXT NOT NULL,
+    city TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (run_time, city, stage)
+)
+"""
+
+# Where each ETL stage spends its time. Parents ("normalise", "write")
+# include their dotted sub-stages, so only leaves are summed per kind.
+STAGE_KINDS = {
+    "fetch.http": "http",
+    "fetch.json": "decode",
+    "normalise": "pandas",
+    "dedupe": "pandas",
+    "write.to_rows": "pandas",
+    "write.stage": "db",
+    "write.dedupe": "db",
+    "write.insert": "db",
+    "write.rollups": "db",
+}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def ensure_metrics(conn):
+    conn.execute(METRICS_SCHEMA)
+
+
+def stage_kind(stage):
+    return STAGE_KINDS.get(stage, "other")
+
+
+def kind_seconds(stage_seconds):
+    # {"http": s, "pandas": s, "db": s} summed over the leaf stages
+    totals = {}
+    for stage, seconds in stage_seconds.items():
+        if stage in STAGE_KINDS:
+            totals[STAGE_KINDS[stage]] = totals.get(STAGE_KINDS[stage], 0.0) + seconds
+    return totals
+
+
+def save_stage_metrics(conn, run_time, city, stage_seconds):
+    ensure_metrics(conn)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {metrics_table} (run_time, city, stage, kind, seconds) VALUES (?, ?, ?, ?, ?)",
+        [(run_time, city, stage, stage_kind(stage), round(seconds, 6)) for stage, seconds in stage_seconds.items()])
+
+
+@contextmanager
+def timed(seconds, name):
+    # Adds the block's wall time to seconds[name]
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds[name] = seconds.get(name, 0.0) + time.perf_counter() - started
+
+
+_spans = threading.local()
+
+
+def start_spans():
+    # Begin collecting span() time on this thread (one API request)
+    _spans.seconds = {}
+    _spans.stack = []
+    return _spans.seconds
+
+
+def span_seconds():
+    return getattr(_spans, "seconds", None) or {}
+
+
+@contextmanager
+def span(name):
+    # Exclusive time: a "db" span inside a "pandas" one is not counted twice.
+    # Also usable as a decorator; outside start_spans() it only times.
+    stack = getattr(_spans, "stack", None)
+    if stack is None:
+        stack = _spans.stack = []
+    started = time.perf_counter()
+    stack.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        children = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        seconds = getattr(_spans, "seconds", None)
+        if seconds is not None:
+            seconds[name] = seconds.get(name, 0.0) + elapsed - children
+
+
+def last_run_families(conn):
+    # Gauges for each city's latest sync, read from etl_logs/etl_metrics at
+    # scrape time; empty before migration 8 or the first instrumented run.
+    try:
+        runs = conn.execute("""
+            SELECT city, run_time, fetched_rows, inserted_rows, fetched_bytes, wall_seconds,
+                   http_seconds, pandas_seconds, db_seconds
+            FROM etl_logs WHERE rowid IN (SELECT MAX(rowid) FROM etl_logs WHERE wall_seconds IS NOT NULL GROUP BY city)
+            ORDER BY city
+        """).fetchall()
+        stages = conn.execute(f"""
+            SELECT m.city, m.stage, m.seconds FROM {metrics_table} m
+            JOIN (SELECT city, MAX(run_time) AS run_time FROM {metrics_table} GROUP BY city) last USING (city, run_time)
+            ORDER BY m.city, m.stage
+        """).fetchall()
+    except sqlite3.OperationalError:
+        return []
+    timestamps, rows, sizes, rates, seconds = [], [], [], [], []
+    for city, run_time, fetched, inserted, fetched_bytes, wall, http, pandas, db in runs:
+        timestamps.append(({"city": city}, datetime.fromisoformat(run_time).timestamp()))
+        rows += [({"city": city, "kind": "fetched"}, fetched or 0), ({"city": city, "kind": "inserted"}, inserted or 0)]
+        sizes.append(({"city": city}, fetched_bytes or 0))
+        rates.append(({"city": city}, (fetched or 0) / wall if wall else 0.0))
+        seconds += [({"city": city, "kind": kind}, value or 0.0)
+                    for kind, value in (("wall", wall), ("http", http), ("pandas", pandas), ("db", db))]
+    return [
+        ("etl_last_run_timestamp_seconds", "gauge", "When each city's latest sync was logged", timestamps),
+        ("etl_last_run_rows", "gauge", "Rows fetched and inserted by the latest sync", rows),
+        ("etl_last_run_bytes", "gauge", "Response bytes downloaded by the latest sync", sizes),
+        ("etl_last_run_rows_per_second", "gauge", "Rows fetched per wall-clock second in the latest sync", rates),
+        ("etl_last_run_seconds", "gauge", "Wall time of the latest sync and its http/pandas/db share", seconds),
+        ("etl_last_run_stage_seconds", "gauge", "Seconds per pipeline stage in the latest sync",
+         [({"city": city, "stage": stage}, value) for city, stage, value in stages]),
+    ]
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
+
+
+def number_text(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # name -> (type, help); samples keyed by (name, sorted label pairs)
+        self.meta = {}
+        self.values = {}
+        self.histograms = {}
+
+    def describe(self, name, kind, help_text):
+        self.meta[name] = (kind, help_text)
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            counts, total, n = self.histograms.get(key) or ([0] * len(LATENCY_BUCKETS), 0.0, 0)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+            self.histograms[key] = (counts, total + value, n + 1)
+
+    def render(self, extra=()):
+        # Prometheus text exposition (version 0.0.4). `extra` holds
+        # (name, kind, help, [(labels dict, value)]) families computed at
+        # scrape time, such as the cache stats and the last ETL run.
+        with self.lock:
+            values = dict(self.values)
+            histograms = {key: (list(counts), total, n) for key, (counts, total, n) in self.histograms.items()}
+        families = {}
+        for (name, labels), value in sorted(values.items()):
+            families.setdefault(name, []).append(f"{name}{label_text(labels)} {number_text(value)}")
+        for (name, labels), (counts, total, n) in sorted(histograms.items()):
+            lines = families.setdefault(name, [])
+            for bound, count in zip(LATENCY_BUCKETS, counts):
+                lines.append(f"{name}_bucket{label_text(labels + (('le', number_text(bound)),))} {count}")
+            lines.append(f"{name}_bucket{label_text(labels + (('le', '+Inf'),))} {n}")
+            lines.append(f"{name}_sum{label_text(labels)} {number_text(total)}")
+            lines.append(f"{name}_count{label_text(labels)} {n}")
+        out = []
+        for name, lines in families.items():
+            kind, help_text = self.meta.get(name, ("untyped", ""))
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"] + lines
+        for name, kind, help_text, samples in extra:
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            out += [f"{name}{label_text(tuple(sorted(labels.items())))} {number_text(value)}" for labels, value in samples]
+        return "\n".join(out) + "\n"
+
+
+@contextmanager
+def profiled(path):
+    # Profiles the block into `path`: a pyinstrument HTML report when it ends
+    # in .html (pyinstrument is optional), cProfile stats otherwise, for
+    # `python -m pstats` or snakeviz. No path, no profiling.
+    if not path:
+        yield
+        return
+    if path.endswith(".html"):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            raise SystemExit("❌ .html profiles need pyinstrument installed; use a .prof path for cProfile")
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, "w") as f:
+                f.write(profiler.output_html())
+            print(f"🔬 Profile written to {path}")
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+        print(f"🔬 Profile written to {path}")
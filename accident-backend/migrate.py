@@ -0,0 +1,266 @@
+import argparse
+import sqlite3
+import time
+from urllib.parse import quote
+
+from geo import rebuild_points
+from metrics import ensure_metrics
+from rollup import CALENDAR_SQL
+from streets import rebuild_streets
+
+# Schema versions are tracked with PRAGMA user_version; each migration runs
+# once, in order, and bumps the version when it commits.
+BASE_COLUMNS = [
+    ("id", "TEXT NOT NULL"),
+    ("start_time", "TEXT"),
+    ("end_time", "TEXT"),
+    ("start_lat", "REAL"),
+    ("start_lng", "REAL"),
+    ("end_lat", "REAL"),
+    ("end_lng", "REAL"),
+    ("distance(mi)", "REAL"),
+    ("description", "TEXT"),
+    ("street", "TEXT"),
+    ("city", "TEXT"),
+    ("state", "TEXT"),
+    ("country", "TEXT"),
+    ("timezone", "TEXT"),
+    ("severity", "INTEGER"),
+]
+
+# Stored generated columns: SQLite fills them on every insert, so writers
+# only supply INSERT_COLUMNS (writer.py's staged executemany for the syncs,
+# csv_ingest.py behind load_to_db.py for the CSV).
+DERIVED_COLUMNS = [
+    ("start_ts", "INTEGER", "CAST(strftime('%s', start_time) AS INTEGER)"),
+    ("year", "INTEGER", CALENDAR_SQL["year"]),
+    ("month", "INTEGER", CALENDAR_SQL["month"]),
+    ("day", "INTEGER", CALENDAR_SQL["day"]),
+    ("hour", "INTEGER", CALENDAR_SQL["hour"]),
+    ("weekday", "TEXT", CALENDAR_SQL["weekday"]),
+    ("season", "TEXT", CALENDAR_SQL["season"]),
+]
+
+# Source ids are only unique within a city, so the key (and the unique index
+# behind it that ingest conflicts against) is (city, id).
+ACCIDENT_KEY = ("city", "id")
+
+ACCIDENT_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_accidents_state_city_ts ON accidents (state, city, start_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_accidents_state_city_calendar ON accidents (state, city, year, month, day)",
+]
+
+progress_table = "migration_progress"
+
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def accidents_ddl(table="accidents"):
+    columns = [f"{quote_ident(name)} {decl}" for name, decl in BASE_COLUMNS]
+    columns += [f"{name} {decl} GENERATED ALWAYS AS ({expr}) STORED" for name, decl, expr in DERIVED_COLUMNS]
+    columns.append(f"PRIMARY KEY ({', '.join(ACCIDENT_KEY)})")
+    return f"CREATE TABLE IF NOT EXISTS {table} (\n    " + ",\n    ".join(columns) + "\n)"
+
+
+def table_exists(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)).fetchone() is not None
+
+
+def table_columns(conn, name):
+    return [row[1] for row in conn.execute(f"PRAGMA table_xinfo({quote_ident(name)})")]
+
+
+def primary_key(conn, name):
+    pk = sorted((row[5], row[1]) for row in conn.execute(f"PRAGMA table_info({quote_ident(name)})") if row[5])
+    return tuple(col for _, col in pk)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def backfill(conn, version, source, batch_size, log):
+    # Copy rowid ranges one committed batch at a time and remember the last
+    # rowid copied, so an interrupted run picks up where it stopped.
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {progress_table} (version INTEGER PRIMARY KEY, last_rowid INTEGER)")
+    row = conn.execute(f"SELECT last_rowid FROM {progress_table} WHERE version=?", (version,)).fetchone()
+    last_rowid = row[0] if row else 0
+
+    legacy_columns = set(table_columns(conn, source))
+    columns = ", ".join(quote_ident(name) for name, _ in BASE_COLUMNS if name in legacy_columns)
+    total = conn.execute(f"SELECT COUNT(*) FROM {source} WHERE rowid > ?", (last_rowid,)).fetchone()[0]
+    copied = skipped = 0
+    while True:
+        upper = conn.execute(
+            f"SELECT MAX(rowid) FROM (SELECT rowid FROM {source} WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+            (last_rowid, batch_size)).fetchone()[0]
+        if upper is None:
+            break
+        batch_rows = conn.execute(f"SELECT COUNT(*) FROM {source} WHERE rowid > ? AND rowid <= ?",
+                                  (last_rowid, upper)).fetchone()[0]
+        cur = conn.execute(
+            f"INSERT OR IGNORE INTO accidents ({columns}) SELECT {columns} FROM {source} WHERE rowid > ? AND rowid <= ?",
+            (last_rowid, upper))
+        copied += cur.rowcount
+        skipped += batch_rows - cur.rowcount
+        last_rowid = upper
+        conn.execute(f"INSERT OR REPLACE INTO {progress_table} (version, last_rowid) VALUES (?, ?)",
+                     (version, last_rowid))
+        conn.commit()
+        log(f"➡️ Backfilled {copied + skipped}/{total} rows")
+    return copied, skipped
+
+
+def rebuild_accidents(conn, version, batch_size, log, outdated):
+    # Tables can't be re-keyed in place: move the old one aside, create the
+    # current schema and copy rows across. A leftover accidents_legacy means
+    # an earlier run was interrupted, so resume its backfill.
+    if table_exists(conn, "accidents") and outdated(conn) and not table_exists(conn, "accidents_legacy"):
+        conn.execute("ALTER TABLE accidents RENAME TO accidents_legacy")
+    conn.execute(accidents_ddl())
+    conn.commit()
+
+    if table_exists(conn, "accidents_legacy"):
+        copied, skipped = backfill(conn, version, "accidents_legacy", batch_size, log)
+        if skipped:
+            log(f"⚠️ Skipped {skipped} rows with a missing or duplicate (city, id)")
+        conn.execute("DROP TABLE accidents_legacy")
+        conn.execute(f"DELETE FROM {progress_table} WHERE version=?", (version,))
+
+
+def migrate_accidents_schema(conn, version, batch_size, log):
+    rebuild_accidents(conn, version, batch_size, log, lambda c: "start_ts" not in table_columns(c, "accidents"))
+
+
+def create_accident_indexes(conn, version, batch_size, log):
+    # Superseded by the composite indexes below
+    conn.execute("DROP INDEX IF EXISTS idx_accidents_state_city")
+    for ddl in ACCIDENT_INDEXES:
+        conn.execute(ddl)
+
+
+def rekey_accidents(conn, version, batch_size, log):
+    rebuild_accidents(conn, version, batch_size, log, lambda c: primary_key(c, "accidents") != ACCIDENT_KEY)
+    for ddl in ACCIDENT_INDEXES:
+        conn.execute(ddl)
+
+
+def extend_etl_logs(conn, version, batch_size, log):
+    conn.execute("CREATE TABLE IF NOT EXISTS etl_logs (run_time TEXT, city TEXT, state TEXT, source TEXT, inserted_rows INTEGER)")
+    if "skipped_rows" not in table_columns(conn, "etl_logs"):
+        conn.execute("ALTER TABLE etl_logs ADD COLUMN skipped_rows INTEGER")
+
+
+def etl_stage_timings(conn, version, batch_size, log):
+    columns = table_columns(conn, "etl_logs")
+    if "fetched_rows" not in columns:
+        conn.execute("ALTER TABLE etl_logs ADD COLUMN fetched_rows INTEGER")
+    if "stage_timings" not in columns:
+        conn.execute("ALTER TABLE etl_logs ADD COLUMN stage_timings TEXT")
+
+
+def index_streets(conn, version, batch_size, log):
+    if "street_id" not in table_columns(conn, "accidents"):
+        conn.execute("ALTER TABLE accidents ADD COLUMN street_id INTEGER")
+    rebuild_streets(conn, batch_size, log)
+
+
+def index_points(conn, version, batch_size, log):
+    if "cell" not in table_columns(conn, "accidents"):
+        conn.execute("ALTER TABLE accidents ADD COLUMN cell INTEGER")
+    rebuild_points(conn, batch_size, log)
+
+
+def etl_metrics(conn, version, batch_size, log):
+    columns = table_columns(conn, "etl_logs")
+    for name, decl in (("fetched_bytes", "INTEGER"), ("wall_seconds", "REAL"), ("http_seconds", "REAL"),
+                       ("pandas_seconds", "REAL"), ("db_seconds", "REAL")):
+        if name not in columns:
+            conn.execute(f"ALTER TABLE etl_logs ADD COLUMN {name} {decl}")
+    ensure_metrics(conn)
+
+
+MIGRATIONS = [
+    (1, "explicit accidents schema with epoch and calendar columns", migrate_accidents_schema),
+    (2, "composite (state, city, time) indexes", create_accident_indexes),
+    (3, "key accidents on (city, id)", rekey_accidents),
+    (4, "skipped row counts in etl_logs", extend_etl_logs),
+    (5, "fetched rows and per-stage timings in etl_logs", etl_stage_timings),
+    (6, "street dictionary, accidents.street_id and street_rollup", index_streets),
+    (7, "grid cells on accidents and the accident_points R*Tree", index_points),
+    (8, "bytes, wall time and http/pandas/db seconds in etl_logs; per-stage etl_metrics", etl_metrics),
+]
+
+
+def apply_migrations(conn, batch_size=50_000, log=print):
+    current = schema_version(conn)
+    applied = []
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        log(f"🔄 Migration {version}: {description}")
+        migration(conn, version, batch_size, log)
+        conn.execute(f"PRAGMA user_version = {version}")
+        conn.commit()
+        applied.append(version)
+    return applied
+
+
+def time_endpoints(db_path, repeat=3):
+    import app
+
+    app.DB_PATH = db_path
+    conn = sqlite3.connect(db_path)
+    row = conn.execute("SELECT state, city FROM accidents GROUP BY state, city ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    conn.close()
+    if row is None:
+        return {}
+    state, city = row
+    analytics = f"/api/analytics?state={quote(state)}&city={quote(city)}"
+    cases = [
+        ("/api/states", "/api/states", None),
+        ("/api/cities", f"/api/cities?state={quote(state)}", None),
+        ("/api/analytics (pandas)", analytics, "pandas"),
+        ("/api/analytics (sql)", analytics, "sql"),
+        ("/api/analytics year (sql)", analytics + "&year=2020", "sql"),
+    ]
+    timings = {}
+    backend = app.ANALYTICS_BACKEND
+    # Time the queries themselves, not the response cache
+    cache_backend, app.response_cache.backend = app.response_cache.backend, None
+    with app.app.test_client() as client:
+        for name, url, case_backend in cases:
+            app.ANALYTICS_BACKEND = case_backend or backend
+            best = None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                client.get(url)
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+    app.ANALYTICS_BACKEND = backend
+    app.response_cache.backend = cache_backend
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply schema migrations to accidents.db")
+    parser.add_argument("--db", default="accidents.db")
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    parser.add_argument("--benchmark", action="store_true", help="time the API endpoints before and after migrating")
+    args = parser.parse_args()
+
+    before = time_endpoints(args.db) if args.benchmark else {}
+    conn = sqlite3.connect(args.db)
+    applied = apply_migrations(conn, args.batch_size)
+    version = schema_version(conn)
+    conn.close()
+    print(f"✅ Schema at version {version}" + (f" (applied {applied})" if applied else " (up to date)"))
+
+    if args.benchmark:
+        after = time_endpoints(args.db)
+        print(f"{'endpoint':<28}{'before ms':>12}{'after ms':>12}")
+        for name, elapsed in after.items():
+            print(f"{name:<28}{before.get(name, float('nan')) * 1000:>12.1f}{elapsed * 1000:>12.1f}")
@@ -0,0 +1,120 @@
+import json
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Local stand-in for a Socrata resource endpoint. Records are loaded into an
+# in-memory SQLite table so $where/$order/$limit/$offset behave like SoQL for
+# the simple comparisons the sync scripts send. Columns use NUMERIC affinity
+# so numeric ids compare as numbers and timestamps as text, like Socrata.
+# `latency` and `fail()` simulate a slow or throttling portal.
+
+
+class MockSocrata:
+    def __init__(self, datasets=None, latency=0.0):
+        self.datasets = {}
+        self.lock = threading.Lock()
+        self.latency = latency
+        self.failures = []
+        self.requests_served = 0
+        self.rows_served = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.server = None
+        for path, records in (datasets or {}).items():
+            self.load(path, records)
+
+    def load(self, path, records):
+        with self.lock:
+            self.datasets[path] = list(records)
+
+    def append(self, path, records):
+        with self.lock:
+            self.datasets.setdefault(path, []).extend(records)
+
+    def fail(self, status, count=1):
+        # The next `count` requests answer with `status` instead of data
+        with self.lock:
+            self.failures.extend([status] * count)
+
+    def query(self, path, params):
+        with self.lock:
+            records = list(self.datasets.get(path, []))
+        columns = sorted({key for record in records for key in record})
+        db = sqlite3.connect(":memory:")
+        db.execute("CREATE TABLE resource (_row INTEGER, " + ", ".join(f'"{c}" NUMERIC' for c in columns) + ")"
+                   if columns else "CREATE TABLE resource (_row INTEGER)")
+        if columns:
+            placeholders = ", ".join("?" * (len(columns) + 1))
+            db.executemany(f"INSERT INTO resource VALUES ({placeholders})", [
+                [i] + [json.dumps(r[c]) if isinstance(r.get(c), (dict, list)) else r.get(c) for c in columns]
+                for i, r in enumerate(records)
+            ])
+        sql = "SELECT _row FROM resource"
+        if params.get("$where"):
+            sql += f" WHERE {params['$where']}"
+        if params.get("$order"):
+            sql += f" ORDER BY {params['$order']}"
+        sql += f" LIMIT {int(params.get('$limit', 1000))} OFFSET {int(params.get('$offset', 0))}"
+        rows = [records[i] for (i,) in db.execute(sql)]
+        db.close()
+        return rows
+
+    def start(self, port=0):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with mock.lock:
+                    mock.in_flight += 1
+                    mock.max_in_flight = max(mock.max_in_flight, mock.in_flight)
+                    status = mock.failures.pop(0) if mock.failures else None
+                try:
+                    time.sleep(mock.latency)
+                finally:
+                    # Released before the reply goes out: a client that has read
+                    # it may send its next request before this thread returns
+                    with mock.lock:
+                        mock.in_flight -= 1
+                if status is None:
+                    self.respond()
+                else:
+                    self.send_response(status)
+                    self.send_header("Retry-After", "0")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+
+            def respond(self):
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                try:
+                    rows = mock.query(parsed.path, params)
+                except sqlite3.Error as e:
+                    self.send_response(400)
+                    self.end_headers()
+                    self.wfile.write(str(e).encode())
+                    return
+                with mock.lock:
+                    mock.requests_served += 1
+                    mock.rows_served += len(rows)
+                body = json.dumps(rows).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
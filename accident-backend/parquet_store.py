@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote
+
+from generation import current_generation
+from migrate import quote_ident
+from rollup import ANALYTICS_DIMENSIONS, STORED_CALENDAR
+from sql_analytics import build_filters
+from streets import street_index_exists, street_table
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Optional columnar copy of `accidents` for the "parquet" analytics backend:
+# zstd-compressed Parquet files partitioned as state=/city=/year=, holding
+# only the columns the API and dashboard read. State and city live in the
+# directory names; street (the normalised name from the street index),
+# weekday and season are dictionary-encoded by the writer. Queries run in
+# an embedded DuckDB over just the city's (and year's) files, reading only
+# the columns they select.
+#
+# manifest.json lists the files per state, city and year and the DB
+# generation they match; a stale store is not used. export_parquet()
+# appends the rows above the last exported rowid as new files and compacts
+# a partition once it has collected COMPACT_FILES of them; etl.py runs it
+# after every sync once the store has been built with
+# `python parquet_store.py`.
+
+manifest_name = "manifest.json"
+EXPORT_ROWS = 1_000_000
+COMPACT_FILES = 16
+PARQUET_OPTIONS = "FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE 122880"
+# Stored columns and their Parquet types, fixed so every file has one schema
+# (a chunk whose streets are all NULL would otherwise be typed INTEGER)
+EXPORT_COLUMNS = [
+    ("state", "VARCHAR"), ("city", "VARCHAR"), ("year", "INTEGER"), ("id", "VARCHAR"), ("start_ts", "BIGINT"),
+    ("month", "TINYINT"), ("day", "TINYINT"), ("hour", "TINYINT"), ("weekday", "VARCHAR"), ("season", "VARCHAR"),
+    ("start_lat", "DOUBLE"), ("start_lng", "DOUBLE"), ("severity", "INTEGER"), ("street", "VARCHAR"),
+]
+
+
+def parquet_dir(db_path):
+    return os.environ.get("PARQUET_STORE_DIR") or f"{db_path}.parquet"
+
+
+def store_exists(path):
+    return os.path.exists(os.path.join(path, manifest_name))
+
+
+def load_manifest(path):
+    try:
+        with open(os.path.join(path, manifest_name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_manifest(path, manifest):
+    tmp = os.path.join(path, manifest_name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(path, manifest_name))
+
+
+def literal(path):
+    return "'" + path.replace("'", "''") + "'"
+
+
+def partition_of(relpath):
+    # "state=NY/city=New%20York/year=2021/rows-1-9-0.parquet" -> ("NY", "New York", "2021")
+    parts = dict(part.split("=", 1) for part in relpath.split("/")[:-1])
+    return unquote(parts["state"]), unquote(parts["city"]), unquote(parts["year"])
+
+
+def export_select(conn):
+    street = "s.name" if street_index_exists(conn) else "a.street"
+    join = f"LEFT JOIN {street_table} s USING (street_id)" if street_index_exists(conn) else ""
+    return f"""
+        SELECT {', '.join(f'a.{quote_ident(name)}' for name, _ in EXPORT_COLUMNS[:-1])}, {street} AS street
+        FROM accidents a {join}
+        WHERE a.rowid > ? AND a.rowid <= ? AND a.year IS NOT NULL AND a.state IS NOT NULL AND a.city IS NOT NULL
+    """
+
+
+def copy_files(con, query, path, pattern):
+    # Writes the query's rows partitioned under `path`; the new files' paths relative to it
+    result = con.execute(f"""
+        COPY ({query}) TO {literal(path)}
+        ({PARQUET_OPTIONS}, PARTITION_BY (state, city, year), FILENAME_PATTERN '{pattern}', OVERWRITE_OR_IGNORE,
+         RETURN_FILES)
+    """).fetchone()
+    return [os.path.relpath(name, path) for name in result[1]]
+
+
+def compact(con, path, files):
+    # One time-ordered file in place of a partition's many small ones
+    first = os.path.join(path, files[0])
+    target = os.path.join(os.path.dirname(first), f"compact-{time.time_ns()}.parquet")
+    sources = ", ".join(literal(os.path.join(path, name)) for name in files)
+    con.execute(f"COPY (SELECT * FROM read_parquet([{sources}]) ORDER BY start_ts) TO {literal(target)} "
+                f"({PARQUET_OPTIONS})")
+    return os.path.relpath(target, path)
+
+
+def export_parquet(conn, path, log=print):
+    # Bring the store at `path` up to date with the committed rows; builds it
+    # from scratch when there is none or rowids went backwards (the table was
+    # rebuilt). Rows deleted in place need --rebuild.
+    if duckdb is None:
+        raise SystemExit("❌ The Parquet store needs duckdb: pip install duckdb")
+    import pandas as pd
+    generation = current_generation(conn)
+    manifest = load_manifest(path)
+    upto = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM accidents").fetchone()[0]
+    if manifest is None or upto < manifest["last_rowid"]:
+        shutil.rmtree(path, ignore_errors=True)
+        manifest = {"last_rowid": 0, "partitions": {}}
+    os.makedirs(path, exist_ok=True)
+    con = duckdb.connect()
+    select = export_select(conn)
+    typed = ", ".join(f"CAST({name} AS {kind}) AS {name}" for name, kind in EXPORT_COLUMNS)
+    written = 0
+    touched = set()
+    for lo in range(manifest["last_rowid"], upto, EXPORT_ROWS):
+        hi = min(lo + EXPORT_ROWS, upto)
+        chunk = pd.read_sql(select, conn, params=(lo, hi))
+        if chunk.empty:
+            continue
+        con.register("chunk", chunk)
+        for name in copy_files(con, f"SELECT {typed} FROM chunk ORDER BY start_ts", path, f"rows-{lo}-{hi}-{{i}}"):
+            state, city, year = partition_of(name)
+            manifest["partitions"].setdefault(state, {}).setdefault(city, {}).setdefault(year, []).append(name)
+            touched.add((state, city, year))
+        con.unregister("chunk")
+        written += len(chunk)
+        log(f"➡️ {written} rows exported to Parquet")
+    removed = []
+    for state, city, year in touched:
+        years = manifest["partitions"][state][city]
+        if len(years[year]) >= COMPACT_FILES:
+            removed += years[year]
+            years[year] = [compact(con, path, years[year])]
+    con.close()
+    manifest.update(last_rowid=upto, generation=generation)
+    save_manifest(path, manifest)
+    for name in removed:
+        try:
+            os.remove(os.path.join(path, name))
+        except FileNotFoundError:
+            pass
+    log(f"🧱 Parquet store at generation {generation}: {written} rows appended to {len(touched)} partitions")
+    return written
+
+
+def store_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+class ParquetStore:
+    # The manifest of one store directory and a DuckDB database to query it
+    # with; reloaded when the manifest changes
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.manifest = None
+        self.con = duckdb.connect()
+
+    def current(self):
+        try:
+            stamp = os.stat(os.path.join(self.path, manifest_name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            if stamp != self.stamp:
+                self.manifest = load_manifest(self.path)
+                self.stamp = stamp
+            return self.manifest
+
+    def files(self, manifest, state, city, year=None):
+        # Partition pruning: only the city's files, or one year of them
+        years = manifest["partitions"].get(state, {}).get(city, {})
+        if year:
+            years = {str(int(year)): years.get(str(int(year)), [])}
+        return [os.path.join(self.path, name) for names in years.values() for name in names]
+
+    def query(self, files, sql, params):
+        # A cursor is a separate DuckDB connection, safe to use per thread
+        cur = self.con.cursor()
+        try:
+            return cur.execute(sql.format(source="read_parquet(?, hive_partitioning = true)"), [files, *params]).fetchall()
+        finally:
+            cur.close()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path):
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ParquetStore(path)
+        return _stores[path]
+
+
+def current_store(path, generation):
+    # The store and its manifest, or None when duckdb is missing or the
+    # store is missing or behind the DB generation
+    if duckdb is None:
+        return None, None
+    store = get_store(path)
+    manifest = store.current()
+    if manifest is None or manifest.get("generation") != generation:
+        return None, None
+    return store, manifest
+
+
+def query_analytics(path, generation, state, city, year=None, month=None, day=None, season=None):
+    # Same shape as rollup.query_analytics(): {key: [(label, count)]}, one
+    # GROUPING SETS scan over the city's files; None to fall back
+    store, manifest = current_store(path, generation)
+    if store is None:
+        return None
+    result = {key: [] for key, _ in ANALYTICS_DIMENSIONS}
+    files = store.files(manifest, state, city, year)
+    if not files:
+        return result
+    cols = [col for _, col in ANALYTICS_DIMENSIONS]
+    where_sql, params = build_filters(STORED_CALENDAR, state, city, year, month, day, season)
+    sql = f"""
+        SELECT GROUPING({', '.join(cols)}) AS g, {', '.join(cols)}, COUNT(*)
+        FROM {{source}} WHERE {where_sql}
+        GROUP BY GROUPING SETS ({', '.join(f'({col})' for col in cols)})
+    """
+    try:
+        rows = store.query(files, sql, params)
+    except duckdb.IOException:
+        # A file compacted away under this request
+        return None
+    for row in rows:
+        # The one dimension grouped on is the zero bit of g
+        i = next(i for i in range(len(cols)) if not row[0] >> (len(cols) - 1 - i) & 1)
+        result[ANALYTICS_DIMENSIONS[i][0]].append((row[1 + i], row[-1]))
+    return {key: sorted(pairs) for key, pairs in result.items()}
+
+
+def query_top_streets(path, generation, state, city, limit=10, year=None, month=None, day=None, season=None):
+    # [(name, accidents)] as streets.top_streets(), or None to fall back
+    store, manifest = current_store(path, generation)
+    if store is None:
+        return None
+    files = store.files(manifest, state, city, year)
+    if not files:
+        return []
+    where_sql, params = build_filters(STORED_CALENDAR, state, city, year, month, day, season)
+    sql = f"""
+        SELECT street, COUNT(*) AS n FROM {{source}}
+        WHERE {where_sql} AND street IS NOT NULL GROUP BY street ORDER BY n DESC, street LIMIT ?
+    """
+    try:
+        return store.query(files, sql, params + [int(limit)])
+    except duckdb.IOException:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the partitioned Parquet store of accidents")
+    parser.add_argument("--db", default="accidents.db")
+    parser.add_argument("--out", help="store directory; default PARQUET_STORE_DIR or <db>.parquet")
+    parser.add_argument("--rebuild", action="store_true", help="discard the existing store first")
+    args = parser.parse_args()
+
+    out = args.out or parquet_dir(args.db)
+    if args.rebuild and os.path.isdir(out):
+        shutil.rmtree(out)
+    conn = sqlite3.connect(args.db)
+    started = time.perf_counter()
+    export_parquet(conn, out)
+    conn.close()
+    print(f"✅ Parquet store written to {out} in {time.perf_counter() - started:.1f}s: "
+          f"{store_bytes(out) / 1e6:.1f} MB vs {os.path.getsize(args.db) / 1e6:.1f} MB SQLite")
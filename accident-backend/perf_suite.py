@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import app
+import csv_ingest
+import dashboard_queries
+import db
+import etl
+import parquet_store
+from benchmarks import best_of
+from migrate import apply_migrations
+from rollup import ensure_rollup
+from snapshot import refresh_snapshot, snapshot_dir
+from synthetic import SCALES, generate_chunks, generate_socrata_pages, scale_rows, write_scaled_db
+
+# Reproducible performance regression suite. Builds a seeded synthetic
+# database at the chosen scale, times each ingest and read path below and
+# writes the results as JSON; --baseline compares a run with an earlier
+# file and exits non-zero when any case got slower than --tolerance allows.
+#
+#   load.*       load_to_db.py (streaming, --bulk and --workers) on a
+#                synthetic CSV
+#   etl.*        the Socrata pipeline (normalise -> dedupe -> write) on
+#                synthetic pages, the path the old clean_and_insert took
+#   api.*        get_data and the /api/* routes, response cache off; the
+#                parquet cases run when duckdb is installed
+#   streamlit.*  the dashboard queries from dashboard_queries.py
+#
+# Read cases report the best of --repeat runs; load cases build a fresh
+# database each time, so they run once.
+
+# Rows fed to the load and pipeline cases at most, so large scales spend
+# their time on the read cases rather than re-loading
+LOAD_ROWS = 200_000
+PIPELINE_ROWS = 50_000
+# Processes for load.parallel
+LOAD_WORKERS = min(4, os.cpu_count() or 1)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+
+def write_csv(path, rows, seed):
+    for i, chunk in enumerate(generate_chunks(rows, seed, chunk_rows=100_000)):
+        chunk.to_csv(path, mode="a", header=i == 0, index=False)
+
+
+def load_cases(tmp, rows, seed):
+    path = os.path.join(tmp, "load.csv")
+    write_csv(path, rows, seed)
+    quiet = lambda message: None
+    yield "load.stream", rows, lambda: csv_ingest.load_csv(path, os.path.join(tmp, "stream.db"), 100_000, quiet)
+    yield "load.bulk", rows, lambda: csv_ingest.bulk_load(path, os.path.join(tmp, "bulk.db"), 100_000, quiet)
+    yield "load.parallel", rows, lambda: csv_ingest.parallel_load(path, os.path.join(tmp, "parallel.db"), 50_000,
+                                                                   LOAD_WORKERS, quiet)
+
+
+def pipeline_cases(tmp, rows, seed):
+    source = etl.SOURCES["Austin"]
+    pages = list(generate_socrata_pages(source, rows, 1000, seed))
+
+    def sync():
+        conn = db.write_connection(os.path.join(tmp, f"etl-{time.perf_counter_ns()}.db"))
+        apply_migrations(conn, log=lambda message: None)
+        ensure_rollup(conn)
+        ctx = etl.RunContext(conn, source, "2025-01-01")
+        pipeline = etl.Pipeline()
+        for page in pages:
+            pipeline.process(ctx, page)
+            conn.commit()
+        conn.close()
+
+    yield "etl.pipeline", rows, sync
+
+
+def read_cases(path):
+    conn = db.connect(path)
+    state, city, year = conn.execute("SELECT state, city, MAX(year) FROM accidents GROUP BY state, city "
+                                     "ORDER BY COUNT(*) DESC LIMIT 1").fetchone()
+    city_rows = conn.execute("SELECT COUNT(*) FROM accidents WHERE state = ? AND city = ?", (state, city)).fetchone()[0]
+    client = app.app.test_client()
+    query = {"state": state, "city": city}
+
+    def get(url, backend=None, **params):
+        def request():
+            app.ANALYTICS_BACKEND = backend or "rollup"
+            response = client.get(url, query_string={**query, **params})
+            assert response.status_code == 200, (url, response.status_code)
+        return request
+
+    yield "api.get_data", city_rows, lambda: app.get_data(state, city)
+    for backend in ("pandas", "sql", "rollup", "snapshot") + (("parquet",) if parquet_store.duckdb else ()):
+        yield f"api.analytics.{backend}", city_rows, get("/api/analytics", backend)
+        yield f"api.analytics.{backend}.year", city_rows, get("/api/analytics", backend, year=year)
+    yield "api.analytics.rollup.day", city_rows, get("/api/analytics", year=year, month=6, day=15)
+    yield "api.analytics.snapshot.day", city_rows, get("/api/analytics", "snapshot", year=year, month=6, day=15)
+    yield "api.batch.month", city_rows, get("/api/analytics/batch", year=year, expand="month")
+    yield "api.streets", city_rows, get("/api/streets")
+    yield "api.streets.year", city_rows, get("/api/streets", year=year)
+    if parquet_store.duckdb:
+        yield "api.streets.parquet", city_rows, get("/api/streets", "parquet")
+        yield "api.streets.parquet.year", city_rows, get("/api/streets", "parquet", year=year)
+    lat, lng = conn.execute("SELECT AVG(start_lat), AVG(start_lng) FROM accidents WHERE state = ? AND city = ?",
+                            (state, city)).fetchone()
+    bbox = f"{lng - 0.5},{lat - 0.5},{lng + 0.5},{lat + 0.5}"
+    yield "api.heatmap", city_rows, get("/api/heatmap", bbox=bbox, zoom=11)
+    yield "streamlit.version", 1, lambda: dashboard_queries.data_version(conn)
+    yield "streamlit.states", 1, lambda: dashboard_queries.states(conn)
+    yield "streamlit.cities", 1, lambda: dashboard_queries.cities(conn, state)
+    yield "streamlit.counts", city_rows, lambda: dashboard_queries.city_counts(conn, state, city)
+    yield "streamlit.top_streets", city_rows, lambda: dashboard_queries.city_top_streets(conn, state, city)
+
+
+def run_suite(scale, seed, repeat, only=None, log=print):
+    rows = scale_rows(scale)
+    results = {}
+
+    def wanted(name):
+        return not only or any(name.startswith(prefix) or prefix.startswith(name) for prefix in only)
+
+    def record(name, case_rows, fn, case_repeat):
+        if not wanted(name):
+            return
+        seconds, _ = best_of(fn, case_repeat)
+        results[name] = {"seconds": round(seconds, 6), "rows": case_rows,
+                         "rows_per_s": round(case_rows / seconds) if seconds else None}
+        log(f"{name:<28}{seconds * 1000:>12.2f} ms{case_rows / seconds if seconds else 0:>14.0f} rows/s")
+
+    backend, cache_backend = app.ANALYTICS_BACKEND, app.response_cache.backend
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "suite.db")
+        started = time.perf_counter()
+        write_scaled_db(path, rows, seed, log=lambda message: None)
+        conn = sqlite3.connect(path)
+        refresh_snapshot(conn, snapshot_dir(path), log=lambda message: None)
+        if parquet_store.duckdb:
+            parquet_store.export_parquet(conn, parquet_store.parquet_dir(path), log=lambda message: None)
+        conn.close()
+        log(f"🧪 {rows} synthetic rows (seed {seed}) built in {time.perf_counter() - started:.1f}s")
+        if wanted("load"):
+            for name, case_rows, fn in load_cases(tmp, min(rows, LOAD_ROWS), seed):
+                record(name, case_rows, fn, 1)
+        if wanted("etl"):
+            for name, case_rows, fn in pipeline_cases(tmp, min(rows, PIPELINE_ROWS), seed):
+                record(name, case_rows, fn, 1)
+        app.DB_PATH = path
+        app.response_cache.backend = None
+        try:
+            for name, case_rows, fn in read_cases(path):
+                record(name, case_rows, fn, repeat)
+        finally:
+            app.ANALYTICS_BACKEND, app.response_cache.backend = backend, cache_backend
+            db.close_pool()
+    return {
+        "meta": {"scale": scale, "rows": rows, "seed": seed, "repeat": repeat, "commit": git_commit(),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "started": datetime.now().isoformat(timespec="seconds")},
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance, min_delta_ms):
+    # Cases slower than baseline * (1 + tolerance), ignoring differences
+    # under min_delta_ms, which are timer noise for the fast queries.
+    if baseline["meta"].get("rows") != report["meta"]["rows"]:
+        print(f"⚠️ Baseline was run at {baseline['meta'].get('scale')}, this run at {report['meta']['scale']}")
+    regressions = []
+    print(f"{'case':<28}{'baseline ms':>13}{'now ms':>10}{'change':>9}")
+    for name, result in report["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<28}{'-':>13}{result['seconds'] * 1000:>10.2f}{'new':>9}")
+            continue
+        change = result["seconds"] / before["seconds"] - 1 if before["seconds"] else 0.0
+        slower = change > tolerance and (result["seconds"] - before["seconds"]) * 1000 > min_delta_ms
+        if slower:
+            regressions.append(name)
+        print(f"{name:<28}{before['seconds'] * 1000:>13.2f}{result['seconds'] * 1000:>10.2f}{change:>+9.0%}"
+              + ("  ❌" if slower else ""))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Seeded performance regression suite")
+    parser.add_argument("--scale", default="100k", help=f"one of {', '.join(SCALES)} or a row count")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per read case; the best is kept")
+    parser.add_argument("--only", help="comma-separated case prefixes, e.g. api.analytics,streamlit")
+    parser.add_argument("--json", help="write the results here")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before failing (0.25 = 25%%)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.scale, args.seed, args.repeat, args.only.split(",") if args.only else None)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"📝 Results written to {args.json}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance, args.min_delta_ms)
+        if regressions:
+            print(f"❌ {len(regressions)} cases regressed: {', '.join(regressions)}")
+            return 1
+        print("✅ No regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
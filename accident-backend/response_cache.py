@@ -0,0 +1,205 @@
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import Response, g, make_response, request
+
+# Caches API responses keyed by route and normalised query parameters.
+# Every entry remembers the DB generation it was computed at; once the ETL
+# bumps the generation, older entries are treated as misses. Entries also
+# expire after a TTL as a backstop for writers that don't bump it.
+#
+# "memory" is a per-process LRU. "disk" keeps entries in a small SQLite file
+# so several gunicorn workers share them. Hit/miss counters are per process.
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def set(self, key, entry):
+        # Returns how many entries were evicted to make room
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            evicted = 0
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class DiskBackend:
+    name = "disk"
+
+    def __init__(self, path="response_cache.db", max_entries=4096):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        conn = self.conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS responses "
+                     "(key TEXT PRIMARY KEY, generation INTEGER, created REAL, etag TEXT, body BLOB, mimetype TEXT)")
+        conn.commit()
+
+    def conn(self):
+        if getattr(self.local, "conn", None) is None:
+            self.local.conn = sqlite3.connect(self.path, timeout=5)
+        return self.local.conn
+
+    def get(self, key):
+        row = self.conn().execute("SELECT generation, created, etag, body, mimetype FROM responses WHERE key=?",
+                                  (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, key, entry):
+        # Oldest-first once over max_entries; a shared file can't track LRU
+        # order without a write on every hit.
+        conn = self.conn()
+        conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, *entry))
+        cur = conn.execute("DELETE FROM responses WHERE key IN "
+                           "(SELECT key FROM responses ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                           (self.max_entries,))
+        conn.commit()
+        return cur.rowcount
+
+    def delete(self, key):
+        conn = self.conn()
+        conn.execute("DELETE FROM responses WHERE key=?", (key,))
+        conn.commit()
+
+    def clear(self):
+        conn = self.conn()
+        conn.execute("DELETE FROM responses")
+        conn.commit()
+
+    def __len__(self):
+        return self.conn().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    def __init__(self, backend, ttl, generation):
+        # generation() returns the DB's current generation counter
+        self.backend = backend
+        self.ttl = ttl
+        self.generation = generation
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "not_modified": 0}
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.stats[name] += n
+
+    def lookup(self, key, generation):
+        entry = self.backend.get(key)
+        if entry is None:
+            self.count("misses")
+            return None
+        entry_generation, created = entry[:2]
+        if entry_generation != generation or time.time() - created > self.ttl:
+            self.backend.delete(key)
+            self.count("stale")
+            self.count("misses")
+            return None
+        self.count("hits")
+        return entry
+
+    def store(self, key, generation, body, mimetype="application/json"):
+        etag = hashlib.sha1(body).hexdigest()
+        entry = (generation, time.time(), etag, body, mimetype)
+        self.count("evictions", self.backend.set(key, entry))
+        return entry
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+        return {"backend": self.backend.name if self.backend else "off", "ttl": self.ttl,
+                "entries": len(self.backend) if self.backend else 0, "generation": self.generation(),
+                "pid": os.getpid(), **stats}
+
+
+def cache_key(path, args):
+    # The parameters exactly as the views read them, in name order: only
+    # empty ones, which every view treats as absent, are dropped, so
+    # ?state=TX&city=Austin and ?city=Austin&state=TX&day= share an entry.
+    # Repeated parameters (the batch endpoint's filter=) keep their order.
+    params = [urlencode({name: value}) for name in sorted(args) for value in args.getlist(name) if value]
+    return path + "?" + "&".join(params)
+
+
+def make_cache(generation):
+    kind = os.environ.get("RESPONSE_CACHE", "memory")
+    ttl = float(os.environ.get("RESPONSE_CACHE_TTL", 300))
+    size = int(os.environ.get("RESPONSE_CACHE_SIZE", 512))
+    if kind == "disk":
+        backend = DiskBackend(os.environ.get("RESPONSE_CACHE_PATH", "response_cache.db"), size)
+    elif kind == "memory":
+        backend = MemoryBackend(size)
+    else:
+        backend = None
+    return ResponseCache(backend, ttl, generation)
+
+
+def cached_response(entry):
+    _, _, etag, body, mimetype = entry
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # Let browsers keep the body but revalidate it every time (304 if unchanged)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+def cached(cache, vary=None):
+    # Wraps a Flask view. vary() names the representation chosen from the
+    # request headers (e.g. the negotiated format) and becomes part of the key.
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # g.cache_result labels the request in the /metrics counters
+            if cache.backend is None:
+                g.cache_result = "off"
+                return view(*args, **kwargs)
+            key = cache_key(request.path, request.args)
+            if vary is not None:
+                key += f"#{vary()}"
+            generation = cache.generation()
+            entry = cache.lookup(key, generation)
+            g.cache_result = "miss" if entry is None else "hit"
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                entry = cache.store(key, generation, response.get_data(), response.mimetype)
+            response = cached_response(entry)
+            if response.status_code == 304:
+                cache.count("not_modified")
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,184 @@
+import gzip
+import json
+
+from flask import Response, request
+
+# Encodings for /api/analytics. "chartjs" is the original payload with the
+# Chart.js styling baked into every dataset; the compact formats carry only
+# typed label and count arrays per dimension and leave styling to the client.
+# A format is picked with ?format= or, failing that, the Accept header.
+# MessagePack and Arrow need the optional msgpack / pyarrow packages.
+
+CHART_STYLE = {
+    "backgroundColor": "rgba(75, 192, 192, 0.6)",
+    "borderColor": "rgba(75, 192, 192, 1)",
+    "borderWidth": 1,
+}
+
+MIMETYPES = {
+    "chartjs": "application/json",
+    "compact": "application/vnd.accidents.compact+json",
+    "msgpack": "application/msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+ACCEPT_FORMATS = {mimetype: name for name, mimetype in MIMETYPES.items()}
+ACCEPT_FORMATS["application/x-msgpack"] = "msgpack"
+
+# Smaller bodies aren't worth the compression overhead
+COMPRESS_MIN_BYTES = 512
+
+
+class FormatUnavailable(Exception):
+    pass
+
+
+def negotiate():
+    # Returns a key of MIMETYPES, or None for an unknown ?format=
+    name = request.args.get("format")
+    if name:
+        return name if name in MIMETYPES else None
+    # application/json comes first so */* keeps getting the original payload
+    best = request.accept_mimetypes.best_match(["application/json"] + [m for m in ACCEPT_FORMATS if m != "application/json"])
+    return ACCEPT_FORMATS.get(best, "chartjs")
+
+
+def plain(value):
+    # numpy scalars from the pandas backend -> int/str
+    return value.item() if hasattr(value, "item") else value
+
+
+def serialize_counts(labels, values, label_name="Accidents"):
+    return {
+        "labels": [str(label) for label in labels],
+        "datasets": [{"label": label_name, "data": [int(value) for value in values], **CHART_STYLE}],
+    }
+
+
+def serialize_counts_by_dimension(counts):
+    return {key: serialize_counts([r[0] for r in rows], [r[1] for r in rows]) for key, rows in counts.items()}
+
+
+def compact_payload(counts):
+    return {key: {"labels": [plain(label) for label, _ in rows], "counts": [int(count) for _, count in rows]}
+            for key, rows in counts.items()}
+
+
+def arrow_stream(results, batch=False):
+    # One long table (dimension, label, count); labels are text because a
+    # column can't mix the integer and weekday/season labels. Batch responses
+    # add a "filter" column indexing the request's filter list.
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise FormatUnavailable("arrow responses need pyarrow installed")
+    filters, dimensions, labels, values = [], [], [], []
+    for index, counts in enumerate(results):
+        for key, rows in counts.items():
+            for label, count in rows:
+                filters.append(index)
+                dimensions.append(key)
+                labels.append(str(plain(label)))
+                values.append(int(count))
+    columns = {"filter": pa.array(filters, pa.uint16())} if batch else {}
+    table = pa.table({
+        **columns,
+        "dimension": pa.array(dimensions).dictionary_encode(),
+        "label": pa.array(labels, pa.string()),
+        "count": pa.array(values, pa.uint32()),
+    })
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def packb(payload):
+    try:
+        import msgpack
+    except ImportError:
+        raise FormatUnavailable("msgpack responses need msgpack installed")
+    return msgpack.packb(payload)
+
+
+def dump_json(payload):
+    return json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()
+
+
+def json_response(payload):
+    # jsonify() without going through the app's JSON provider
+    return Response(dump_json(payload), mimetype="application/json")
+
+
+def encode(counts, name):
+    if name == "chartjs":
+        return dump_json(serialize_counts_by_dimension(counts))
+    if name == "compact":
+        return dump_json(compact_payload(counts))
+    if name == "msgpack":
+        return packb(compact_payload(counts))
+    return arrow_stream([counts])
+
+
+def encode_batch(filters, results, name):
+    # {"filters": [...], "results": [...]}: results[i] is what /api/analytics
+    # returns for filters[i] in the same format.
+    if name == "arrow":
+        return arrow_stream(results, batch=True)
+    payload = serialize_counts_by_dimension if name == "chartjs" else compact_payload
+    batch = {"filters": filters, "results": [payload(counts) for counts in results]}
+    return packb(batch) if name == "msgpack" else dump_json(batch)
+
+
+def encoded_response(encoder, name):
+    try:
+        body = encoder()
+    except FormatUnavailable as e:
+        return Response(json.dumps({"error": str(e)}), status=406, mimetype="application/json")
+    return Response(body, mimetype=MIMETYPES[name])
+
+
+def counts_response(counts, name):
+    return encoded_response(lambda: encode(counts, name), name)
+
+
+def batch_response(filters, results, name):
+    return encoded_response(lambda: encode_batch(filters, results, name), name)
+
+
+def brotli_module():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def compress(body, accept_encoding):
+    # Returns (body, encoding); brotli when the client takes it and the
+    # package is installed, gzip otherwise.
+    encodings = {part.split(";")[0].strip() for part in accept_encoding.split(",")}
+    brotli = brotli_module() if "br" in encodings else None
+    if brotli is not None:
+        return brotli.compress(body, quality=5), "br"
+    if "gzip" in encodings:
+        return gzip.compress(body, compresslevel=6), "gzip"
+    return body, None
+
+
+def compress_response(response):
+    # after_request hook for every API response
+    response.vary.update(["Accept", "Accept-Encoding"])
+    if (response.status_code != 200 or response.direct_passthrough or "Content-Encoding" in response.headers
+            or response.content_length is None or response.content_length < COMPRESS_MIN_BYTES):
+        return response
+    body, encoding = compress(response.get_data(), request.headers.get("Accept-Encoding", ""))
+    if encoding is None:
+        return response
+    response.set_data(body)
+    response.headers["Content-Encoding"] = encoding
+    # The same entity in another encoding: keep the tag but mark it weak so
+    # If-None-Match still matches it.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
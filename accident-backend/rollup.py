@@ -0,0 +1,249 @@
+import argparse
+import sqlite3
+import time
+
+from generation import bump_generation
+
+rollup_table = "accident_rollup"
+
+# Response key -> rollup column, in the order /api/analytics returns them
+ANALYTICS_DIMENSIONS = [
+    ("years", "year"),
+    ("months", "month"),
+    ("days", "day"),
+    ("hours", "hour"),
+    ("weekdays", "weekday"),
+    ("seasons", "season"),
+]
+
+SEASON_MONTHS = {
+    'Winter': [12, 1, 2],
+    'Spring': [3, 4, 5],
+    'Summer': [6, 7, 8],
+    'Autumn': [9, 10, 11]
+}
+MONTH_SEASONS = {month: season for season, months in SEASON_MONTHS.items() for month in months}
+WEEKDAYS = ['Sunday', 'Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday']
+
+# One row per (state, city, hour of a calendar day); weekday and season are
+# derived from the date so they ride along as plain attributes.
+ROLLUP_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS {rollup_table} (
+    state TEXT NOT NULL,
+    city TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    hour INTEGER NOT NULL,
+    weekday TEXT NOT NULL,
+    season TEXT NOT NULL,
+    accidents INTEGER NOT NULL,
+    PRIMARY KEY (state, city, year, month, day, hour)
+) WITHOUT ROWID
+"""
+
+_weekday_case = "CASE strftime('%w', start_time) " + " ".join(
+    f"WHEN '{i}' THEN '{name}'" for i, name in enumerate(WEEKDAYS)) + " END"
+_season_case = "CASE " + " ".join(
+    f"WHEN CAST(strftime('%m', start_time) AS INTEGER) IN ({', '.join(map(str, months))}) THEN '{season}'"
+    for season, months in SEASON_MONTHS.items()) + " END"
+
+# Calendar fields derived from the text start_time column, matching what
+# pandas' .dt accessors produce for the same rows.
+CALENDAR_SQL = {
+    "year": "CAST(strftime('%Y', start_time) AS INTEGER)",
+    "month": "CAST(strftime('%m', start_time) AS INTEGER)",
+    "day": "CAST(strftime('%d', start_time) AS INTEGER)",
+    "hour": "CAST(strftime('%H', start_time) AS INTEGER)",
+    "weekday": _weekday_case,
+    "season": _season_case,
+}
+# The same fields read from the stored generated columns on accidents
+STORED_CALENDAR = {col: col for col in CALENDAR_SQL}
+
+
+def rollup_select_sql(source, calendar=CALENDAR_SQL):
+    return f"""
+SELECT state, city,
+       {calendar['year']},
+       {calendar['month']},
+       {calendar['day']},
+       {calendar['hour']},
+       {calendar['weekday']},
+       {calendar['season']},
+       COUNT(*)
+FROM {source}
+WHERE state IS NOT NULL AND city IS NOT NULL AND {calendar['year']} IS NOT NULL
+GROUP BY 1, 2, 3, 4, 5, 6
+"""
+
+
+def rebuild_sql(calendar):
+    return f"""
+INSERT INTO {rollup_table} (state, city, year, month, day, hour, weekday, season, accidents)
+{rollup_select_sql("accidents", calendar)}
+"""
+
+
+def rollup_exists(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (rollup_table,)).fetchone()
+    return row is not None
+
+
+def ensure_rollup(conn):
+    # A freshly created rollup would only see rows inserted from now on, so
+    # seed it from whatever is already in `accidents`.
+    created = not rollup_exists(conn)
+    conn.execute(ROLLUP_SCHEMA)
+    if created:
+        rebuild_rollup(conn)
+    return created
+
+
+def rebuild_rollup(conn):
+    conn.execute(ROLLUP_SCHEMA)
+    conn.execute(f"DELETE FROM {rollup_table}")
+    columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(accidents)")}
+    if columns:
+        # Migrated tables already carry the calendar fields; skip re-parsing start_time
+        conn.execute(rebuild_sql(STORED_CALENDAR if "start_ts" in columns else CALENDAR_SQL))
+    bump_generation(conn)
+    conn.commit()
+    return conn.execute(f"SELECT COALESCE(SUM(accidents), 0) FROM {rollup_table}").fetchone()[0]
+
+
+def update_rollup(conn, source, calendar=CALENDAR_SQL):
+    # Fold rows staged in `source` (exactly the ones just inserted) into the
+    # rollup; the caller commits together with the insert so both stay in step.
+    cur = conn.execute(f"""
+        INSERT INTO {rollup_table} (state, city, year, month, day, hour, weekday, season, accidents)
+        {rollup_select_sql(source, calendar)}
+        ON CONFLICT (state, city, year, month, day, hour) DO UPDATE SET accidents = accidents + excluded.accidents
+    """)
+    return cur.rowcount
+
+
+_weekday_index = {name: i for i, name in enumerate(WEEKDAYS)}
+
+
+class DimensionCounts:
+    # One query_analytics() result being summed: fixed-size count lists for
+    # every dimension, fed per-day rollup rows and per-hour sums
+    def __init__(self):
+        self.years = {}
+        self.months, self.days, self.hours = [0] * 13, [0] * 32, [0] * 24
+        self.weekdays, self.seasons = [0] * len(WEEKDAYS), dict.fromkeys(SEASON_MONTHS, 0)
+
+    def add_day(self, y, m, d, weekday, s, count):
+        self.years[y] = self.years.get(y, 0) + count
+        self.months[m] += count
+        self.days[d] += count
+        self.weekdays[_weekday_index[weekday]] += count
+        self.seasons[s] += count
+
+    def result(self):
+        def present(counts):
+            return [(label, counts[label]) for label in range(len(counts)) if counts[label]]
+
+        # Labels ascending, as ORDER BY would give them; weekday and season names alphabetically
+        return {
+            "years": sorted(self.years.items()),
+            "months": present(self.months),
+            "days": present(self.days),
+            "hours": present(self.hours),
+            "weekdays": sorted((name, self.weekdays[i]) for name, i in _weekday_index.items() if self.weekdays[i]),
+            "seasons": sorted((name, count) for name, count in self.seasons.items() if count),
+        }
+
+
+def query_analytics(conn, state, city, year=None, month=None, day=None, season=None):
+    where, params = filter_where({"year": year, "month": month, "day": day, "season": season})
+    where_sql = " AND ".join(["state = ?", "city = ?"] + where)
+    params = [state, city] + params
+
+    # Two reads instead of one GROUP BY per dimension: a per-day aggregate in
+    # primary key order, folded into fixed-size count lists for every
+    # dimension but the hour, and one GROUP BY hour.
+    counts = DimensionCounts()
+    rows = conn.execute(
+        f"SELECT year, month, day, weekday, season, SUM(accidents) FROM {rollup_table} WHERE {where_sql} "
+        f"GROUP BY year, month, day", params)
+    for row in rows:
+        counts.add_day(*row)
+    for hour, count in conn.execute(
+            f"SELECT hour, SUM(accidents) FROM {rollup_table} WHERE {where_sql} GROUP BY hour", params):
+        counts.hours[hour] = count
+    return counts.result()
+
+
+FILTER_FIELDS = ("year", "month", "day", "season")
+
+
+def filter_where(f):
+    # WHERE terms and parameters for one filter tuple, in query_analytics() order
+    where, params = [], []
+    if f.get("season"):
+        where.append("season = ?")
+        params.append(f["season"])
+    for col in ("year", "month", "day"):
+        if f.get(col):
+            where.append(f"{col} = ?")
+            params.append(int(f[col]))
+    return where, params
+
+
+def query_analytics_matrix(conn, state, city, expand, **base):
+    # group_by x filter: the query_analytics() result for every value of
+    # `expand` under the base filter, e.g. expand="month" with year=2020
+    # gives all the monthly drill-downs of 2020 keyed by month. One per-day
+    # aggregate that follows the primary key order (no sort) gives every
+    # dimension but the hour. When `expand` is the next key column after
+    # the filtered ones (year; month within a year; day within a month), the
+    # hours are one index range read per value, as query_analytics() does;
+    # grouping the whole range by (expand, hour) would sort every row of it.
+    # Otherwise (season, or month across years) one GROUP BY covers them all.
+    where, params = filter_where(base)
+    where_sql = " AND ".join(["state = ?", "city = ?"] + where)
+    params = [state, city] + params
+    sums = {}
+    position = ("year", "month", "day", "weekday", "season").index(expand)
+
+    days = conn.execute(
+        f"SELECT year, month, day, weekday, season, SUM(accidents) FROM {rollup_table} WHERE {where_sql} "
+        f"GROUP BY year, month, day", params)
+    for row in days:
+        counts = sums.get(row[position])
+        if counts is None:
+            counts = sums[row[position]] = DimensionCounts()
+        counts.add_day(*row)
+    keyed = ("year", "month", "day")
+    if expand in keyed and all(base.get(col) for col in keyed[:keyed.index(expand)]):
+        for value, counts in sums.items():
+            hours = conn.execute(f"SELECT hour, SUM(accidents) FROM {rollup_table} WHERE {where_sql} AND {expand} = ? "
+                                 f"GROUP BY hour", params + [value])
+            for hour, count in hours:
+                counts.hours[hour] = count
+    else:
+        hours = conn.execute(
+            f"SELECT {expand}, hour, SUM(accidents) FROM {rollup_table} WHERE {where_sql} GROUP BY hour, {expand}", params)
+        for value, hour, count in hours:
+            sums[value].hours[hour] = count
+    return {value: sums[value].result() for value in sorted(sums)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the accident_rollup table used by /api/analytics")
+    parser.add_argument("--db", default="accidents.db")
+    parser.add_argument("--rebuild", action="store_true", help="recompute the rollup from the accidents table")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    if args.rebuild:
+        started = time.perf_counter()
+        total = rebuild_rollup(conn)
+        print(f"✅ Rollup rebuilt from {total} accidents in {time.perf_counter() - started:.1f}s")
+    else:
+        created = ensure_rollup(conn)
+        conn.commit()
+        print("✅ Rollup created." if created else "✅ Rollup already present.")
+    conn.close()
@@ -0,0 +1,289 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from generation import current_generation
+from rollup import ANALYTICS_DIMENSIONS, SEASON_MONTHS, WEEKDAYS
+
+# Columnar snapshot of accidents for the "snapshot" analytics backend. Each
+# city is a directory of .npy arrays sorted by time:
+#
+#   ts       int64   epoch seconds of start_time (as accidents.start_ts)
+#   year     uint16
+#   month, day, hour, weekday (0 = Sunday)   uint8
+#
+# The API opens them with mmap, so they live in the page cache rather than
+# in every worker. A year or year+month filter is a searchsorted slice of
+# the sorted timestamps (a view, no copy); day, season and month-without-
+# year become one boolean mask over that slice, and each histogram is an
+# np.bincount. manifest.json names each city's directory and the DB
+# generation the snapshot matches; a stale snapshot is not used.
+#
+# refresh_snapshot() reads only rows with a rowid above the last refresh
+# and rewrites just the cities they belong to, merging the new rows into
+# the existing arrays; etl.py runs it after every sync once the snapshot
+# has been built with `python snapshot.py`.
+
+manifest_name = "manifest.json"
+CALENDAR_DTYPES = {"year": np.uint16, "month": np.uint8, "day": np.uint8, "hour": np.uint8}
+COLUMNS = ["ts", *CALENDAR_DTYPES, "weekday"]
+FETCH_ROWS = 500_000
+# Alphabetical, the order every other backend returns weekday and season labels in
+_weekday_order = sorted(range(len(WEEKDAYS)), key=lambda i: WEEKDAYS[i])
+_seasons = sorted(SEASON_MONTHS)
+_season_of_month = np.zeros(13, dtype=np.uint8)
+for _i, _season in enumerate(_seasons):
+    _season_of_month[SEASON_MONTHS[_season]] = _i
+
+
+def snapshot_dir(db_path):
+    return os.environ.get("ANALYTICS_SNAPSHOT_DIR") or f"{db_path}.snapshot"
+
+
+def city_key(state, city):
+    return f"{state}/{city}"
+
+
+def load_manifest(path):
+    try:
+        with open(os.path.join(path, manifest_name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def snapshot_exists(path):
+    return os.path.exists(os.path.join(path, manifest_name))
+
+
+def read_city(conn, state, city, after_rowid, upto_rowid):
+    # Calendar arrays for the city's rows in (after_rowid, upto_rowid], unsorted
+    cur = conn.execute("""
+        SELECT start_ts, year, month, day, hour FROM accidents
+        WHERE state = ? AND city = ? AND year IS NOT NULL AND rowid > ? AND rowid <= ?
+    """, (state, city, after_rowid, upto_rowid))
+    chunks = []
+    while True:
+        rows = cur.fetchmany(FETCH_ROWS)
+        if not rows:
+            break
+        chunks.append(np.array(rows, dtype=np.int64).reshape(-1, 5))
+    data = np.concatenate(chunks) if chunks else np.empty((0, 5), dtype=np.int64)
+    ts = data[:, 0]
+    arrays = {"ts": ts.copy()}
+    for i, (col, dtype) in enumerate(CALENDAR_DTYPES.items(), start=1):
+        arrays[col] = data[:, i].astype(dtype)
+    # 1970-01-01 was a Thursday
+    arrays["weekday"] = ((ts // 86400 + 4) % 7).astype(np.uint8)
+    return arrays
+
+
+def sort_arrays(arrays):
+    order = np.argsort(arrays["ts"], kind="stable")
+    return {col: values[order] for col, values in arrays.items()}
+
+
+def write_city(path, state, city, arrays, generation):
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", f"{state}-{city}").strip("-")
+    digest = hashlib.sha1(city_key(state, city).encode()).hexdigest()[:8]
+    name = f"{slug}-{digest}-{generation}-{time.time_ns()}"
+    os.makedirs(os.path.join(path, name))
+    for col in COLUMNS:
+        np.save(os.path.join(path, name, f"{col}.npy"), arrays[col])
+    return name
+
+
+def open_city(path, name):
+    return {col: np.load(os.path.join(path, name, f"{col}.npy"), mmap_mode="r") for col in COLUMNS}
+
+
+def save_manifest(path, manifest):
+    tmp = os.path.join(path, manifest_name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(path, manifest_name))
+
+
+def refresh_snapshot(conn, path, log=print):
+    # Bring the snapshot at `path` up to date with the committed rows; builds
+    # it from scratch when there is none or the table was rebuilt underneath
+    # it (rowids went backwards or a city's row count doesn't add up).
+    os.makedirs(path, exist_ok=True)
+    generation = current_generation(conn)
+    manifest = load_manifest(path) or {"last_rowid": 0, "cities": {}}
+    # City directories the previous refresh replaced. A request that read the
+    # manifest before that refresh may still open them, so they are kept
+    # until this one has swapped the manifest again.
+    expired = manifest.pop("retired", [])
+    upto = conn.execute("SELECT COALESCE(MAX(rowid), 0) FROM accidents").fetchone()[0]
+    if upto < manifest["last_rowid"]:
+        manifest = {"last_rowid": 0, "cities": {}}
+    after = manifest["last_rowid"]
+    changed = conn.execute("""
+        SELECT DISTINCT state, city FROM accidents
+        WHERE rowid > ? AND rowid <= ? AND state IS NOT NULL AND city IS NOT NULL
+    """, (after, upto)).fetchall()
+    replaced, merged = [], 0
+    for state, city in changed:
+        key = city_key(state, city)
+        entry = manifest["cities"].get(key)
+        new = read_city(conn, state, city, after, upto)
+        expected = conn.execute("SELECT COUNT(*) FROM accidents WHERE state = ? AND city = ? AND year IS NOT NULL "
+                                "AND rowid <= ?", (state, city, upto)).fetchone()[0]
+        if entry and entry["rows"] + len(new["ts"]) == expected:
+            old = open_city(path, entry["dir"])
+            arrays = sort_arrays({col: np.concatenate([old[col], new[col]]) for col in COLUMNS})
+            merged += 1
+        else:
+            arrays = sort_arrays(read_city(conn, state, city, 0, upto))
+        if entry:
+            replaced.append(entry["dir"])
+        manifest["cities"][key] = {"state": state, "city": city, "rows": len(arrays["ts"]),
+                                   "dir": write_city(path, state, city, arrays, generation)}
+    manifest.update(last_rowid=upto, generation=generation, retired=replaced)
+    save_manifest(path, manifest)
+    # Readers that still map the old files keep them until they close
+    for name in expired:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+    log(f"📸 Snapshot at generation {generation}: {len(changed)} cities refreshed ({merged} merged incrementally)")
+    return len(changed)
+
+
+class Snapshot:
+    # The open arrays of one snapshot directory; reopened when the manifest changes
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.manifest = None
+        self.cities = {}
+
+    def current(self):
+        try:
+            stamp = os.stat(os.path.join(self.path, manifest_name)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self.lock:
+            if stamp != self.stamp:
+                self.manifest = load_manifest(self.path)
+                self.cities = {}
+                self.stamp = stamp
+            return self.manifest
+
+    def city(self, state, city):
+        with self.lock:
+            key = city_key(state, city)
+            if key not in self.cities:
+                entry = self.manifest["cities"].get(key)
+                self.cities[key] = open_city(self.path, entry["dir"]) if entry else None
+            return self.cities[key]
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(path):
+    with _snapshots_lock:
+        if path not in _snapshots:
+            _snapshots[path] = Snapshot(path)
+        return _snapshots[path]
+
+
+def epoch(year, month=1):
+    return int(np.datetime64(f"{year:04d}-{month:02d}", "s").astype(np.int64))
+
+
+def counts_of(values, mask=None, minlength=0):
+    # np.bincount over the rows where `mask` is set, passed as 0/1 weights
+    # so the (memory-mapped) column is never copied to apply the filter
+    if mask is None:
+        return np.bincount(values, minlength=minlength)
+    return np.bincount(values, weights=mask, minlength=minlength).astype(np.int64)
+
+
+def histogram(values, mask=None):
+    counts = counts_of(values, mask)
+    return [(int(v), int(counts[v])) for v in np.flatnonzero(counts)]
+
+
+def city_histograms(arrays, year=None, month=None, day=None, season=None):
+    # Same shape as rollup.query_analytics(): {key: [(label, count)]}
+    empty = {key: [] for key, _ in ANALYTICS_DIMENSIONS}
+    if arrays is None:
+        return empty
+    lo, hi = 0, len(arrays["ts"])
+    if year:
+        year = int(year)
+        if not 1 <= year <= 9998:
+            return empty
+        if month and 1 <= int(month) <= 12:
+            bounds = (epoch(year, int(month)), epoch(year + int(month) // 12, int(month) % 12 + 1))
+        else:
+            bounds = (epoch(year), epoch(year + 1))
+        lo, hi = np.searchsorted(arrays["ts"], bounds)
+    # Slices of the memmaps are views; the remaining filters become one
+    # shared mask that every histogram counts through
+    view = {col: values[lo:hi] for col, values in arrays.items()}
+    mask = None
+    filters = [("day", day)] if day else []
+    if month and not (year and 1 <= int(month) <= 12):
+        filters.append(("month", month))
+    for col, value in filters:
+        hit = view[col] == int(value) if int(value) < 256 else np.zeros(hi - lo, dtype=bool)
+        mask = hit if mask is None else mask & hit
+    if season:
+        months = SEASON_MONTHS.get(season, [])
+        hit = np.isin(view["month"], months)
+        mask = hit if mask is None else mask & hit
+    months = counts_of(view["month"], mask, minlength=13)
+    seasons = np.bincount(_season_of_month, weights=months[:13], minlength=len(_seasons))
+    weekdays = counts_of(view["weekday"], mask, minlength=7)
+    return {
+        "years": histogram(view["year"], mask),
+        "months": [(m, int(months[m])) for m in np.flatnonzero(months).tolist()],
+        "days": histogram(view["day"], mask),
+        "hours": histogram(view["hour"], mask),
+        "weekdays": [(WEEKDAYS[i], int(weekdays[i])) for i in _weekday_order if weekdays[i]],
+        "seasons": [(name, int(seasons[i])) for i, name in enumerate(_seasons) if seasons[i]],
+    }
+
+
+def query_snapshot(path, generation, state, city, year=None, month=None, day=None, season=None):
+    # None when there is no snapshot or it is behind the DB generation, so
+    # the caller can answer from another backend
+    snapshot = get_snapshot(path)
+    manifest = snapshot.current()
+    if manifest is None or manifest.get("generation") != generation:
+        return None
+    try:
+        arrays = snapshot.city(state, city)
+    except OSError:
+        # Its directory was removed two refreshes after this manifest was read
+        return None
+    return city_histograms(arrays, year, month, day, season)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or refresh the memory-mapped analytics snapshot")
+    parser.add_argument("--db", default="accidents.db")
+    parser.add_argument("--out", help="snapshot directory; default ANALYTICS_SNAPSHOT_DIR or <db>.snapshot")
+    parser.add_argument("--rebuild", action="store_true", help="discard the existing snapshot first")
+    args = parser.parse_args()
+
+    out = args.out or snapshot_dir(args.db)
+    if args.rebuild and os.path.isdir(out):
+        shutil.rmtree(out)
+    conn = sqlite3.connect(args.db)
+    started = time.perf_counter()
+    refresh_snapshot(conn, out)
+    conn.close()
+    print(f"✅ Snapshot written to {out} in {time.perf_counter() - started:.1f}s")
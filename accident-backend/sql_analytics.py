@@ -0,0 +1,56 @@
+from rollup import ANALYTICS_DIMENSIONS, CALENDAR_SQL, SEASON_MONTHS, STORED_CALENDAR
+
+# Migrated databases carry precomputed, indexed calendar columns; older ones
+# fall back to deriving them from start_time on the fly.
+
+
+def calendar_fields(conn):
+    columns = {row[1] for row in conn.execute("PRAGMA table_xinfo(accidents)")}
+    return STORED_CALENDAR if "start_ts" in columns else CALENDAR_SQL
+
+
+def build_filters(calendar, state, city, year=None, month=None, day=None, season=None):
+    where = ["state = ?", "city = ?", f"{calendar['year']} IS NOT NULL"]
+    params = [state, city]
+    if season:
+        months = SEASON_MONTHS.get(season, [])
+        where.append(f"{calendar['month']} IN ({', '.join('?' * len(months)) or 'NULL'})")
+        params.extend(months)
+    if year:
+        where.append(f"{calendar['year']} = ?")
+        params.append(int(year))
+    if month:
+        where.append(f"{calendar['month']} = ?")
+        params.append(int(month))
+    if day:
+        where.append(f"{calendar['day']} = ?")
+        params.append(int(day))
+    return " AND ".join(where), params
+
+
+def build_analytics_query(calendar, state, city, year=None, month=None, day=None, season=None):
+    # Group the filtered rows once at hour granularity, then roll that small
+    # intermediate up along each dimension. SQLite materialises a CTE that is
+    # referenced more than once, so the city is only scanned a single time.
+    where_sql, params = build_filters(calendar, state, city, year, month, day, season)
+    fields = ", ".join(f"{calendar[col]} AS {col}" for _, col in ANALYTICS_DIMENSIONS)
+    rollups = " UNION ALL ".join(
+        f"SELECT '{key}', {col}, SUM(n) FROM hourly GROUP BY {col}" for key, col in ANALYTICS_DIMENSIONS)
+    sql = f"""
+    WITH hourly AS (
+        SELECT year, month, day, hour, weekday, season, COUNT(*) AS n
+        FROM (SELECT {fields} FROM accidents WHERE {where_sql})
+        GROUP BY year, month, day, hour
+    )
+    {rollups}
+    ORDER BY 1, 2
+    """
+    return sql, params
+
+
+def query_analytics(conn, state, city, year=None, month=None, day=None, season=None):
+    sql, params = build_analytics_query(calendar_fields(conn), state, city, year, month, day, season)
+    result = {key: [] for key, _ in ANALYTICS_DIMENSIONS}
+    for key, label, count in conn.execute(sql, params):
+        result[key].append((label, count))
+    return result
@@ -0,0 +1,213 @@
+import argparse
+import re
+import sqlite3
+import time
+
+from generation import bump_generation
+from rollup import CALENDAR_SQL, SEASON_MONTHS, STORED_CALENDAR
+
+street_table = "streets"
+alias_table = "street_aliases"
+street_rollup_table = "street_rollup"
+street_totals_table = "street_totals"
+
+# The sources spell one street many ways ("Main Street", " main st. ",
+# "MAIN ST"). Each spelling seen at ingest is mapped once, through
+# street_key(), to an integer id in the streets dictionary; accidents carry
+# that id and street_rollup keeps per-(city, street, month) counts for
+# /api/streets, with all-time totals per (city, street) in street_totals,
+# indexed by count so the city-wide top streets are an index range read.
+STREET_SCHEMA = [
+    f"CREATE TABLE IF NOT EXISTS {street_table} (street_id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE)",
+    f"CREATE TABLE IF NOT EXISTS {alias_table} (raw TEXT PRIMARY KEY, street_id INTEGER NOT NULL) WITHOUT ROWID",
+    f"""CREATE TABLE IF NOT EXISTS {street_rollup_table} (
+    state TEXT NOT NULL,
+    city TEXT NOT NULL,
+    year INTEGER NOT NULL,
+    month INTEGER NOT NULL,
+    street_id INTEGER NOT NULL,
+    accidents INTEGER NOT NULL,
+    PRIMARY KEY (state, city, year, month, street_id)
+) WITHOUT ROWID""",
+    f"""CREATE TABLE IF NOT EXISTS {street_totals_table} (
+    state TEXT NOT NULL,
+    city TEXT NOT NULL,
+    street_id INTEGER NOT NULL,
+    accidents INTEGER NOT NULL,
+    PRIMARY KEY (state, city, street_id)
+) WITHOUT ROWID""",
+    f"CREATE INDEX IF NOT EXISTS idx_street_totals_rank ON {street_totals_table} (state, city, accidents)",
+]
+
+# USPS-style abbreviations, applied to every word of the name
+STREET_WORDS = {
+    "STREET": "ST", "AVENUE": "AVE", "AV": "AVE", "ROAD": "RD", "BOULEVARD": "BLVD", "DRIVE": "DR",
+    "LANE": "LN", "PLACE": "PL", "COURT": "CT", "PARKWAY": "PKWY", "HIGHWAY": "HWY", "EXPRESSWAY": "EXPY",
+    "TERRACE": "TER", "CIRCLE": "CIR", "SQUARE": "SQ", "TRAIL": "TRL",
+    "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W",
+}
+_punctuation = re.compile(r"[.,;'\"]")
+
+
+def street_key(raw):
+    # Canonical name for one spelling, or None when nothing is left
+    words = _punctuation.sub(" ", str(raw)).upper().split()
+    return " ".join(STREET_WORDS.get(word, word) for word in words) or None
+
+
+def ensure_streets(conn):
+    for ddl in STREET_SCHEMA:
+        conn.execute(ddl)
+
+
+def add_aliases(conn, raws):
+    names = {raw: street_key(raw) for raw in raws}
+    conn.executemany(f"INSERT OR IGNORE INTO {street_table} (name) VALUES (?)",
+                     [(name,) for name in sorted(set(names.values()) - {None})])
+    conn.executemany(f"INSERT OR IGNORE INTO {alias_table} (raw, street_id) "
+                     f"SELECT ?, street_id FROM {street_table} WHERE name = ?",
+                     [(raw, name) for raw, name in names.items() if name])
+    return len(names)
+
+
+def assign_street_ids(conn, source):
+    # Map the spellings in `source` that haven't been seen before
+    rows = conn.execute(f"SELECT DISTINCT street FROM {source} WHERE street IS NOT NULL "
+                        f"AND street NOT IN (SELECT raw FROM {alias_table})")
+    return add_aliases(conn, [raw for (raw,) in rows])
+
+
+def street_ids(conn, raws, known):
+    # Extends `known` (raw spelling -> street_id) with `raws`, mapping any
+    # that are new; for loaders that write street_id themselves.
+    new = [raw for raw in raws if raw not in known]
+    if new:
+        add_aliases(conn, new)
+        known.update(conn.execute(f"SELECT raw, street_id FROM {alias_table}"))
+    return known
+
+
+def add_street_counts(conn, source, calendar):
+    # Count the rows of `source`, which has a street_id column, into
+    # street_rollup and street_totals
+    cur = conn.execute(f"""
+        INSERT INTO {street_rollup_table} (state, city, year, month, street_id, accidents)
+        SELECT state, city, {calendar['year']}, {calendar['month']}, street_id, COUNT(*)
+        FROM {source}
+        WHERE state IS NOT NULL AND city IS NOT NULL AND {calendar['year']} IS NOT NULL AND street_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+        ON CONFLICT (state, city, year, month, street_id) DO UPDATE SET accidents = accidents + excluded.accidents
+    """)
+    conn.execute(f"""
+        INSERT INTO {street_totals_table} (state, city, street_id, accidents)
+        SELECT state, city, street_id, COUNT(*)
+        FROM {source}
+        WHERE state IS NOT NULL AND city IS NOT NULL AND {calendar['year']} IS NOT NULL AND street_id IS NOT NULL
+        GROUP BY 1, 2, 3
+        ON CONFLICT (state, city, street_id) DO UPDATE SET accidents = accidents + excluded.accidents
+    """)
+    return cur.rowcount
+
+
+def update_street_rollup(conn, source):
+    # Fold the staged rows (the ones just inserted) into street_rollup; the
+    # caller commits with the insert, as with update_rollup().
+    return add_street_counts(conn, f"{source} JOIN {alias_table} a ON a.raw = street", CALENDAR_SQL)
+
+
+def street_index_exists(conn):
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (street_rollup_table,)).fetchone()
+    return row is not None
+
+
+def rebuild_streets(conn, batch_size=50_000, log=print):
+    # Map every spelling in accidents, fill accidents.street_id one rowid
+    # range that still lacks one per commit, then recount street_rollup. Used
+    # by the migration and after bulk loads, which insert without going
+    # through write_accidents().
+    ensure_streets(conn)
+    mapped = assign_street_ids(conn, "accidents")
+    conn.commit()
+    last_rowid, filled = 0, 0
+    while True:
+        upper = conn.execute("SELECT MAX(rowid) FROM (SELECT rowid FROM accidents WHERE rowid > ? ORDER BY rowid LIMIT ?)",
+                             (last_rowid, batch_size)).fetchone()[0]
+        if upper is None:
+            break
+        cur = conn.execute(f"""
+            UPDATE accidents SET street_id = (SELECT street_id FROM {alias_table} WHERE raw = accidents.street)
+            WHERE rowid > ? AND rowid <= ? AND street_id IS NULL AND street IN (SELECT raw FROM {alias_table})
+        """, (last_rowid, upper))
+        filled += cur.rowcount
+        last_rowid = upper
+        conn.commit()
+    conn.execute(f"DELETE FROM {street_rollup_table}")
+    conn.execute(f"""
+        INSERT INTO {street_rollup_table} (state, city, year, month, street_id, accidents)
+        SELECT state, city, year, month, street_id, COUNT(*) FROM accidents
+        WHERE state IS NOT NULL AND city IS NOT NULL AND year IS NOT NULL AND street_id IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+    conn.execute(f"DELETE FROM {street_totals_table}")
+    conn.execute(f"""
+        INSERT INTO {street_totals_table} (state, city, street_id, accidents)
+        SELECT state, city, street_id, SUM(accidents) FROM {street_rollup_table} GROUP BY 1, 2, 3
+    """)
+    bump_generation(conn)
+    conn.commit()
+    log(f"🛣️ {mapped} new street spellings mapped, {filled} accidents given a street id")
+    return filled
+
+
+def top_streets(conn, state, city, limit=10, year=None, month=None, day=None, season=None):
+    # [(name, accidents)] for the `limit` streets with the most accidents
+    # under the drill-down filter. City-wide reads street_totals in count
+    # order and year/month/season sum street_rollup; a day is below its
+    # grain, so that case counts the day's accidents via the (state, city,
+    # year, month, day) index instead. A database without the street index
+    # yet gets the raw spellings counted, with the calendar fields derived
+    # from start_time since it may predate the stored columns too.
+    indexed = street_index_exists(conn)
+    calendar = STORED_CALENDAR if indexed else CALENDAR_SQL
+    where = ["state = ?", "city = ?", f"{calendar['year']} IS NOT NULL"]
+    params = [state, city]
+    if season:
+        months = SEASON_MONTHS.get(season, [])
+        where.append(f"{calendar['month']} IN ({', '.join('?' * len(months))})" if months else "0")
+        params += months
+    for col, value in (("year", year), ("month", month), ("day", day)):
+        if value:
+            where.append(f"{calendar[col]} = ?")
+            params.append(int(value))
+    if not indexed:
+        source, name, group, total = "accidents", "street", "street", "COUNT(*)"
+        where.append("street IS NOT NULL")
+    elif day:
+        source, name, group, total = f"accidents JOIN {street_table} USING (street_id)", "name", "street_id", "COUNT(*)"
+    elif not (season or year or month):
+        rows = conn.execute(f"""
+            SELECT name, accidents FROM {street_totals_table} JOIN {street_table} USING (street_id)
+            WHERE state = ? AND city = ? ORDER BY accidents DESC, name LIMIT ?
+        """, params + [int(limit)])
+        return rows.fetchall()
+    else:
+        source, name, group, total = (f"{street_rollup_table} JOIN {street_table} USING (street_id)", "name", "street_id",
+                                      "SUM(accidents)")
+    rows = conn.execute(f"""
+        SELECT {name}, {total} AS n FROM {source}
+        WHERE {' AND '.join(where)} GROUP BY {group} ORDER BY n DESC, {name} LIMIT ?
+    """, params + [int(limit)])
+    return rows.fetchall()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the street dictionary and street_rollup from accidents")
+    parser.add_argument("--db", default="accidents.db")
+    parser.add_argument("--batch-size", type=int, default=50_000)
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.db)
+    started = time.perf_counter()
+    rebuild_streets(conn, args.batch_size)
+    conn.close()
+    print(f"✅ Street index rebuilt in {time.perf_counter() - started:.1f}s")
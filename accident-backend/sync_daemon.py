@@ -0,0 +1,127 @@
+import argparse
+import random
+import signal
+import threading
+import time
+
+import pandas as pd
+
+import etl
+from fetch_engine import make_session
+
+# Resident sync process: the long-running alternative to starting
+# realtime_sync.py (or austin_sync.py, chicago.py, ...) from cron. It keeps one
+# requests session, whose keep-alive connections stay open to each portal,
+# and one SQLite write connection open across polls. So a poll that finds
+# nothing new costs a single HTTP round trip rather than an interpreter,
+# pandas import and migration check.
+#
+# Each source is polled every Source.poll_seconds (or --interval), spread by
+# up to --jitter of that so sources drift apart instead of firing together.
+# After a failed poll the wait doubles, up to --max-backoff. Sources that
+# fall due together are fetched concurrently by the fetch engine. Every
+# committed batch publishes change events (see changes.py) that /api/stream
+# pushes to the dashboard.
+
+
+class Schedule:
+    # When each source is next due, on the time.monotonic() clock
+    def __init__(self, intervals, jitter=0.1, max_backoff=3600, rng=None):
+        self.intervals = intervals
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.rng = rng or random.Random()
+        self.failures = dict.fromkeys(intervals, 0)
+        now = time.monotonic()
+        self.due_at = dict.fromkeys(intervals, now)
+
+    def delay(self, name):
+        interval = self.intervals[name]
+        wait = min(interval * 2 ** self.failures[name], max(self.max_backoff, interval))
+        return wait * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def due(self, now):
+        return [name for name, at in self.due_at.items() if at <= now]
+
+    def wait_seconds(self, now):
+        return max(min(self.due_at.values()) - now, 0.0)
+
+    def done(self, name, ok, now):
+        self.failures[name] = 0 if ok else self.failures[name] + 1
+        self.due_at[name] = now + self.delay(name)
+
+
+def run_daemon(cities=None, since="2025-01-01", db=etl.db_path, interval=None, jitter=0.1, max_backoff=3600,
+               max_workers=4, page_size=1000, max_pages=100, prefetch=4, registry=None, once=False, stop=None):
+    # Polls until `stop` is set (SIGTERM / Ctrl-C from the command line), or
+    # after one poll of every source with once=True. Returns the polls run.
+    since = pd.Timestamp(since).isoformat()
+    registry = registry or etl.SOURCES
+    sources = {name: registry[name] for name in (cities or registry)}
+    schedule = Schedule({name: interval or source.poll_seconds for name, source in sources.items()}, jitter,
+                        max_backoff)
+    stop = stop or threading.Event()
+    conn = etl.open_db(db)
+    session = make_session(pool_size=max_workers * 2)
+    polls = 0
+    print(f"🛰️ Sync daemon polling {', '.join(sources)} into {db}")
+    try:
+        while not stop.is_set():
+            due = schedule.due(time.monotonic())
+            if not due:
+                stop.wait(schedule.wait_seconds(time.monotonic()))
+                continue
+            try:
+                # Per-source lines only for polls that found something
+                contexts, timings = etl.sync_sources(conn, {name: sources[name] for name in due}, since,
+                                                     session=session, max_workers=max_workers,
+                                                     page_size=page_size, max_pages=max_pages, prefetch=prefetch,
+                                                     log=lambda message: None)
+                errors = {name: timings[name]["error"] for name in due}
+                for name, ctx in contexts.items():
+                    if ctx.inserted:
+                        print(f"✅ {name}: {ctx.inserted} rows inserted in {timings[name]['wall_s']:.2f}s")
+                if any(ctx.inserted for ctx in contexts.values()):
+                    etl.refresh_stores(conn, db)
+            except Exception as e:
+                # e.g. the database locked past the busy timeout; retried with backoff
+                conn.rollback()
+                errors = dict.fromkeys(due, e)
+            now = time.monotonic()
+            for name in due:
+                schedule.done(name, errors[name] is None, now)
+                if errors[name] is not None:
+                    print(f"⚠️ {name} failed ({errors[name]}); next poll in {schedule.due_at[name] - now:.0f}s")
+            polls += len(due)
+            if once and polls >= len(sources):
+                break
+    finally:
+        session.close()
+        conn.close()
+    print(f"🛑 Sync daemon stopped after {polls} polls")
+    return polls
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep polling the configured Socrata sources")
+    parser.add_argument("--city", action="append", choices=sorted(etl.SOURCES), help="repeat for several; default all")
+    parser.add_argument("--since", default="2025-01-01", help="only rows at or after this time")
+    parser.add_argument("--db", default=etl.db_path)
+    parser.add_argument("--interval", type=float, help="seconds between polls of each source; default per source")
+    parser.add_argument("--jitter", type=float, default=0.1, help="random spread of each wait (0.1 = +/-10%%)")
+    parser.add_argument("--max-backoff", type=float, default=3600, help="longest wait after repeated failures")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--max-pages", type=int, default=100)
+    parser.add_argument("--once", action="store_true", help="poll every source once and exit")
+    args = parser.parse_args(argv)
+
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda signum, frame: stop.set())
+    return run_daemon(args.city, args.since, args.db, args.interval, args.jitter, args.max_backoff, args.workers,
+                      args.page_size, args.max_pages, once=args.once, stop=stop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from migrate import apply_migrations
+from streets import STREET_WORDS
+
+# Seeded fixture data shaped like the rows the sync scripts write, so
+# analytics can be exercised offline without the live Socrata APIs. The
+# skew follows the real feeds: a few cities hold most rows, crashes peak in
+# the rush hours, on weekdays and in winter and grow year on year, points
+# cluster around each city centre, and a Zipf-distributed set of streets is
+# spelled several ways.
+FIXTURE_CITIES = [
+    ("TX", "Austin"),
+    ("TX", "Houston"),
+    ("NY", "New York"),
+    ("MD", "Montgomery"),
+    ("IL", "Chicago"),
+]
+CITY_CENTRES = {"Austin": (30.27, -97.74), "Houston": (29.76, -95.37), "New York": (40.71, -74.01),
+                "Montgomery": (39.15, -77.2), "Chicago": (41.88, -87.63)}
+FIXTURE_STREETS = ["MAIN ST", "I-35", "BROADWAY", "LAMAR BLVD", "5TH AVE", "STATE ST", "OAK AVE", "ELM ST"]
+
+# Named row counts for --scale
+SCALES = {"10k": 10_000, "100k": 100_000, "1m": 1_000_000, "5m": 5_000_000, "10m": 10_000_000, "50m": 50_000_000}
+
+# Relative crash rates per hour of day, per weekday (Monday first) and per month
+HOUR_WEIGHTS = np.array([2, 1.5, 1.2, 1, 1, 1.5, 3, 6, 7, 5, 4, 4.5, 5, 5, 5.5, 6.5, 7.5, 8, 6, 4.5, 3.5, 3, 2.5, 2.2])
+WEEKDAY_WEIGHTS = np.array([1.0, 1.05, 1.05, 1.05, 1.15, 0.8, 0.7])
+MONTH_WEIGHTS = np.array([1.15, 1.1, 1.0, 0.95, 0.95, 0.9, 0.9, 0.95, 1.0, 1.05, 1.1, 1.2])
+
+STREET_VOCABULARY = 2000
+_LONG_WORDS = {short: long for long, short in STREET_WORDS.items() if len(long) > 2}
+_SUFFIXES = ["ST", "AVE", "RD", "BLVD", "DR", "LN", "PKWY", "HWY"]
+
+
+def scale_rows(scale):
+    # "1m" -> 1_000_000; plain integers pass through
+    return SCALES[scale] if scale in SCALES else int(scale)
+
+
+def street_spellings(vocabulary=STREET_VOCABULARY):
+    # (vocabulary, 3) names: each street as abbreviated upper case, spelled
+    # out, and lower case with a trailing period, as the sources mix them.
+    names = list(FIXTURE_STREETS)
+    i = 0
+    while len(names) < vocabulary:
+        names.append(f"{i // len(_SUFFIXES) + 1} {_SUFFIXES[i % len(_SUFFIXES)]}")
+        i += 1
+    spelled = [" ".join(_LONG_WORDS.get(word, word).title() for word in name.split()) for name in names]
+    return np.array([[name, long, long.lower() + "."] for name, long in zip(names, spelled)])
+
+
+_spellings = street_spellings()
+
+
+def calendar_weights(start, days):
+    dates = pd.date_range(start, periods=days, freq="D")
+    weights = WEEKDAY_WEIGHTS[dates.dayofweek] * MONTH_WEIGHTS[dates.month - 1] * np.linspace(0.8, 1.2, days)
+    return weights / weights.sum()
+
+
+def sample_times(rng, rows, start, days):
+    day = rng.choice(days, size=rows, p=calendar_weights(start, days))
+    hour = rng.choice(24, size=rows, p=HOUR_WEIGHTS / HOUR_WEIGHTS.sum())
+    seconds = day * 86400 + hour * 3600 + rng.integers(0, 3600, size=rows)
+    return pd.Timestamp(start) + pd.to_timedelta(seconds, unit="s")
+
+
+def sample_streets(rng, rows):
+    street = np.minimum(rng.zipf(1.4, size=rows), len(_spellings)) - 1
+    return _spellings[street, rng.integers(0, 3, size=rows)]
+
+
+def generate_accidents(rows, seed=0, start="2019-01-01", years=6, offset=0):
+    # `offset` numbers the ids, so chunks of one large set don't collide
+    rng = np.random.default_rng(seed)
+    # Skew rows towards the first cities so small and large cities both exist
+    weights = 1.0 / np.arange(1, len(FIXTURE_CITIES) + 1)
+    city_idx = rng.choice(len(FIXTURE_CITIES), size=rows, p=weights / weights.sum())
+    start_time = sample_times(rng, rows, start, max(1, int(years * 365)))
+    centres = np.array([CITY_CENTRES[city] for _, city in FIXTURE_CITIES]).reshape(-1, 2)
+    lat = (centres[city_idx, 0] + rng.normal(0, 0.12, size=rows)).round(6)
+    lng = (centres[city_idx, 1] + rng.normal(0, 0.12, size=rows)).round(6)
+    df = pd.DataFrame({
+        "id": [f"fx-{i}" for i in range(offset, offset + rows)],
+        "start_time": start_time,
+        "end_time": start_time,
+        "start_lat": lat,
+        "start_lng": lng,
+        "end_lat": lat,
+        "end_lng": lng,
+        "distance(mi)": 0.1,
+        "description": "Auto-Crash",
+        "street": sample_streets(rng, rows),
+        "city": np.array([city for _, city in FIXTURE_CITIES])[city_idx],
+        "state": np.array([state for state, _ in FIXTURE_CITIES])[city_idx],
+        "country": "US",
+        "timezone": "US/Central",
+        "severity": rng.choice([1, 2, 3, 4], size=rows, p=[0.05, 0.7, 0.2, 0.05]),
+    })
+    return df
+
+
+def generate_chunks(rows, seed=0, chunk_rows=500_000, **kwargs):
+    # The same rows as a sequence of frames; chunk i is seeded with
+    # (seed, i), so the data depends on seed and chunk_rows only.
+    for i, offset in enumerate(range(0, rows, chunk_rows)):
+        yield generate_accidents(min(chunk_rows, rows - offset), seed=[seed, i], offset=offset, **kwargs)
+
+
+def generate_socrata_records(source, rows, seed=0, start="2025-01-01", days=180, offset=0):
+    # JSON records as a Socrata resource returns them: every value a string,
+    # the point nested under `location`, plus the unrelated attributes real
+    # crash datasets carry.
+    rng = np.random.default_rng(seed)
+    times = sample_times(rng, rows, start, days)
+    stamps = times.strftime("%Y-%m-%dT%H:%M:%S.000")
+    lat, lng = CITY_CENTRES.get(source.city, (40.0, -90.0))
+    lat = (lat + rng.normal(0, 0.12, size=rows)).round(6).astype(str)
+    lng = (lng + rng.normal(0, 0.12, size=rows)).round(6).astype(str)
+    streets = sample_streets(rng, rows)
+    injured = rng.integers(0, 4, size=rows).astype(str)
+    street_field = source.street_fields[0]
+    records = []
+    for i in range(rows):
+        records.append({
+            source.date_field: stamps[i],
+            source.id_field: str(100000 + offset + i),
+            "latitude": lat[i],
+            "longitude": lng[i],
+            "location": {"latitude": lat[i], "longitude": lng[i], "human_address": '{"address": "", "city": ""}'},
+            street_field: streets[i],
+            "crash_sev_id": injured[i],
+            "number_of_persons_injured": injured[i],
+            "number_of_persons_killed": "0",
+            "contributing_factor_vehicle_1": "Unspecified",
+            "vehicle_type_code1": "Sedan",
+            "borough": "",
+            "zip_code": "10001",
+        })
+    return records
+
+
+def generate_socrata_pages(source, rows, page_size=1000, seed=0, **kwargs):
+    # Pages in the order a keyset sync reads them, oldest first
+    records = generate_socrata_records(source, rows, seed=seed, **kwargs)
+    records.sort(key=lambda r: (r[source.date_field], int(r[source.id_field])))
+    for offset in range(0, len(records), page_size):
+        yield records[offset:offset + page_size]
+
+
+def write_socrata_pages(out_dir, source, rows, page_size=1000, seed=0):
+    os.makedirs(out_dir, exist_ok=True)
+    pages = 0
+    for pages, page in enumerate(generate_socrata_pages(source, rows, page_size, seed), start=1):
+        with open(os.path.join(out_dir, f"page-{pages:05d}.json"), "w") as f:
+            json.dump(page, f)
+    return pages
+
+
+def write_fixture_db(db_path, rows, seed=0):
+    df = generate_accidents(rows, seed=seed)
+    conn = sqlite3.connect(db_path)
+    conn.execute("DROP TABLE IF EXISTS accidents")
+    conn.execute("PRAGMA user_version = 0")
+    apply_migrations(conn, log=lambda message: None)
+    df.to_sql("accidents", conn, if_exists="append", index=False)
+    conn.commit()
+    conn.close()
+    return df
+
+
+def write_scaled_db(db_path, rows, seed=0, chunk_rows=500_000, log=print):
+    # A fresh database of `rows` accidents through the csv_ingest --bulk
+    # insert path, chunk by chunk so memory stays flat up to the 50m scale,
+    # with the secondary indexes built once at the end.
+    import csv_ingest
+
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    conn = sqlite3.connect(db_path)
+    csv_ingest.start_bulk(conn, None, log=lambda message: None)
+    aliases = {}
+    written = 0
+    for chunk in generate_chunks(rows, seed, chunk_rows):
+        written += csv_ingest.insert_chunk(conn, chunk, aliases)
+        conn.commit()
+        log(f"➡️ {written}/{rows} synthetic rows written")
+    csv_ingest.finish_bulk(conn, None, log)
+    conn.close()
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic accidents database or Socrata pages")
+    parser.add_argument("--db", default="fixture_accidents.db")
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--scale", help=f"one of {', '.join(SCALES)} (or a row count); builds the rollups too")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-rows", type=int, default=500_000)
+    parser.add_argument("--pages", metavar="DIR", help="write Socrata-shaped JSON pages here instead of a DB")
+    parser.add_argument("--city", default="Austin", help="source whose field names the pages use")
+    parser.add_argument("--page-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    rows = scale_rows(args.scale) if args.scale else args.rows
+    started = time.perf_counter()
+    if args.pages:
+        import etl
+        pages = write_socrata_pages(args.pages, etl.SOURCES[args.city], rows, args.page_size, args.seed)
+        print(f"✅ Wrote {rows} synthetic {args.city} records as {pages} pages to {args.pages}")
+    elif args.scale:
+        write_scaled_db(args.db, rows, args.seed, args.chunk_rows)
+        print(f"✅ Wrote {rows} synthetic accidents to {args.db} in {time.perf_counter() - started:.1f}s")
+    else:
+        write_fixture_db(args.db, rows, args.seed)
+        print(f"✅ Wrote {rows} synthetic accidents to {args.db}")
@@ -0,0 +1,77 @@
+import pandas as pd
+
+from changes import record_changes
+from generation import bump_generation
+from geo import CELL_SQL, update_points
+from metrics import timed
+from migrate import BASE_COLUMNS, quote_ident
+from rollup import update_rollup
+from streets import alias_table, assign_street_ids, update_street_rollup
+
+staging_table = "temp.accidents_staging"
+
+INSERT_COLUMNS = [name for name, _ in BASE_COLUMNS]
+_column_list = ", ".join(quote_ident(name) for name in INSERT_COLUMNS)
+
+
+def ensure_staging(conn):
+    # Copy the column affinities from accidents so ids compare as TEXT there too
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {staging_table} AS SELECT {_column_list} FROM accidents WHERE 0")
+
+
+def to_rows(df):
+    # Plain Python values for sqlite3: timestamps as the same text to_sql
+    # writes, missing values as NULL.
+    out = pd.DataFrame(index=df.index)
+    for name in INSERT_COLUMNS:
+        col = df[name] if name in df.columns else pd.Series(None, index=df.index, dtype=object)
+        if pd.api.types.is_datetime64_any_dtype(col):
+            col = col.dt.strftime('%Y-%m-%d %H:%M:%S')
+        elif col.dtype == "float32":
+            # Widen compact coordinates without float32 noise (30.27 not 30.2700004)
+            col = col.astype("float64").round(6)
+        out[name] = col.astype(object).where(col.notna(), None)
+    return out.itertuples(index=False, name=None)
+
+
+def write_accidents(conn, df, seconds=None):
+    # Stage the batch, drop rows whose (city, id) is already stored (or
+    # repeated inside the batch), then move the rest across in one set-based
+    # insert. What is left in staging is exactly what was inserted, so the
+    # rollups, spatial index and change events are fed from it too. Returns
+    # (inserted, skipped).
+    # `seconds`, if given, collects time per step (to_rows, stage, dedupe,
+    # insert, rollups).
+    if df.empty:
+        return 0, 0
+    seconds = {} if seconds is None else seconds
+    ensure_staging(conn)
+    conn.execute(f"DELETE FROM {staging_table}")
+    with timed(seconds, "to_rows"):
+        rows = to_rows(df)
+    with timed(seconds, "stage"):
+        conn.executemany(f"INSERT INTO {staging_table} VALUES ({', '.join('?' * len(INSERT_COLUMNS))})", rows)
+    with timed(seconds, "dedupe"):
+        conn.execute(f"""
+            DELETE FROM {staging_table}
+            WHERE id IS NULL
+               OR rowid NOT IN (SELECT MIN(rowid) FROM {staging_table} GROUP BY city, id)
+               OR EXISTS (SELECT 1 FROM accidents a WHERE a.city = accidents_staging.city AND a.id = accidents_staging.id)
+        """)
+    with timed(seconds, "insert"):
+        assign_street_ids(conn, staging_table)
+        cur = conn.execute(f"""
+            INSERT INTO accidents ({_column_list}, street_id, cell)
+            SELECT {_column_list}, a.street_id, {CELL_SQL} FROM {staging_table} LEFT JOIN {alias_table} a ON a.raw = street
+        """)
+    inserted = cur.rowcount
+    with timed(seconds, "rollups"):
+        update_rollup(conn, staging_table)
+        update_street_rollup(conn, staging_table)
+        update_points(conn, staging_table)
+    if inserted:
+        bump_generation(conn)
+        # Published to /api/stream when the caller commits
+        record_changes(conn, staging_table)
+    conn.execute(f"DELETE FROM {staging_table}")
+    return inserted, len(df) - inserted
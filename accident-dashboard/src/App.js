@@ -1,4 +1,4 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
 import {
   Chart as ChartJS,
@@ -25,6 +25,34 @@ ChartJS.register(
   Legend
 );
 
+// The API sends compact { labels, counts } per dimension; styling lives here
+const CHART_STYLE = {
+  backgroundColor: 'rgba(75, 192, 192, 0.6)',
+  borderColor: 'rgba(75, 192, 192, 1)',
+  borderWidth: 1
+};
+
+const toChartData = ({ labels, counts }) => ({
+  labels: labels.map(String),
+  datasets: [{ label: 'Accidents', data: counts, ...CHART_STYLE }]
+});
+
+// Prefetched drill-downs are keyed by their /api/analytics parameters
+const analyticsKey = params => JSON.stringify(Object.entries(params).sort());
+
+// The level a click on the current charts drills into next
+const nextLevel = (year, month, day) => (day ? null : month ? 'day' : year ? 'month' : 'year');
+
+// Whether new rows with start_time in [change.first, change.last] can show
+// up in the charts of this drill-down; a season view is always refetched
+const touchesView = (change, year, month, day) => {
+  if (!year) return true;
+  const pad = n => String(n).padStart(2, '0');
+  const from = `${year}-${pad(month || 1)}-${pad(day || 1)}`;
+  const to = `${year}-${pad(month || 12)}-${pad(day || 31)} 99`;
+  return change.first <= to && change.last >= from;
+};
+
 const App = () => {
   const [states, setStates] = useState([]);
   const [cities, setCities] = useState([]);
@@ -35,28 +63,81 @@ const App = () => {
   const [selectedMonth, setSelectedMonth] = useState(null);
   const [selectedDay, setSelectedDay] = useState(null);
   const [selectedSeason, setSelectedSeason] = useState(null);
+  const prefetched = useRef(new Map());
+  // What is on screen, for the /api/stream listener set up once below
+  const view = useRef({});
+  view.current = {
+    states, cities, state: selectedState, city: selectedCity,
+    year: selectedYear, month: selectedMonth, day: selectedDay, season: selectedSeason
+  };
+
+  // Fetches the whole next drill-down level in one /api/analytics/batch call
+  // so the next click renders without a round trip.
+  const prefetchLevel = (params, expand) => {
+    axios.get('http://localhost:5000/api/analytics/batch', { params: { ...params, expand } })
+      .then(res => res.data.filters.forEach((filter, i) => {
+        prefetched.current.set(analyticsKey({ ...filter, state: params.state, city: params.city, format: 'compact' }),
+          res.data.results[i]);
+      }))
+      .catch(() => {});
+  };
 
   const fetchAnalytics = async (state, city, year, month, day, season) => {
-    const params = { state, city };
+    const params = { state, city, format: 'compact' };
     if (year) params.year = year;
     if (month) params.month = month;
     if (day) params.day = day;
     if (season) params.season = season;
 
-    const res = await axios.get('http://localhost:5000/api/analytics', { params });
-    setChartData(res.data);
+    const key = analyticsKey(params);
+    if (prefetched.current.has(key)) {
+      setChartData(prefetched.current.get(key));
+    } else {
+      const res = await axios.get('http://localhost:5000/api/analytics', { params });
+      setChartData(res.data);
+    }
+    const expand = nextLevel(year, month, day);
+    if (expand) prefetchLevel(params, expand);
   };
 
   useEffect(() => {
     axios.get('http://localhost:5000/api/states').then(res => setStates(res.data));
   }, []);
 
+  // The API pushes a change event for each state and city a sync commits
+  // rows to; refetch only the lists and charts it can have changed
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return undefined;
+    const stream = new EventSource('http://localhost:5000/api/stream');
+    stream.addEventListener('change', e => {
+      const change = JSON.parse(e.data);
+      const v = view.current;
+      if (!v.states.includes(change.state)) {
+        axios.get('http://localhost:5000/api/states').then(res => setStates(res.data));
+      }
+      if (change.state !== v.state) return;
+      if (!v.cities.includes(change.city)) {
+        axios.get(`http://localhost:5000/api/cities?state=${v.state}`).then(res => setCities(res.data));
+      }
+      if (change.city !== v.city) return;
+      prefetched.current.clear();
+      if (touchesView(change, v.year, v.month, v.day)) {
+        fetchAnalytics(v.state, v.city, v.year, v.month, v.day, v.season);
+      }
+    });
+    return () => stream.close();
+  }, []);
+
   useEffect(() => {
     if (selectedState) {
       axios.get(`http://localhost:5000/api/cities?state=${selectedState}`).then(res => setCities(res.data));
     }
   }, [selectedState]);
 
+  useEffect(() => {
+    prefetched.current.clear();
+  }, [selectedState, selectedCity]);
+
   useEffect(() => {
     if (selectedState && selectedCity) {
       fetchAnalytics(selectedState, selectedCity, selectedYear, selectedMonth, selectedDay, selectedSeason);
@@ -134,14 +215,14 @@ const App = () => {
         <>
           <h2>{selectedCity}, {selectedState}</h2>
 
-          {chartData.years && <><h3>Yearly Accidents</h3><Bar data={chartData.years} options={createOptions('Yearly', 'years')} /></>}
-          {selectedYear && chartData.months && <><h3>Monthly Accidents</h3><Bar data={chartData.months} options={createOptions('Monthly', 'months')} /></>}
-          {selectedMonth && chartData.days && <><h3>Daily Accidents</h3><Bar data={chartData.days} options={createOptions('Daily', 'days')} /></>}
-          {selectedDay && chartData.hours && <><h3>Hourly Accidents</h3><Line data={chartData.hours} options={createOptions('Hourly', 'hours')} /></>}
+          {chartData.years && <><h3>Yearly Accidents</h3><Bar data={toChartData(chartData.years)} options={createOptions('Yearly', 'years')} /></>}
+          {selectedYear && chartData.months && <><h3>Monthly Accidents</h3><Bar data={toChartData(chartData.months)} options={createOptions('Monthly', 'months')} /></>}
+          {selectedMonth && chartData.days && <><h3>Daily Accidents</h3><Bar data={toChartData(chartData.days)} options={createOptions('Daily', 'days')} /></>}
+          {selectedDay && chartData.hours && <><h3>Hourly Accidents</h3><Line data={toChartData(chartData.hours)} options={createOptions('Hourly', 'hours')} /></>}
 
           <h3>Seasonal Accidents</h3>
-          {chartData.seasons && <Bar data={chartData.seasons} options={createOptions('Seasonal', 'seasons')} />}
-          {selectedSeason && chartData.months && <><h3>Season Breakdown - Monthly</h3><Bar data={chartData.months} options={createOptions('Monthly', 'months')} /></>}
+          {chartData.seasons && <Bar data={toChartData(chartData.seasons)} options={createOptions('Seasonal', 'seasons')} />}
+          {selectedSeason && chartData.months && <><h3>Season Breakdown - Monthly</h3><Bar data={toChartData(chartData.months)} options={createOptions('Monthly', 'months')} /></>}
         </>
       )}
     </div>
@@ -1,20 +1,9 @@
-import pandas as pd
-from sqlalchemy import create_engine
+import os
+import sys
 
-print("Reading CSV...")
-df = pd.read_csv("cleaned_crash_data.csv")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "accident-backend"))
+import csv_ingest
 
-print("Connecting to DB...")
-engine = create_engine('sqlite:///accidents.db')
-
-# Break into chunks
-chunksize = 100_000
-total_rows = 0
-
-print("Writing to DB in chunks...")
-for i, chunk in enumerate(pd.read_csv("cleaned_crash_data.csv", chunksize=chunksize)):
-    chunk.to_sql('accidents', con=engine, if_exists='append', index=False)
-    total_rows += len(chunk)
-    print(f"✅ Loaded {total_rows} rows so far...")
-
-print("🎉 Done. All data written.")
+# Streams cleaned_crash_data.csv into accidents.db chunk by chunk; the
+# analytics rollup is kept up to date as each chunk is written.
+csv_ingest.main(sys.argv[1:])
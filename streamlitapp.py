@@ -1,88 +1,99 @@
+import os
+import sys
 
 import pandas as pd
 import streamlit as st
 import altair as alt
-from sqlalchemy import create_engine
 
-# Connect to SQLite database
-engine = create_engine('sqlite:///accidents.db')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "accident-backend"))
+import db
+import dashboard_queries
+import parquet_store
+
+DB_PATH = os.environ.get("ACCIDENTS_DB", "accidents.db")
+# ANALYTICS_BACKEND=parquet reads the city charts from the Parquet store, as the API does
+PARQUET_DIR = parquet_store.parquet_dir(DB_PATH) if os.environ.get("ANALYTICS_BACKEND") == "parquet" else None
+
+# Streamlit reruns this script on every widget interaction, so every query
+# below is a cached aggregate keyed on its parameters and the data version.
+# Entries expire after CACHE_TTL seconds, and sooner when the ETL writes:
+# the version (DB generation + latest etl_logs row) is re-read at most every
+# VERSION_TTL seconds, so a rerun in between does no DB work at all.
+CACHE_TTL = int(os.environ.get("STREAMLIT_CACHE_TTL", 600))
+VERSION_TTL = int(os.environ.get("STREAMLIT_VERSION_TTL", 30))
+
+# Response key -> chart column
+COLUMNS = {"years": "Year", "months": "Month", "hours": "Hour", "weekdays": "Weekday", "seasons": "Season"}
+
+
+@st.cache_data(ttl=VERSION_TTL)
+def data_version():
+    # Pooled read-only connection, so the dashboard never blocks a running sync
+    return dashboard_queries.data_version(db.connect(DB_PATH))
+
+
+@st.cache_data(ttl=CACHE_TTL)
+def load_states(version):
+    return dashboard_queries.states(db.connect(DB_PATH))
+
+
+@st.cache_data(ttl=CACHE_TTL)
+def load_cities(state, version):
+    return dashboard_queries.cities(db.connect(DB_PATH), state)
+
+
+@st.cache_data(ttl=CACHE_TTL)
+def load_counts(state, city, version):
+    counts = dashboard_queries.city_counts(db.connect(DB_PATH), state, city, parquet=PARQUET_DIR)
+    return {key: pd.DataFrame(counts[key], columns=[col, "count"]) for key, col in COLUMNS.items()}
+
+
+@st.cache_data(ttl=CACHE_TTL)
+def load_top_streets(state, city, version, limit=10):
+    return pd.DataFrame(dashboard_queries.city_top_streets(db.connect(DB_PATH), state, city, limit, parquet=PARQUET_DIR),
+                        columns=["Street", "count"])
+
+
+def trend_chart(summary, col, axis):
+    summary = summary.rename(columns={"count": "Accident_Count"})
+    return alt.Chart(summary).mark_line(point=True).encode(
+        x=alt.X(f'{col}:O', axis=axis),
+        y=alt.Y('Accident_Count', axis=alt.Axis(title='Accident Count', format='~s'))
+    ).properties(width=700, height=400)
+
+
+version = data_version()
 
 # Title
 st.title("US Accident Data Analysis (Optimized)")
 
 # Step 1: Get State list (only distinct states)
-state_query = "SELECT DISTINCT state FROM accidents WHERE state IS NOT NULL ORDER BY state"
-state_list = pd.read_sql(state_query, con=engine)['state'].tolist()
-selected_state = st.selectbox("Select a State", state_list)
+selected_state = st.selectbox("Select a State", load_states(version))
 
 # Step 2: Get City list for selected state
-city_query = f"SELECT DISTINCT city FROM accidents WHERE state = '{selected_state}' AND city IS NOT NULL ORDER BY city"
-city_list = pd.read_sql(city_query, con=engine)['city'].tolist()
-selected_city = st.selectbox("Select a City", city_list)
-
-# Step 3: Pull city-specific data (only necessary columns)
-data_query = f"""
-SELECT start_time, end_time, street
-FROM accidents
-WHERE state = '{selected_state}' AND city = '{selected_city}'
-"""
-city_data = pd.read_sql(data_query, con=engine, parse_dates=['start_time', 'end_time'])
-
-# Extract datetime components
-city_data['Year'] = city_data['start_time'].dt.year
-city_data['Month'] = city_data['start_time'].dt.month
-city_data['Day'] = city_data['start_time'].dt.day
-city_data['Hour'] = city_data['start_time'].dt.hour
-city_data['Weekday'] = city_data['start_time'].dt.day_name()
-
-# Add season
-def get_season(month):
-    return (
-        'Winter' if month in [12, 1, 2] else
-        'Spring' if month in [3, 4, 5] else
-        'Summer' if month in [6, 7, 8] else
-        'Autumn'
-    )
-
-city_data['Season'] = city_data['Month'].apply(get_season)
+selected_city = st.selectbox("Select a City", load_cities(selected_state, version))
+
+# Step 3: City aggregates, computed in SQL
+counts = load_counts(selected_state, selected_city, version)
 
 # Display Header
 st.subheader(f"Analytics for {selected_city}, {selected_state}")
 
 # Weekday analysis
-weekday_counts = city_data['Weekday'].value_counts().reset_index()
-weekday_counts.columns = ['Weekday', 'count']
-st.bar_chart(data=weekday_counts, x='Weekday', y='count', use_container_width=True)
+st.bar_chart(data=counts["weekdays"], x='Weekday', y='count', use_container_width=True)
 
 # Hourly analysis
-hourly_counts = city_data['Hour'].value_counts().sort_index().reset_index()
-hourly_counts.columns = ['Hour', 'count']
-st.line_chart(data=hourly_counts, x='Hour', y='count', use_container_width=True)
+st.line_chart(data=counts["hours"], x='Hour', y='count', use_container_width=True)
 
 # Street-level
-if 'street' in city_data.columns:
-    top_streets = city_data['street'].value_counts().head(10).reset_index()
-    top_streets.columns = ['Street', 'count']
-    st.write("Top 10 Streets with Most Accidents")
-    st.bar_chart(data=top_streets, x='Street', y='count', use_container_width=True)
+st.write("Top 10 Streets with Most Accidents")
+st.bar_chart(data=load_top_streets(selected_state, selected_city, version), x='Street', y='count', use_container_width=True)
 
 # Yearly trend
-yearly_summary = city_data.groupby('Year').size().reset_index(name='Accident_Count')
-chart = alt.Chart(yearly_summary).mark_line(point=True).encode(
-    x=alt.X('Year:O', axis=alt.Axis(title='Year', labelAngle=0)),
-    y=alt.Y('Accident_Count', axis=alt.Axis(title='Accident Count', format='~s'))
-).properties(width=700, height=400)
-st.altair_chart(chart, use_container_width=True)
+st.altair_chart(trend_chart(counts["years"], 'Year', alt.Axis(title='Year', labelAngle=0)), use_container_width=True)
 
 # Monthly trend
-monthly_summary = city_data.groupby('Month').size().reset_index(name='Accident_Count')
-chart_month = alt.Chart(monthly_summary).mark_line(point=True).encode(
-    x=alt.X('Month:O', axis=alt.Axis(title='Month')),
-    y=alt.Y('Accident_Count', axis=alt.Axis(title='Accident Count', format='~s'))
-).properties(width=700, height=400)
-st.altair_chart(chart_month, use_container_width=True)
+st.altair_chart(trend_chart(counts["months"], 'Month', alt.Axis(title='Month')), use_container_width=True)
 
 # Seasonal trend
-seasonal_summary = city_data['Season'].value_counts().reset_index()
-seasonal_summary.columns = ['Season', 'count']
-st.bar_chart(data=seasonal_summary, x='Season', y='count', use_container_width=True)
+st.bar_chart(data=counts["seasons"], x='Season', y='count', use_container_width=True)